@@ -0,0 +1,127 @@
+# python imports
+import time
+import atexit
+import typing
+import logging
+import datetime
+import threading
+
+# django imports
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+# app imports
+from domain.files.models import File
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .instrumentation import metrics
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+
+class AccessRecorder:
+    """
+    Counts File reads in memory and writes them with one UPDATE per flush instead of one write per request.
+    A flush is started on the first access after FILES_ACCESS_FLUSH_INTERVAL seconds or once
+    FILES_ACCESS_FLUSH_MAX_FILES distinct Files are pending, and at interpreter exit. It runs on a background
+    thread, the request that crosses the threshold does not wait for the UPDATE.
+    With FILES_ACCESS_LOG set every access is also appended to that file as "<epoch> <file id> <bytes>",
+    the input of the tiering simulator.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._events = []
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    @property
+    def flush_interval(self) -> float:
+        return getattr(settings, "FILES_ACCESS_FLUSH_INTERVAL", 30)
+
+    @property
+    def flush_max_files(self) -> int:
+        return getattr(settings, "FILES_ACCESS_FLUSH_MAX_FILES", 1000)
+
+    @property
+    def log_path(self) -> typing.Optional[str]:
+        return getattr(settings, "FILES_ACCESS_LOG", None)
+
+    def record(self, file_id, size: typing.Optional[int] = None, at: typing.Optional[float] = None):
+        at = at or time.time()
+        with self._lock:
+            count, last = self._pending.get(file_id, (0, 0))
+            self._pending[file_id] = (count + 1, max(last, at))
+            if self.log_path:
+                self._events.append("{:.3f} {} {}\n".format(at, file_id, size if size is not None else "-"))
+            due = not self._flushing and (
+                len(self._pending) >= self.flush_max_files
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if due:
+                self._flushing = True
+        metrics.inc("files_accesses_total")
+        if due:
+            threading.Thread(target=self._flush_in_background, name="files-access-flush", daemon=True).start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # the thread has its own database connection, it would stay open until the server restarts
+            connection.close()
+            with self._lock:
+                self._flushing = False
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            events, self._events = self._events, []
+            self._last_flush = time.monotonic()
+        if events and self.log_path:
+            try:
+                with open(self.log_path, "a") as access_log:
+                    access_log.writelines(events)
+            except OSError as e:
+                logger.warning("Access log {} could not be written - {}".format(self.log_path, e))
+        if not pending:
+            return 0
+
+        tz = datetime.timezone.utc if settings.USE_TZ else None
+        counts = Case(
+            *[When(id=file_id, then=Value(count)) for file_id, (count, _) in pending.items()],
+            output_field=IntegerField(),
+        )
+        accessed = Case(
+            *[
+                When(id=file_id, then=Value(datetime.datetime.fromtimestamp(last, tz=tz)))
+                for file_id, (_, last) in pending.items()
+            ],
+            output_field=DateTimeField(),
+        )
+        try:
+            File.objects.filter(id__in=list(pending)).update(
+                access_count=F("access_count") + counts,
+                last_accessed=Greatest(Coalesce("last_accessed", accessed), accessed),
+            )
+        except Exception as e:
+            # statistics are best effort, a lost flush must not fail a download
+            logger.warning("Access statistics of {} files could not be written - {}".format(len(pending), e))
+            return 0
+        metrics.inc("files_access_flushes_total")
+        return len(pending)
+
+
+access_recorder = AccessRecorder()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        access_recorder.flush()
+    except Exception:
+        pass
@@ -0,0 +1,157 @@
+# python imports
+import os
+import typing
+import tempfile
+import tarfile
+import zipfile
+from dataclasses import dataclass
+
+# django imports
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+# app imports
+from application.files.exceptions import FileUploadException
+
+CHUNK_SIZE = 64 * 1024
+# bytes of an extracted member kept in memory, the rest goes to a temporary file
+MEMBER_MAX_MEMORY = getattr(settings, "FILES_ARCHIVE_MEMBER_MAX_MEMORY", 1024 * 1024)
+ZIP_MIME_TYPES = {"application/zip"}
+TAR_MIME_TYPES = {
+    "application/x-tar",
+    "application/x-gtar",
+    "application/x-ustar",
+    "application/x-compressed",
+    "application/x-gzip",
+}
+ARCHIVE_MIME_TYPES = ZIP_MIME_TYPES | TAR_MIME_TYPES
+
+
+@dataclass(frozen=True)
+class ArchiveLimits:
+    max_members: int
+    max_member_bytes: int
+    max_total_bytes: int
+    # extracted bytes per archive byte
+    max_ratio: int
+
+    @classmethod
+    def from_settings(cls, max_member_bytes: int) -> "ArchiveLimits":
+        return cls(
+            max_members=getattr(settings, "FILES_ARCHIVE_MAX_MEMBERS", 10000),
+            max_member_bytes=max_member_bytes,
+            max_total_bytes=getattr(settings, "FILES_ARCHIVE_MAX_TOTAL_BYTES", 2 * 1000 * 1000 * 1000),
+            max_ratio=getattr(settings, "FILES_ARCHIVE_MAX_RATIO", 100),
+        )
+
+
+def _limit_exceeded(message: str):
+    return FileUploadException("archive-limit-exceeded", message)
+
+
+def _skip(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base or base.startswith("._") or name.startswith("__MACOSX/")
+
+
+class SpooledUploadedFile(UploadedFile):
+    """
+    Extracted archive member, kept in memory up to max_memory bytes and in a temporary file beyond
+    """
+
+    def __init__(self, name: str, content_type: typing.Optional[str], max_memory: int):
+        super().__init__(tempfile.SpooledTemporaryFile(max_size=max_memory), name, content_type, 0)
+
+
+def _extract_limited(src, max_bytes: int, name: str, content_type) -> SpooledUploadedFile:
+    """
+    Copies src into a spooled uploaded file without trusting the sizes the archive declares
+    """
+    base = os.path.basename(name)
+    member = SpooledUploadedFile(base, content_type(base), MEMBER_MAX_MEMORY)
+    try:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            member.size += len(chunk)
+            if member.size > max_bytes:
+                raise _limit_exceeded("Archive member too large - {}".format(name))
+            member.file.write(chunk)
+    except BaseException:
+        member.close()
+        raise
+    member.file.seek(0)
+    return member
+
+
+def _iter_zip(archive, limits: ArchiveLimits, content_type):
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise FileUploadException("file-upload-exception", "The archive can not be read")
+    infos = [info for info in zf.infolist() if not info.is_dir() and not _skip(info.filename)]
+    # the central directory allows to reject most bombs before anything is extracted
+    if len(infos) > limits.max_members:
+        raise _limit_exceeded("Too many archive members - {} > {}".format(len(infos), limits.max_members))
+    if sum(info.file_size for info in infos) > limits.max_total_bytes:
+        raise _limit_exceeded("Archive content too large")
+    for info in infos:
+        if info.file_size > limits.max_member_bytes:
+            raise _limit_exceeded("Archive member too large - {}".format(info.filename))
+        if info.file_size > limits.max_ratio * max(info.compress_size, 1):
+            raise _limit_exceeded("Archive member compression ratio too high - {}".format(info.filename))
+        try:
+            with zf.open(info) as src:
+                member = _extract_limited(src, limits.max_member_bytes, info.filename, content_type)
+        except (RuntimeError, zipfile.BadZipFile, NotImplementedError) as e:
+            raise FileUploadException(
+                "file-upload-exception", "Archive member can not be read - {}: {}".format(info.filename, e)
+            )
+        yield member
+
+
+def _iter_tar(archive, limits: ArchiveLimits, content_type):
+    members = 0
+    try:
+        # stream mode reads the (optionally compressed) archive front to back without seeking
+        with tarfile.open(fileobj=archive, mode="r|*") as tf:
+            for member in tf:
+                if not member.isfile() or _skip(member.name):
+                    continue
+                members += 1
+                if members > limits.max_members:
+                    raise _limit_exceeded("Too many archive members - more than {}".format(limits.max_members))
+                if member.size > limits.max_member_bytes:
+                    raise _limit_exceeded("Archive member too large - {}".format(member.name))
+                yield _extract_limited(tf.extractfile(member), member.size, member.name, content_type)
+    except tarfile.TarError as e:
+        raise FileUploadException("file-upload-exception", "The archive can not be read - {}".format(e))
+
+
+def iter_archive_members(
+    archive,
+    mime_type: str,
+    limits: ArchiveLimits,
+    content_type: typing.Callable[[str], typing.Optional[str]],
+) -> typing.Iterator[SpooledUploadedFile]:
+    """
+    Yields the regular files of a zip or (compressed) tar archive as uploaded files, one at a time.
+    The caller closes them, which removes their temporary files.
+    Member count, member size, total size and the overall compression ratio are enforced on the bytes
+    actually extracted, a violation raises FileUploadException.
+    """
+    if mime_type in ZIP_MIME_TYPES:
+        members = _iter_zip(archive, limits, content_type)
+    elif mime_type in TAR_MIME_TYPES:
+        members = _iter_tar(archive, limits, content_type)
+    else:
+        raise FileUploadException("file-upload-exception", "File is not an archive - {}".format(mime_type))
+
+    archive_size = max(getattr(archive, "size", 0) or 0, 1)
+    total = 0
+    archive.seek(0)
+    for member in members:
+        total += member.size
+        if total > limits.max_total_bytes:
+            raise _limit_exceeded("Archive content too large")
+        if total > limits.max_ratio * archive_size:
+            raise _limit_exceeded("Archive compression ratio too high")
+        yield member
@@ -0,0 +1,41 @@
+# python imports
+import typing
+
+# django imports
+from asgiref.sync import sync_to_async
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class AsyncStorage:
+    """
+    Awaitable facade over a django storage. Every blocking storage call runs in the default thread pool
+    (thread_sensitive=False), so the event loop is never blocked by a slow transfer.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def save(self, name: str, content) -> str:
+        return await sync_to_async(self.storage.save, thread_sensitive=False)(name, content)
+
+    async def open(self, name: str, mode: str = "rb"):
+        return await sync_to_async(self.storage.open, thread_sensitive=False)(name, mode)
+
+    async def delete(self, name: str):
+        await sync_to_async(self.storage.delete, thread_sensitive=False)(name)
+
+    async def exists(self, name: str) -> bool:
+        return await sync_to_async(self.storage.exists, thread_sensitive=False)(name)
+
+    async def iter_chunks(self, name: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.AsyncIterator[bytes]:
+        storage_file = await self.open(name)
+        read = sync_to_async(storage_file.read, thread_sensitive=False)
+        try:
+            while True:
+                chunk = await read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await sync_to_async(storage_file.close, thread_sensitive=False)()
@@ -0,0 +1,222 @@
+# python imports
+import os
+import time
+import typing
+import tarfile
+import zipfile
+import tempfile
+from collections import deque
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 64 * 1024
+# members of unknown size are spooled to disk above this size
+SPOOL_MAX_MEMORY = 1024 * 1024
+ZIP = "zip"
+TAR = "tar"
+ARCHIVE_FORMATS = {ZIP: "application/zip", TAR: "application/x-tar"}
+
+
+class BundleSizeMismatch(Exception):
+    """
+    A stored object is not as long as its File says, the tar header written for it would be wrong
+    """
+
+
+class BundleMember(typing.NamedTuple):
+    arcname: str
+    location: str
+    origin_name: str
+    content_encoding: typing.Optional[str]
+    # size of the member content, None when it is unknown
+    size: typing.Optional[int]
+    compressible: bool
+    modified_at: typing.Optional[float] = None
+
+
+def unique_archive_names(names: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Makes names usable as archive members: path separators are replaced and duplicates
+    get a counter the way file managers do ("a.csv", "a (1).csv", ...)
+    """
+    seen = set()
+    unique = []
+    for name in names:
+        name = name.replace("/", "_").replace("\\", "_") or "file"
+        candidate = name
+        root, ext = os.path.splitext(name)
+        counter = 1
+        while candidate in seen:
+            candidate = "{} ({}){}".format(root, counter, ext)
+            counter += 1
+        seen.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+class _StreamSink:
+    """
+    Write only stream that collects what the archive writers produce until it is drained
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _PrefetchedReader:
+    def __init__(self, first_chunk: bytes, reader):
+        self._first_chunk = first_chunk
+        self._reader = reader
+
+    def read(self, size: int = -1) -> bytes:
+        if self._first_chunk:
+            data, self._first_chunk = self._first_chunk, b""
+            if size is None or size < 0:
+                data += self._reader.read()
+            return data
+        return self._reader.read(size)
+
+    def close(self):
+        self._reader.close()
+
+
+def _prefetch(open_member, member: BundleMember):
+    reader = open_member(member)
+    # the first read starts the transfer, so it happens on the prefetch thread instead of the writer
+    return _PrefetchedReader(reader.read(CHUNK_SIZE), reader)
+
+
+def _iter_opened(members, open_member, prefetch: int):
+    """
+    Yields (member, reader) in order while up to prefetch members are opened ahead on a thread pool
+    """
+    members = iter(members)
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = deque()
+
+        def submit_next():
+            member = next(members, None)
+            if member is not None:
+                pending.append((member, executor.submit(_prefetch, open_member, member)))
+
+        for _ in range(prefetch):
+            submit_next()
+        try:
+            while pending:
+                member, future = pending.popleft()
+                submit_next()
+                yield member, future.result()
+        finally:
+            # a closed generator (client disconnect) leaves opened readers behind, they are closed once ready
+            for _, future in pending:
+                if not future.cancel():
+                    future.add_done_callback(_close_reader)
+
+
+def _close_reader(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    with suppress(Exception):
+        future.result().close()
+
+
+def _iter_zip(members, open_member, prefetch) -> typing.Iterator[bytes]:
+    sink = _StreamSink()
+    # the sink is not seekable so zipfile writes data descriptors and never seeks back
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for member, reader in _iter_opened(members, open_member, prefetch):
+            info = zipfile.ZipInfo(member.arcname, time.localtime(member.modified_at or time.time())[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if member.compressible else zipfile.ZIP_STORED
+            try:
+                with archive.open(info, mode="w", force_zip64=True) as dest:
+                    for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            finally:
+                reader.close()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _spool(reader) -> typing.Tuple[typing.IO[bytes], int]:
+    """
+    Copies a member of unknown size to a temporary file so its tar header can be written first
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+        spooled.write(chunk)
+        size += len(chunk)
+    spooled.seek(0)
+    return spooled, size
+
+
+def _iter_tar(members, open_member, prefetch) -> typing.Iterator[bytes]:
+    written = 0
+    for member, reader in _iter_opened(members, open_member, prefetch):
+        spooled = None
+        try:
+            if member.size is None:
+                spooled, size = _spool(reader)
+                source = spooled
+            else:
+                source, size = reader, member.size
+            info = tarfile.TarInfo(member.arcname)
+            info.size = size
+            info.mtime = int(member.modified_at or time.time())
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            yield header
+            written += len(header)
+            member_written = 0
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                member_written += len(chunk)
+                if member_written > size:
+                    break
+                yield chunk
+                written += len(chunk)
+            if member_written != size:
+                # the archive can not be fixed once the header is sent, the stream is aborted instead
+                raise BundleSizeMismatch(
+                    "{} is {} than the {} bytes of its File".format(
+                        member.location, "longer" if member_written > size else "shorter", size
+                    )
+                )
+            padding = -size % tarfile.BLOCKSIZE
+            yield tarfile.NUL * padding
+            written += padding
+        finally:
+            reader.close()
+            if spooled is not None:
+                spooled.close()
+    end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    written += len(end)
+    yield end + tarfile.NUL * (-written % tarfile.RECORDSIZE)
+
+
+def stream_archive(
+    members: typing.Iterable[BundleMember],
+    archive_format: str,
+    open_member: typing.Callable[[BundleMember], typing.Any],
+    prefetch: int = 4,
+) -> typing.Iterator[bytes]:
+    """
+    Streams a ZIP or TAR archive of members, holding at most prefetch open members at a time.
+    open_member returns a readable file for a member.
+    """
+    if archive_format == ZIP:
+        return _iter_zip(members, open_member, prefetch)
+    return _iter_tar(members, open_member, prefetch)
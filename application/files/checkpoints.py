@@ -0,0 +1,51 @@
+# python imports
+import os
+import threading
+import typing
+
+
+class FileCheckpoint:
+    """
+    Append-only checkpoint of processed entries, one per line, so that interrupted long running jobs can resume.
+    A missing path disables checkpointing.
+    """
+
+    def __init__(self, path: typing.Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as checkpoint_file:
+                self._done = {line.rstrip("\n") for line in checkpoint_file if line.strip()}
+
+    def __contains__(self, entry: str) -> bool:
+        return entry in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def mark_done(self, entries: typing.Iterable[str]):
+        entries = [entry for entry in entries if entry not in self._done]
+        if not entries:
+            return
+        with self._lock:
+            self._done.update(entries)
+            if self.path:
+                with open(self.path, "a") as checkpoint_file:
+                    checkpoint_file.write("".join("{}\n".format(entry) for entry in entries))
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+
+    def clear(self, prefix: str = ""):
+        """
+        Forgets the entries starting with prefix, once the job that wrote them completed a full pass
+        """
+        with self._lock:
+            self._done = {entry for entry in self._done if not entry.startswith(prefix)}
+            if self.path and os.path.exists(self.path):
+                tmp_path = "{}.tmp".format(self.path)
+                with open(tmp_path, "w") as checkpoint_file:
+                    checkpoint_file.write("".join("{}\n".format(entry) for entry in sorted(self._done)))
+                    checkpoint_file.flush()
+                    os.fsync(checkpoint_file.fileno())
+                os.replace(tmp_path, self.path)
@@ -0,0 +1,181 @@
+# python imports
+import zlib
+import typing
+import tempfile
+
+# django imports
+from django.conf import settings
+from django.core.files import File as DjangoFile
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+CHUNK_SIZE = 64 * 1024
+# compressed uploads are spooled in memory up to this size before they go to a temporary file
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+COMPRESSIBLE_MIME_TYPES = {
+    "application/json",
+    "application/x-javascript",
+    "application/postscript",
+    "application/rtf",
+    "application/x-sh",
+    "application/x-csh",
+    "application/x-tcl",
+    "application/x-tex",
+    "application/x-latex",
+    "image/svg+xml",
+    "message/rfc822",
+}
+
+
+def supported_encodings() -> typing.Tuple[str, ...]:
+    return (GZIP, ZSTD) if zstandard is not None else (GZIP,)
+
+
+def is_compressible(mime_type: str) -> bool:
+    return mime_type.startswith("text/") or mime_type in COMPRESSIBLE_MIME_TYPES
+
+
+def get_storage_encoding(mime_type: str, size: int) -> typing.Optional[str]:
+    """
+    Encoding a file with this mime type and size is stored with, None when it is stored raw.
+    Configured with FILES_COMPRESS_AT_REST ("gzip" or "zstd") and FILES_COMPRESS_MIN_BYTES.
+    """
+    encoding = getattr(settings, "FILES_COMPRESS_AT_REST", None)
+    if not encoding or encoding not in supported_encodings():
+        return None
+    if size < getattr(settings, "FILES_COMPRESS_MIN_BYTES", 1024) or not is_compressible(mime_type):
+        return None
+    return encoding
+
+
+def make_compressor(encoding: str):
+    if encoding == GZIP:
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor(level=3).compressobj()
+
+
+def make_decompressor(encoding: str):
+    if encoding == GZIP:
+        return zlib.decompressobj(31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def compress_file(file_obj, encoding: str) -> DjangoFile:
+    """
+    Compresses file_obj chunk by chunk into a spooled temporary file
+    """
+    compressor = make_compressor(encoding)
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    file_obj.seek(0)
+    for chunk in iter(lambda: file_obj.read(CHUNK_SIZE), b""):
+        spooled.write(compressor.compress(chunk))
+    spooled.write(compressor.flush())
+    file_obj.seek(0)
+    spooled.seek(0)
+    return DjangoFile(spooled, name=file_obj.name)
+
+
+def decompress_chunks(chunks: typing.Iterable[bytes], encoding: str) -> typing.Iterator[bytes]:
+    decompressor = make_decompressor(encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+async def adecompress_chunks(chunks: typing.AsyncIterable[bytes], encoding: str) -> typing.AsyncIterator[bytes]:
+    decompressor = make_decompressor(encoding)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def iter_file_chunks(file_obj, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+    try:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+class DecompressingReader:
+    """
+    Read only file object that decompresses a stored object on the fly.
+    size is the uncompressed size, django's File needs it to chunk the reader.
+    """
+
+    def __init__(self, raw, encoding: str, size: typing.Optional[int] = None):
+        self.raw = raw
+        self.size = size
+        self._chunks = decompress_chunks(iter(lambda: raw.read(CHUNK_SIZE), b""), encoding)
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) - self._offset < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self._offset:
+                # drop what was already read before the buffer grows
+                del self._buffer[:self._offset]
+                self._offset = 0
+            self._buffer += chunk
+        if size < 0:
+            end = len(self._buffer)
+        else:
+            end = min(self._offset + size, len(self._buffer))
+        data = bytes(self._buffer[self._offset:end])
+        self._offset = end
+        if self._offset == len(self._buffer):
+            self._buffer.clear()
+            self._offset = 0
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    @property
+    def closed(self) -> bool:
+        return self.raw.closed
+
+    def close(self):
+        self.raw.close()
+
+
+def accepts_encoding(accept_encoding: typing.Optional[str], encoding: str) -> bool:
+    """
+    Whether an Accept-Encoding header allows the given encoding (q=0 refuses it)
+    """
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
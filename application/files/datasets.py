@@ -0,0 +1,241 @@
+# python imports
+import io
+import csv
+import json
+import math
+import uuid
+import random
+import bisect
+import typing
+import logging
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+# django imports
+from django.core.files.base import ContentFile
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+# app imports
+from domain.files.models import File
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .instrumentation import metrics
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+# (extension, mime type, weight, median bytes, sigma of the log-normal size)
+DEFAULT_MIME_MIX = (
+    ("jpg", "image/jpeg", 30, 350000, 1.0),
+    ("png", "image/png", 15, 120000, 1.2),
+    ("pdf", "application/pdf", 20, 250000, 1.4),
+    ("csv", "text/csv", 10, 40000, 1.8),
+    ("json", "application/json", 8, 8000, 1.5),
+    ("txt", "text/plain", 7, 4000, 1.6),
+    ("zip", "application/zip", 5, 5000000, 1.5),
+    ("mp4", "video/mp4", 5, 40000000, 1.2),
+)
+NAME_WORDS = (
+    "invoice", "report", "scan", "contract", "receipt", "statement", "summary", "draft", "final", "budget",
+    "forecast", "audit", "payroll", "inventory", "shipment", "order", "quote", "claim", "policy", "memo",
+    "photo", "export", "backup", "notes", "slides", "minutes", "agenda", "plan", "review", "sample",
+)
+COLUMNS = (
+    "id", "uploader", "title", "description", "origin_name", "location", "status", "meta_data",
+    "idempotency_key", "last_accessed", "access_count", "storage_class", "created_at", "modified_at",
+)
+
+
+@dataclass
+class DatasetSpec:
+    """
+    Shape of a synthetic File catalog. Equal specs generate byte for byte equal datasets.
+    """
+
+    rows: int
+    uploaders: int = 1000
+    seed: int = 0
+    # zipf exponent of the files per uploader, 0 spreads them evenly
+    uploader_skew: float = 1.1
+    mime_mix: typing.Sequence[typing.Tuple[str, str, float, int, float]] = DEFAULT_MIME_MIX
+    max_size_bytes: int = 5 * 1000 ** 3
+    end: datetime.datetime = field(default_factory=lambda: timezone.now().replace(microsecond=0))
+    span_days: int = 3 * 365
+    # > 1 concentrates created_at towards end, the catalog grows over time
+    recency_bias: float = 2.0
+    deactivated_ratio: float = 0.05
+    accessed_ratio: float = 0.3
+
+
+class SyntheticFileGenerator:
+    """
+    Generates File rows for load tests and query plan checks from one seeded random generator:
+    uploaders follow a zipf distribution, mime types a weighted mix, sizes a log-normal distribution
+    per mime type and created_at is spread over span_days with a bias towards recent dates.
+    """
+
+    def __init__(self, spec: DatasetSpec):
+        self.spec = spec
+        seeded = random.Random(spec.seed)
+        self.uploader_ids = [uuid.UUID(int=seeded.getrandbits(128), version=4) for _ in range(spec.uploaders)]
+        self.uploader_weights = list(
+            self._cumulative([1 / (rank ** spec.uploader_skew) for rank in range(1, spec.uploaders + 1)])
+        )
+        self.mime_weights = list(self._cumulative([mime[2] for mime in spec.mime_mix]))
+
+    def _cumulative(self, weights):
+        total = 0.0
+        for weight in weights:
+            total += weight
+            yield total
+
+    def _pick(self, rng: random.Random, cumulative):
+        return bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+
+    def iter_rows(self) -> typing.Iterator[dict]:
+        spec = self.spec
+        rng = random.Random(spec.seed + 1)
+        span = datetime.timedelta(days=spec.span_days).total_seconds()
+        for i in range(spec.rows):
+            file_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+            uploader = self.uploader_ids[self._pick(rng, self.uploader_weights)]
+            extension, mime_type, _, median, sigma = spec.mime_mix[self._pick(rng, self.mime_weights)]
+            size = min(spec.max_size_bytes, max(1, int(rng.lognormvariate(math.log(median), sigma))))
+            created_at = spec.end - datetime.timedelta(seconds=span * (rng.random() ** spec.recency_bias))
+            modified_at = created_at + datetime.timedelta(seconds=int(rng.expovariate(1 / 3600.0)))
+            words = rng.sample(NAME_WORDS, 3)
+            meta_data = {"mime_type": mime_type, "filesize_in_bytes": size}
+            if mime_type.startswith("image/"):
+                meta_data["width"] = rng.choice((640, 1024, 1280, 1920, 3024, 4032))
+                meta_data["height"] = rng.choice((480, 768, 720, 1080, 3024, 3024))
+            accessed = rng.random() < spec.accessed_ratio
+            last_accessed = (
+                modified_at + (spec.end - modified_at) * rng.random() if accessed else None
+            )
+            yield {
+                "id": file_id,
+                "uploader": uploader,
+                "title": "{} {}".format(words[0], words[1]),
+                "description": "{} number {}".format(words[2], i),
+                "origin_name": "{}_{}.{}".format(words[0], i, extension),
+                "location": "synthetic/{}/{}".format(uploader.hex, file_id.hex),
+                "status": File.DEACTIVATED_STATUS if rng.random() < spec.deactivated_ratio else File.ACTIVE_STATUS,
+                "meta_data": meta_data,
+                "idempotency_key": None,
+                "last_accessed": last_accessed,
+                "access_count": int(rng.expovariate(0.2)) + 1 if accessed else 0,
+                "storage_class": File.STANDARD_STORAGE_CLASS,
+                "created_at": created_at,
+                "modified_at": modified_at,
+            }
+
+    def iter_batches(self, batch_size: int) -> typing.Iterator[typing.List[dict]]:
+        batch = []
+        for row in self.iter_rows():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def object_content(row: dict, max_bytes: typing.Optional[int]) -> bytes:
+    """
+    Deterministic content of the row's object, filesize_in_bytes long unless max_bytes cuts it
+    """
+    size = row["meta_data"]["filesize_in_bytes"]
+    if max_bytes is not None:
+        size = min(size, max_bytes)
+    block = random.Random(row["id"].int).getrandbits(8 * 4096).to_bytes(4096, "little")
+    return (block * (size // len(block) + 1))[:size]
+
+
+class DatasetLoader:
+    """
+    Bulk loads generated rows, with COPY on postgres and batched multi row inserts elsewhere.
+    Both write created_at and modified_at as generated, unlike bulk_create which would stamp them with now.
+    With a storage every row also gets its object, written on a thread pool. table loads the rows into a copy
+    of the File table instead, such as the tables of the partitioning benchmark.
+    """
+
+    def __init__(
+        self,
+        using: typing.Optional[str] = None,
+        batch_size: int = 10000,
+        storage=None,
+        object_max_bytes: typing.Optional[int] = 64 * 1024,
+        workers: int = 8,
+        table: typing.Optional[str] = None,
+    ):
+        self.connection = connections[using or router.db_for_write(File)]
+        self.table = table or File._meta.db_table
+        self.batch_size = batch_size
+        self.storage = storage
+        self.object_max_bytes = object_max_bytes
+        self.workers = workers
+
+    def load(self, generator: SyntheticFileGenerator) -> int:
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch in generator.iter_batches(self.batch_size):
+                if self.storage is not None:
+                    # objects first, a row never points to a missing object
+                    list(executor.map(self._save_object, batch))
+                with transaction.atomic(using=self.connection.alias):
+                    if self.connection.vendor == "postgresql":
+                        self._copy(batch)
+                    else:
+                        self._insert(batch)
+                loaded += len(batch)
+                metrics.inc("files_synthetic_rows_total", len(batch))
+                logger.info("Loaded {} of {} synthetic files".format(loaded, generator.spec.rows))
+        return loaded
+
+    def _save_object(self, row: dict):
+        self.storage.save(row["location"], ContentFile(object_content(row, self.object_max_bytes)))
+
+    def _prepared(self, row: dict) -> list:
+        return [
+            File._meta.get_field(column).get_db_prep_save(row[column], connection=self.connection)
+            for column in COLUMNS
+        ]
+
+    def _insert(self, batch: typing.List[dict]):
+        quote = self.connection.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            quote(self.table),
+            ", ".join(quote(column) for column in COLUMNS),
+            ", ".join(["%s"] * len(COLUMNS)),
+        )
+        with self.connection.cursor() as cursor:
+            cursor.executemany(sql, [self._prepared(row) for row in batch])
+
+    def _copy(self, batch: typing.List[dict]):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            # NULL is an empty unquoted field, the generator never produces empty strings
+            writer.writerow(
+                [
+                    json.dumps(value, separators=(",", ":"), sort_keys=True)
+                    if column == "meta_data"
+                    else (value.isoformat() if isinstance(value, datetime.datetime) else value)
+                    for column, value in ((column, row[column]) for column in COLUMNS)
+                ]
+            )
+        sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            self.connection.ops.quote_name(self.table), ", ".join(COLUMNS)
+        )
+        with self.connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy_expert"):
+                # psycopg2
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+            else:
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
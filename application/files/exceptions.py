@@ -14,5 +14,12 @@ class FileUploadException(Exception):
     message: str
 
     def __str__(self):
-        return "{}: {}".format(self.item, self.message) 
-        
\ No newline at end of file
+        return "{}: {}".format(self.item, self.message)
+
+@dataclass(frozen=True)
+class IdempotencyException(Exception):
+    item: str
+    message: str
+
+    def __str__(self):
+        return "{}: {}".format(self.item, self.message)
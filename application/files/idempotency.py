@@ -0,0 +1,182 @@
+# python imports
+import time
+import asyncio
+import uuid
+import typing
+import hashlib
+import logging
+
+# django imports
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import UploadedFile
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .exceptions import IdempotencyException
+from .instrumentation import metrics
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+# deletes KEYS[1] only while it holds ARGV[1], the redis side of release_lock
+RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+def lock_value(owner: str) -> str:
+    """
+    Lock value of one holder, the random token tells it apart from a later holder of the same lock
+    """
+    return "{}:{}".format(owner, uuid.uuid4().hex)
+
+
+def lock_owner(value: str) -> str:
+    return value.rsplit(":", 1)[0]
+
+
+def release_lock(cache, lock_key: str, value: str):
+    """
+    Deletes the lock only while it still holds value. A lock that expired and was taken by another
+    request stays. On a django-redis cache the compare and delete is one atomic script run through the
+    client's public get_client, make_key and encode, other backends compare and delete in two steps.
+    """
+    client = getattr(cache, "client", None)
+    if all(hasattr(client, name) for name in ("get_client", "make_key", "encode")):
+        client.get_client(write=True).eval(RELEASE_LOCK_SCRIPT, 1, client.make_key(lock_key), client.encode(value))
+        return
+    if cache.get(lock_key) == value:
+        cache.delete(lock_key)
+
+
+def file_fingerprint(file_obj) -> str:
+    """
+    Digest of an uploaded file's name and content, kept on the File of an idempotent upload
+    """
+    digest = hashlib.sha256()
+    _update_with_file(digest, file_obj)
+    return digest.hexdigest()
+
+
+def _update_with_file(digest, file_obj):
+    digest.update("{}:{}:".format(file_obj.name, file_obj.size).encode("utf-8"))
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    file_obj.seek(0)
+
+
+def request_fingerprint(user_id, action: str, data: dict) -> str:
+    """
+    Digest of everything that defines an upload request, uploaded files count with their name and content
+    """
+    digest = hashlib.sha256("{}:{}".format(user_id, action).encode("utf-8"))
+    for key in sorted(data):
+        value = data[key]
+        digest.update("\0{}=".format(key).encode("utf-8"))
+        if isinstance(value, UploadedFile):
+            _update_with_file(digest, value)
+        else:
+            digest.update(repr(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Remembers the result of a request under the client's Idempotency-Key for FILES_IDEMPOTENCY_TTL seconds.
+    A retry with the same key and fingerprint gets the stored result, a retry arriving while the first
+    request still runs waits for its result instead of repeating the work, and the same key with a
+    different request is rejected. Only successful results are stored, failed requests can be retried.
+    """
+
+    def __init__(self, cache_alias: typing.Optional[str] = None):
+        self.cache = caches[cache_alias or getattr(settings, "FILES_IDEMPOTENCY_CACHE", "default")]
+        self.ttl = getattr(settings, "FILES_IDEMPOTENCY_TTL", 24 * 60 * 60)
+        # upper bound of a request, a crashed worker's lock expires after it
+        self.lock_ttl = getattr(settings, "FILES_IDEMPOTENCY_LOCK_TTL", 300)
+        self.wait_timeout = getattr(settings, "FILES_IDEMPOTENCY_WAIT_TIMEOUT", 30)
+        self.poll_interval = 0.1
+
+    def _cache_key(self, user_id, idempotency_key: str) -> str:
+        digest = hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+        return "files:idempotency:{}:{}".format(user_id, digest)
+
+    def _result(self, record, fingerprint: str):
+        if record is None:
+            return None
+        if record["fingerprint"] != fingerprint:
+            raise self._reused()
+        return record["result"]
+
+    def _stored(self, cache_key: str, fingerprint: str):
+        return self._result(self.cache.get(cache_key), fingerprint)
+
+    def _reused(self) -> IdempotencyException:
+        return IdempotencyException(
+            "idempotency-key-reused", "The Idempotency-Key was already used for a different request"
+        )
+
+    def _check_in_flight(self, in_flight, fingerprint: str, waited: bool, deadline: float):
+        if in_flight is not None and lock_owner(in_flight) != fingerprint:
+            raise self._reused()
+        if not waited:
+            logger.info("Request with Idempotency-Key in flight, waiting for its result")
+        if time.monotonic() >= deadline:
+            raise IdempotencyException(
+                "idempotency-key-in-progress", "A request with this Idempotency-Key is still in progress"
+            )
+
+    def run(self, user_id, idempotency_key: str, fingerprint: str, func: typing.Callable[[], typing.Any]):
+        """
+        Returns (result, replayed), func is only called when no result for the key exists or is on its way
+        """
+        cache_key = self._cache_key(user_id, idempotency_key)
+        lock_key = "{}:lock".format(cache_key)
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            result = self._stored(cache_key, fingerprint)
+            if result is not None:
+                metrics.record_cache("idempotency", hit=True)
+                return result, True
+            # add is atomic, only one of the concurrent duplicates gets the lock
+            value = lock_value(fingerprint)
+            if self.cache.add(lock_key, value, self.lock_ttl):
+                metrics.record_cache("idempotency", hit=False)
+                try:
+                    result = func()
+                    self.cache.set(cache_key, {"fingerprint": fingerprint, "result": result}, self.ttl)
+                    return result, False
+                finally:
+                    release_lock(self.cache, lock_key, value)
+            self._check_in_flight(self.cache.get(lock_key), fingerprint, waited, deadline)
+            waited = True
+            time.sleep(self.poll_interval)
+
+    async def arun(
+        self, user_id, idempotency_key: str, fingerprint: str, func: typing.Callable[[], typing.Awaitable]
+    ):
+        """
+        run for coroutine views, func is a coroutine function and waiting does not block the event loop
+        """
+        cache_key = self._cache_key(user_id, idempotency_key)
+        lock_key = "{}:lock".format(cache_key)
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            result = self._result(await self.cache.aget(cache_key), fingerprint)
+            if result is not None:
+                metrics.record_cache("idempotency", hit=True)
+                return result, True
+            value = lock_value(fingerprint)
+            if await self.cache.aadd(lock_key, value, self.lock_ttl):
+                metrics.record_cache("idempotency", hit=False)
+                try:
+                    result = await func()
+                    await self.cache.aset(cache_key, {"fingerprint": fingerprint, "result": result}, self.ttl)
+                    return result, False
+                finally:
+                    await sync_to_async(release_lock)(self.cache, lock_key, value)
+            self._check_in_flight(await self.cache.aget(lock_key), fingerprint, waited, deadline)
+            waited = True
+            await asyncio.sleep(self.poll_interval)
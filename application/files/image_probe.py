@@ -0,0 +1,141 @@
+# python imports
+import struct
+import typing
+
+# the largest number of bytes a jpeg is scanned for its frame header before giving up
+MAX_JPEG_SCAN_BYTES = 1024 * 1024
+
+# markers that start a frame, DHT (C4), JPG (C8) and DAC (CC) share the range but carry no dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+Size = typing.Tuple[int, int]
+
+
+def _read_at(file_obj, offset: int, size: int) -> bytes:
+    file_obj.seek(offset)
+    return file_obj.read(size)
+
+
+def _png(head: bytes, file_obj) -> typing.Optional[Size]:
+    if head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _gif(head: bytes, file_obj) -> typing.Optional[Size]:
+    return struct.unpack("<HH", head[6:10])
+
+
+def _bmp(head: bytes, file_obj) -> typing.Optional[Size]:
+    (header_size,) = struct.unpack("<I", head[14:18])
+    if header_size == 12:
+        return struct.unpack("<HH", head[18:22])
+    width, height = struct.unpack("<ii", head[18:26])
+    return abs(width), abs(height)
+
+
+def _webp(head: bytes, file_obj) -> typing.Optional[Size]:
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if head[20] != 0x2F:
+            return None
+        (bits,) = struct.unpack("<I", head[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _tiff(head: bytes, file_obj) -> typing.Optional[Size]:
+    endian = "<" if head[:2] == b"II" else ">"
+    (ifd_offset,) = struct.unpack(endian + "I", head[4:8])
+    entry_count_bytes = _read_at(file_obj, ifd_offset, 2)
+    if len(entry_count_bytes) != 2:
+        return None
+    (entry_count,) = struct.unpack(endian + "H", entry_count_bytes)
+    entries = _read_at(file_obj, ifd_offset + 2, entry_count * 12)
+    width = height = None
+    for index in range(len(entries) // 12):
+        tag, field_type, _ = struct.unpack(endian + "HHI", entries[index * 12:index * 12 + 8])
+        if tag not in (256, 257):
+            continue
+        if field_type == 3:
+            (value,) = struct.unpack(endian + "H", entries[index * 12 + 8:index * 12 + 10])
+        elif field_type == 4:
+            (value,) = struct.unpack(endian + "I", entries[index * 12 + 8:index * 12 + 12])
+        else:
+            return None
+        if tag == 256:
+            width = value
+        else:
+            height = value
+    if width is None or height is None:
+        return None
+    return width, height
+
+
+def _jpeg(head: bytes, file_obj) -> typing.Optional[Size]:
+    offset = 2
+    while offset < MAX_JPEG_SCAN_BYTES:
+        marker = _read_at(file_obj, offset, 2)
+        if len(marker) != 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] == 0xFF:
+            # fill byte
+            offset += 1
+            continue
+        if marker[1] in (0x01, 0xD8) or 0xD0 <= marker[1] <= 0xD7:
+            # markers without a payload
+            offset += 2
+            continue
+        segment = file_obj.read(7)
+        if len(segment) < 2:
+            return None
+        (length,) = struct.unpack(">H", segment[:2])
+        if marker[1] in JPEG_SOF_MARKERS:
+            if len(segment) < 7:
+                return None
+            height, width = struct.unpack(">HH", segment[3:7])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def _probe_head(head: bytes):
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return _gif
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return _tiff
+    if head[:2] == b"BM":
+        return _bmp
+    return None
+
+
+def probe_image_size(file_obj) -> typing.Optional[Size]:
+    """
+    Reads the (width, height) of a PNG, JPEG, GIF, WebP, TIFF or BMP image from its header without decoding it.
+    Only the header bytes are read, the position of file_obj is restored afterwards.
+    Returns None for unknown or malformed headers.
+    """
+    position = file_obj.tell()
+    try:
+        head = _read_at(file_obj, 0, 32)
+        probe = _probe_head(head)
+        if probe is None or (len(head) < 30 and probe is not _gif):
+            return None
+        return probe(head, file_obj)
+    except struct.error:
+        return None
+    finally:
+        file_obj.seek(position)
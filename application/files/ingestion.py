@@ -0,0 +1,215 @@
+# python imports
+import os
+import time
+import hashlib
+import logging
+import typing
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# django imports
+from django.core.files import File as DjangoFile
+
+# app imports
+from domain.files.models import File, FileFactory
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .services import FileAppServices
+from .checkpoints import FileCheckpoint
+from .reaper import delete_many
+from .storages import get_media_storage
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+
+@dataclass
+class IngestionReport:
+    ingested: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes_ingested: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+    errors: typing.List[typing.Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started_at, 1e-9)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.ingested / self.elapsed
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes_ingested / 1000000 / self.elapsed
+
+
+def iter_directory(root: str) -> typing.Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename)
+
+
+def iter_manifest(manifest: str) -> typing.Iterator[str]:
+    """
+    A manifest lists one path per line, relative paths are resolved against the manifest directory
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, "r") as manifest_file:
+        for line in manifest_file:
+            path = line.strip()
+            if path and not path.startswith("#"):
+                yield os.path.join(base_dir, path)
+
+
+def extract_meta_data(path: str) -> typing.Tuple[str, typing.Optional[dict], typing.Optional[str]]:
+    """
+    Runs in a worker process, returns (path, meta_data, error)
+    """
+    try:
+        with open(path, "rb") as fh:
+            file_obj = DjangoFile(fh, name=os.path.basename(path))
+            return path, FileAppServices(None, logger).build_meta_data(file_obj), None
+    except Exception as e:
+        return path, None, "{}: {}".format(type(e).__name__, e)
+
+
+def ingestion_key(path: str) -> str:
+    """
+    Idempotency key of the File ingested from path, a repeated run finds the Files it already registered
+    """
+    return "ingest:{}".format(hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest())
+
+
+def _chunks(iterable: typing.Iterable[str], size: int) -> typing.Iterator[typing.List[str]]:
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class FileIngestionAppServices:
+    """
+    Ingests local files in batches: meta data is extracted in a process pool, storage uploads run on a
+    thread pool and every batch is registered with a single bulk insert before it is checkpointed.
+    """
+
+    def __init__(
+        self,
+        user,
+        log: AttributeLogger,
+        processes: int = None,
+        upload_workers: int = 16,
+        batch_size: int = 500,
+    ):
+        self.user = user
+        self.log = log
+        self.processes = os.cpu_count() if processes is None else processes
+        self.upload_workers = upload_workers
+        self.batch_size = batch_size
+        self.file_app_services = FileAppServices(None, log)
+
+    def ingest(
+        self,
+        paths: typing.Iterable[str],
+        checkpoint: FileCheckpoint,
+        progress: typing.Callable[[IngestionReport], None] = None,
+    ) -> IngestionReport:
+        report = IngestionReport()
+        process_pool = ProcessPoolExecutor(self.processes) if self.processes > 0 else None
+        try:
+            with ThreadPoolExecutor(self.upload_workers) as upload_pool:
+                for batch in _chunks(paths, self.batch_size):
+                    pending = [path for path in batch if path not in checkpoint]
+                    report.skipped += len(batch) - len(pending)
+                    if pending:
+                        self._ingest_batch(pending, checkpoint, report, process_pool, upload_pool)
+                    if progress is not None:
+                        progress(report)
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown()
+        return report
+
+    def _ingest_batch(self, paths, checkpoint, report, process_pool, upload_pool):
+        # paths registered by a run that stopped before its checkpoint was written are not ingested twice
+        keys = {path: ingestion_key(path) for path in paths}
+        registered = set(
+            self.file_app_services.file_services.get_file_repo()
+            .filter(uploader=self.user.id, idempotency_key__in=list(keys.values()))
+            .values_list("idempotency_key", flat=True)
+        )
+        if registered:
+            done = [path for path in paths if keys[path] in registered]
+            checkpoint.mark_done(done)
+            report.skipped += len(done)
+            paths = [path for path in paths if keys[path] not in registered]
+            if not paths:
+                return
+
+        if process_pool is not None:
+            inspected = list(process_pool.map(extract_meta_data, paths, chunksize=16))
+        else:
+            inspected = [extract_meta_data(path) for path in paths]
+
+        to_upload = []
+        for path, meta_data, error in inspected:
+            if error is not None:
+                report.failed += 1
+                report.errors.append((path, error))
+                continue
+            to_upload.append((path, meta_data))
+
+        uploaded = []
+        for (path, meta_data), (upload_key, error) in zip(
+            to_upload, upload_pool.map(self._upload, [path for path, _ in to_upload])
+        ):
+            if error is not None:
+                report.failed += 1
+                report.errors.append((path, error))
+                continue
+            uploaded.append((path, meta_data, upload_key))
+
+        entities = []
+        for path, meta_data, upload_key in uploaded:
+            entity = FileFactory.build_entity_with_id(
+                self.user.id,
+                "{} uploaded".format(os.path.basename(path)),
+                "A file is uploaded to s3",
+                os.path.basename(path),
+                upload_key,
+                File.ACTIVE_STATUS,
+                meta_data,
+            )
+            entity.idempotency_key = keys[path]
+            entities.append(entity)
+        try:
+            self.file_app_services.file_services.bulk_create_files(entities, batch_size=self.batch_size)
+        except Exception as e:
+            # the batch's objects would be orphans, the run goes on with the next batch
+            self.log.warning("Batch of {} files could not be registered - {}".format(len(entities), e))
+            delete_many(get_media_storage(), [upload_key for _, _, upload_key in uploaded])
+            report.failed += len(uploaded)
+            report.errors.extend((path, "{}: {}".format(type(e).__name__, e)) for path, _, _ in uploaded)
+            return
+        checkpoint.mark_done([path for path, _, _ in uploaded])
+
+        report.ingested += len(uploaded)
+        report.bytes_ingested += sum(meta_data["filesize_in_bytes"] for _, meta_data, _ in uploaded)
+
+    def _upload(self, path: str) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        # the key follows from the path, uploading a path again overwrites its object instead of adding one
+        key = os.path.join(self.user.username, "ingest", ingestion_key(path).split(":", 1)[1])
+        try:
+            with open(path, "rb") as fh:
+                file_obj = DjangoFile(fh, name=os.path.basename(path))
+                return self.file_app_services.file_upload_s3(self.user, file_obj, deepcopy=False, key=key), None
+        except Exception as e:
+            self.log.warning("File {} could not be uploaded - {}".format(path, e))
+            return None, "{}: {}".format(type(e).__name__, e)
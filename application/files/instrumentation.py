@@ -0,0 +1,185 @@
+# python imports
+import time
+import asyncio
+import bisect
+import threading
+import typing
+from collections import defaultdict
+from contextlib import contextmanager, ExitStack
+from functools import wraps
+
+# django imports
+from django.conf import settings
+from django.db import connections
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # optional dependency
+    otel_trace = None
+
+# seconds, the default prometheus client buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Process wide counters and histograms, cheap enough to keep enabled in production.
+    Rendered in the prometheus text exposition format.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels_key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # one slot per bucket, +Inf, sum and count
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def counter_value(self, name: str, **labels) -> float:
+        return self._counters.get((name, _labels_key(labels)), 0)
+
+    def histogram_count(self, name: str, **labels) -> int:
+        histogram = self._histograms.get((name, _labels_key(labels)))
+        return histogram[-1] if histogram else 0
+
+    def record_cache(self, cache: str, hit: bool):
+        self.inc("files_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels, (("le", le),)), cumulative))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), histogram[-2]))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), histogram[-1]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """
+    Records duration, database queries and errors of a stage and wraps it in an OpenTelemetry span when available
+    """
+    query_counter = _QueryCounter()
+    with ExitStack() as stack:
+        if otel_trace is not None and getattr(settings, "FILES_METRICS_OTEL_SPANS", True):
+            stack.enter_context(
+                otel_trace.get_tracer(__name__).start_as_current_span("files.{}".format(stage))
+            )
+        if getattr(settings, "FILES_METRICS_COUNT_QUERIES", True):
+            # reads may be routed to a replica, every configured database counts
+            for db_connection in connections.all():
+                stack.enter_context(db_connection.execute_wrapper(query_counter))
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            metrics.inc("files_stage_errors_total", stage=stage)
+            raise
+        finally:
+            metrics.observe("files_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+            if query_counter.count:
+                metrics.inc("files_stage_db_queries_total", query_counter.count, stage=stage)
+
+
+def instrumented(stage: str):
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            # queries a coroutine makes through sync_to_async run on another thread and are not counted
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timed_stage(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed_stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedStorage:
+    """
+    Transparent proxy that counts the calls made to a storage backend
+    """
+
+    COUNTED_METHODS = ("save", "open", "open_mapped", "delete", "delete_many", "exists", "url", "size", "listdir")
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if name not in self.COUNTED_METHODS:
+            return attribute
+
+        @wraps(attribute)
+        def counted(*args, **kwargs):
+            metrics.inc("files_storage_calls_total", operation=name)
+            return attribute(*args, **kwargs)
+
+        return counted
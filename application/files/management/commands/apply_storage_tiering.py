@@ -0,0 +1,41 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+from application.files.tiering import TieringEngine, TieringPolicy
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Moves Files between storage classes according to how long they have not been read"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-size-bytes", type=int, default=None, help="Smaller files stay in the default tier")
+        parser.add_argument("--batch-size", type=int, default=500, help="Files handled per batch")
+        parser.add_argument("--rate", type=float, default=None, help="Maximum transitions per second")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be moved")
+
+    def handle(self, *args, **options):
+        engine = TieringEngine(
+            log,
+            policy=TieringPolicy(min_size_bytes=options["min_size_bytes"]),
+            batch_size=options["batch_size"],
+            rate=options["rate"],
+            dry_run=options["dry_run"],
+        )
+        report = engine.run()
+
+        for error in report.errors:
+            self.stderr.write(error)
+        for storage_class, count in report.transitions.items():
+            self.stdout.write("{}: {} files".format(storage_class, count))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{}Moved {} files".format("(dry run) " if options["dry_run"] else "", report.moved)
+            )
+        )
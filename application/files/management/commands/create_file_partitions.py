@@ -0,0 +1,33 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+# app imports
+from domain.files import partitioning
+from domain.files.models import File
+from infrastructure.logger.models import AttributeLogger
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Creates the monthly File partitions ahead of time, run it at least once a month"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead", type=int, default=None, help="Defaults to FILES_PARTITION_MONTHS_AHEAD"
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(File)]
+        table = File._meta.db_table
+        if not partitioning.is_partitioned(connection, table):
+            raise CommandError("{} is not partitioned".format(table))
+
+        created = partitioning.ensure_future_partitions(connection, table, months=options["months_ahead"])
+        for name in created:
+            self.stdout.write("Created {}".format(name))
+        self.stdout.write(self.style.SUCCESS("{} partitions created".format(len(created))))
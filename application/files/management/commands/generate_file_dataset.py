@@ -0,0 +1,68 @@
+# python imports
+import logging
+import datetime
+
+# django imports
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+from application.files.datasets import DatasetLoader, DatasetSpec, SyntheticFileGenerator
+from application.files.storages import get_media_storage
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+LOCAL_STORAGE_BACKEND = "interface.storages.local_storage.LocalMediaStorage"
+
+
+class Command(BaseCommand):
+    help = "Bulk loads a seeded synthetic File catalog, the same arguments always produce the same rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1000000, help="Number of files")
+        parser.add_argument("--uploaders", type=int, default=1000, help="Number of distinct uploaders")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument("--uploader-skew", type=float, default=1.1, help="Zipf exponent, 0 for an even spread")
+        parser.add_argument("--span-days", type=int, default=3 * 365, help="created_at spread")
+        parser.add_argument(
+            "--end", default=None, help="Newest created_at as YYYY-MM-DD, defaults to now (fix it to reproduce a run)"
+        )
+        parser.add_argument("--batch-size", type=int, default=10000, help="Rows per COPY or INSERT")
+        parser.add_argument("--objects", action="store_true", help="Also store an object for every file")
+        parser.add_argument(
+            "--storage-root", default=None, help="Store the objects in a local storage at this path"
+        )
+        parser.add_argument(
+            "--object-max-bytes", type=int, default=64 * 1024, help="Cut objects to this size, 0 keeps the full size"
+        )
+        parser.add_argument("--workers", type=int, default=8, help="Threads writing objects")
+
+    def handle(self, *args, **options):
+        spec = DatasetSpec(
+            rows=options["rows"],
+            uploaders=options["uploaders"],
+            seed=options["seed"],
+            uploader_skew=options["uploader_skew"],
+            span_days=options["span_days"],
+        )
+        if options["end"]:
+            spec.end = datetime.datetime.strptime(options["end"], "%Y-%m-%d").replace(
+                tzinfo=datetime.timezone.utc if timezone.is_aware(spec.end) else None
+            )
+
+        storage = None
+        if options["storage_root"]:
+            storage = import_string(LOCAL_STORAGE_BACKEND)(location=options["storage_root"])
+        elif options["objects"]:
+            storage = get_media_storage()
+
+        loader = DatasetLoader(
+            batch_size=options["batch_size"],
+            storage=storage,
+            object_max_bytes=options["object_max_bytes"] or None,
+            workers=options["workers"],
+        )
+        loaded = loader.load(SyntheticFileGenerator(spec))
+        self.stdout.write(self.style.SUCCESS("Loaded {} files (seed {})".format(loaded, spec.seed)))
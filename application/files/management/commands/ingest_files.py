@@ -0,0 +1,75 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand, CommandError
+
+# app imports
+from domain.users.models import User
+from infrastructure.logger.models import AttributeLogger
+from application.files.checkpoints import FileCheckpoint
+from application.files.ingestion import (
+    FileIngestionAppServices,
+    iter_directory,
+    iter_manifest,
+)
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Ingests a local directory tree or a manifest of paths into storage and registers the Files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Directory to walk or manifest file (with --manifest)")
+        parser.add_argument("--username", required=True, help="Uploader of the ingested files")
+        parser.add_argument("--manifest", action="store_true", help="Treat source as a manifest with one path per line")
+        parser.add_argument("--checkpoint", help="Checkpoint file used to resume interrupted runs")
+        parser.add_argument("--processes", type=int, default=None, help="Meta data worker processes, 0 runs inline")
+        parser.add_argument("--workers", type=int, default=16, help="Concurrent storage uploads")
+        parser.add_argument("--batch-size", type=int, default=500, help="Files registered per bulk insert")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError("User {} does not exist".format(options["username"]))
+
+        if options["manifest"]:
+            paths = iter_manifest(options["source"])
+        else:
+            paths = iter_directory(options["source"])
+
+        checkpoint = FileCheckpoint(options["checkpoint"])
+        if len(checkpoint):
+            self.stdout.write("Resuming, {} files already ingested".format(len(checkpoint)))
+
+        ingestion = FileIngestionAppServices(
+            user,
+            log.with_attributes(user_id=user.id),
+            processes=options["processes"],
+            upload_workers=options["workers"],
+            batch_size=options["batch_size"],
+        )
+        report = ingestion.ingest(paths, checkpoint, progress=self.report_progress)
+
+        for path, error in report.errors:
+            self.stderr.write("{}: {}".format(path, error))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Ingested {} files ({} skipped, {} failed) in {:.1f}s".format(
+                    report.ingested, report.skipped, report.failed, report.elapsed
+                )
+            )
+        )
+
+    def report_progress(self, report):
+        self.stdout.write(
+            "ingested={} skipped={} failed={} {:.1f} files/s {:.2f} MB/s".format(
+                report.ingested,
+                report.skipped,
+                report.failed,
+                report.files_per_second,
+                report.megabytes_per_second,
+            )
+        )
@@ -0,0 +1,62 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+from application.files.checkpoints import FileCheckpoint
+from application.files.reaper import FileReaper, ReaperReport
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Deletes deactivated Files past the retention window and storage objects no File points to"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int, default=None, help="Keep deactivated files this long")
+        parser.add_argument("--orphan-grace-hours", type=int, default=None, help="Never delete younger objects")
+        parser.add_argument("--prefix", default="", help="Only reconcile objects below this prefix")
+        parser.add_argument("--skip-sweep", action="store_true", help="Do not delete deactivated files")
+        parser.add_argument("--skip-reconcile", action="store_true", help="Do not look for orphaned objects")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows or objects handled per batch")
+        parser.add_argument("--rate", type=float, default=None, help="Maximum object deletes per second")
+        parser.add_argument("--checkpoint", help="Checkpoint file used to resume interrupted runs")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted")
+
+    def handle(self, *args, **options):
+        checkpoint = FileCheckpoint(options["checkpoint"])
+        if len(checkpoint):
+            self.stdout.write("Resuming, {} entries already processed".format(len(checkpoint)))
+
+        reaper = FileReaper(
+            log,
+            retention_days=options["retention_days"],
+            orphan_grace_hours=options["orphan_grace_hours"],
+            batch_size=options["batch_size"],
+            rate=options["rate"],
+            checkpoint=checkpoint,
+            dry_run=options["dry_run"],
+        )
+        report = ReaperReport()
+        if not options["skip_sweep"]:
+            reaper.sweep(report)
+        if not options["skip_reconcile"]:
+            reaper.reconcile(options["prefix"], report)
+
+        for error in report.errors:
+            self.stderr.write(error)
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{}Deleted {} files, {} upload sessions and {} objects, {} orphans in {} scanned objects".format(
+                    "(dry run) " if options["dry_run"] else "",
+                    report.rows_deleted,
+                    report.sessions_expired,
+                    report.objects_deleted,
+                    report.orphans_found,
+                    report.objects_scanned,
+                )
+            )
+        )
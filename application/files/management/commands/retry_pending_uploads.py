@@ -0,0 +1,28 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+from application.files.outbox import PendingUploadRetrier
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Activates or rolls back uploads that were left pending"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace-minutes", type=int, default=None, help="Leave younger pending files alone")
+        parser.add_argument("--batch-size", type=int, default=500, help="Pending files handled per batch")
+
+    def handle(self, *args, **options):
+        retrier = PendingUploadRetrier(log, grace_minutes=options["grace_minutes"], batch_size=options["batch_size"])
+        report = retrier.run()
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Activated {} and rolled back {} pending uploads".format(report.activated, report.rolled_back)
+            )
+        )
@@ -0,0 +1,60 @@
+# python imports
+import logging
+
+# django imports
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+# app imports
+from domain.files.models import File
+from domain.files.services import FileServices
+from infrastructure.logger.models import AttributeLogger
+from application.files.tiering import TieringPolicy, read_access_log, simulate
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+
+class Command(BaseCommand):
+    help = "Replays the access log against the tiering policy and estimates the monthly storage cost"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--access-log", default=None, help="Defaults to FILES_ACCESS_LOG")
+        parser.add_argument("--min-size-bytes", type=int, default=None, help="Smaller files stay in the default tier")
+        parser.add_argument(
+            "--include-unread", action="store_true", help="Also price active files the log never reads"
+        )
+
+    def handle(self, *args, **options):
+        path = options["access_log"] or getattr(settings, "FILES_ACCESS_LOG", None)
+        if not path:
+            raise CommandError("No access log, pass --access-log or set FILES_ACCESS_LOG")
+
+        inventory = {}
+        if options["include_unread"]:
+            files = FileServices(log).get_file_repo().filter(status=File.ACTIVE_STATUS)
+            for file_id, created_at, size in files.values_list(
+                "id", "created_at", "meta_data__filesize_in_bytes"
+            ).iterator():
+                inventory[str(file_id)] = (created_at.timestamp(), size or 0)
+
+        try:
+            report = simulate(
+                read_access_log(path), TieringPolicy(min_size_bytes=options["min_size_bytes"]), inventory
+            )
+        except OSError as e:
+            raise CommandError("Access log could not be read - {}".format(e))
+
+        months = max(report.days, 1) / 30.0
+        self.stdout.write("{} files, {} reads over {} days".format(report.files, report.reads, report.days))
+        self.stdout.write("{} transitions".format(report.transitions))
+        self.stdout.write("storage:    {:12.4f} USD/month".format(report.storage_cost / months))
+        self.stdout.write("retrieval:  {:12.4f} USD/month".format(report.retrieval_cost / months))
+        self.stdout.write("transition: {:12.4f} USD/month".format(report.transition_cost / months))
+        self.stdout.write("baseline:   {:12.4f} USD/month".format(report.baseline_cost / months))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "tiered:     {:12.4f} USD/month, saves {:.4f}".format(
+                    report.tiered_cost / months, report.savings / months
+                )
+            )
+        )
@@ -0,0 +1,75 @@
+# python imports
+import typing
+import logging
+import datetime
+from dataclasses import dataclass
+
+# django imports
+from django.conf import settings
+from django.utils import timezone
+
+# app imports
+from domain.files.models import File
+from domain.files.services import FileServices
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .instrumentation import metrics
+from .storages import get_media_storage
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+
+@dataclass
+class RetrierReport:
+    activated: int = 0
+    rolled_back: int = 0
+
+
+class PendingUploadRetrier:
+    """
+    Resolves uploads that stopped between registering the pending File and activating it.
+    Storage writes are atomic, so a pending File whose object exists only missed its activation and is activated,
+    one without object is deleted and the client can repeat the upload with the same idempotency key.
+    Only Files pending for longer than the grace period are touched, younger ones may still be uploading.
+    """
+
+    def __init__(self, log: AttributeLogger, grace_minutes: typing.Optional[int] = None, batch_size: int = 500):
+        self.log = log
+        self.file_services = FileServices(log)
+        self.grace = datetime.timedelta(
+            minutes=grace_minutes
+            if grace_minutes is not None
+            else getattr(settings, "FILES_PENDING_UPLOAD_GRACE_MINUTES", 60)
+        )
+        self.batch_size = batch_size
+        self.storage = get_media_storage()
+
+    def run(self, now=None) -> RetrierReport:
+        report = RetrierReport()
+        cutoff = (now or timezone.now()) - self.grace
+        repo = self.file_services.get_file_repo()
+        queryset = repo.filter(
+            status=File.PENDING_STATUS, modified_at__lt=cutoff, created_at__lt=cutoff
+        ).order_by("id")
+        last_id = None
+        while True:
+            batch = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            rows = list(batch.values_list("id", "location")[: self.batch_size])
+            if not rows:
+                return report
+            last_id = rows[-1][0]
+
+            stored, missing = [], []
+            for file_id, location in rows:
+                (stored if self.storage.exists(location) else missing).append(file_id)
+            # the status condition keeps a concurrently finished upload untouched
+            report.activated += repo.filter(id__in=stored, status=File.PENDING_STATUS).update(
+                status=File.ACTIVE_STATUS, modified_at=timezone.now()
+            )
+            report.rolled_back += repo.filter(id__in=missing, status=File.PENDING_STATUS).delete()[0]
+            metrics.inc("files_pending_resolved_total", len(stored), outcome="activated")
+            metrics.inc("files_pending_resolved_total", len(missing), outcome="rolled_back")
+            logger.info(
+                "Resolved pending uploads - {} activated, {} rolled back".format(report.activated, report.rolled_back)
+            )
@@ -0,0 +1,279 @@
+# python imports
+import time
+import typing
+import logging
+import datetime
+import threading
+from dataclasses import dataclass, field
+
+# django imports
+from django.conf import settings
+from django.utils import timezone
+
+# app imports
+from domain.files.models import File
+from domain.files.services import FileServices
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .checkpoints import FileCheckpoint
+from .instrumentation import metrics
+from .resumable import SESSION_TTL, get_session_store, part_upload_id
+from .storages import get_media_storage
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+# S3 DeleteObjects accepts at most 1000 keys per request
+S3_DELETE_BATCH = 1000
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the storage operations per second, None disables the limit
+    """
+
+    def __init__(self, rate: typing.Optional[float]):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._allowance = rate or 0
+        self._last = time.monotonic()
+
+    def acquire(self, n: int = 1):
+        if not self.rate:
+            return
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= min(n, self.rate):
+                    self._allowance -= n
+                    return
+                time.sleep((min(n, self.rate) - self._allowance) / self.rate)
+
+
+def _s3_key(storage, name: str) -> str:
+    # S3Boto3Storage prefixes its location and cleans the name the same way for every object call
+    from storages.utils import clean_name
+
+    return storage._normalize_name(clean_name(name))
+
+
+def delete_many(storage, names: typing.Sequence[str]) -> typing.List[str]:
+    """
+    Deletes many objects with as few storage requests as the backend allows:
+    S3 multi-object delete, the backend's delete_many or one delete per object.
+    Returns the names that could not be deleted.
+    """
+    if not names:
+        return []
+    if hasattr(storage, "bucket"):
+        failed = []
+        for start in range(0, len(names), S3_DELETE_BATCH):
+            batch = names[start:start + S3_DELETE_BATCH]
+            keys = {_s3_key(storage, name): name for name in batch}
+            response = storage.bucket.delete_objects(
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+            )
+            metrics.inc("files_storage_calls_total", operation="delete_objects")
+            for error in response.get("Errors", []):
+                logger.warning("Object {} could not be deleted - {}".format(error["Key"], error.get("Message")))
+                failed.append(keys.get(error["Key"], error["Key"]))
+        return failed
+    if hasattr(storage, "delete_many"):
+        return storage.delete_many(names)
+
+    failed = []
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            logger.warning("Object {} could not be deleted - {}".format(name, e))
+            failed.append(name)
+    return failed
+
+
+def iter_objects(storage, prefix: str = "") -> typing.Iterator[typing.Tuple[str, datetime.datetime]]:
+    """
+    Yields (name, last modified) of every object below prefix
+    """
+    if hasattr(storage, "bucket"):
+        location = storage._normalize_name("")
+        for obj in storage.bucket.objects.filter(Prefix=_s3_key(storage, prefix) if prefix else location):
+            yield obj.key[len(location):].lstrip("/"), obj.last_modified
+        return
+
+    if hasattr(storage, "iter_keys"):
+        names = storage.iter_keys(prefix)
+    else:
+        names = _walk(storage, prefix.rstrip("/"))
+    for name in names:
+        yield name, storage.get_modified_time(name)
+
+
+def _walk(storage, path: str) -> typing.Iterator[str]:
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield "{}/{}".format(path, name) if path else name
+    for directory in directories:
+        yield from _walk(storage, "{}/{}".format(path, directory) if path else directory)
+
+
+@dataclass
+class ReaperReport:
+    rows_deleted: int = 0
+    objects_deleted: int = 0
+    orphans_found: int = 0
+    objects_scanned: int = 0
+    sessions_expired: int = 0
+    errors: typing.List[str] = field(default_factory=list)
+
+
+class FileReaper:
+    """
+    Reclaims storage in two passes that can run independently:
+    sweep deletes deactivated Files older than the retention window together with their objects and
+    resumable upload sessions older than FILES_RESUMABLE_SESSION_TTL together with their parts,
+    reconcile lists the bucket and deletes objects no File or live upload session points to.
+    Storage deletes go through the rate limiter and finished work is recorded in the checkpoint
+    so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        log: AttributeLogger,
+        retention_days: typing.Optional[int] = None,
+        orphan_grace_hours: typing.Optional[int] = None,
+        batch_size: int = 500,
+        rate: typing.Optional[float] = None,
+        checkpoint: typing.Optional[FileCheckpoint] = None,
+        dry_run: bool = False,
+    ):
+        self.log = log
+        self.file_services = FileServices(log)
+        self.retention = datetime.timedelta(
+            days=retention_days if retention_days is not None else getattr(settings, "FILES_RETENTION_DAYS", 30)
+        )
+        # uploads save the object before the File row exists, younger objects are never treated as orphans
+        self.orphan_grace = datetime.timedelta(
+            hours=orphan_grace_hours
+            if orphan_grace_hours is not None
+            else getattr(settings, "FILES_ORPHAN_GRACE_HOURS", 24)
+        )
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(rate)
+        self.checkpoint = checkpoint or FileCheckpoint(None)
+        self.dry_run = dry_run
+        self.storage = get_media_storage()
+        self._session_store = get_session_store()
+
+    def sweep(self, report: typing.Optional[ReaperReport] = None, now=None) -> ReaperReport:
+        report = report or ReaperReport()
+        cutoff = (now or timezone.now()) - self.retention
+        # created_at never exceeds modified_at, bounding it as well prunes the newer partitions
+        queryset = self.file_services.get_file_repo().filter(
+            status=File.DEACTIVATED_STATUS, modified_at__lt=cutoff, created_at__lt=cutoff
+        )
+        last_id = None
+        while True:
+            batch = queryset.order_by("id")
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            rows = list(batch.values_list("id", "location")[: self.batch_size])
+            if not rows:
+                self.expire_sessions(report, now)
+                if not self.dry_run:
+                    # the pass is complete, the next run starts from scratch
+                    self.checkpoint.clear("object:")
+                return report
+            last_id = rows[-1][0]
+
+            # objects go first, a row left behind by a failure is swept again on the next run
+            pending = [location for file_id, location in rows if "object:{}".format(location) not in self.checkpoint]
+            failed = set(self._delete_objects(pending, report))
+            deletable = [file_id for file_id, location in rows if location not in failed]
+            report.rows_deleted += len(deletable)
+            if not self.dry_run and deletable:
+                self.file_services.get_file_repo().filter(id__in=deletable).delete()
+                metrics.inc("files_reaped_total", len(deletable), kind="row")
+            logger.info("Swept {} deactivated files".format(report.rows_deleted))
+
+    def expire_sessions(self, report: typing.Optional[ReaperReport] = None, now=None) -> ReaperReport:
+        report = report or ReaperReport()
+        store = self._session_store
+        before = (now or timezone.now()) - datetime.timedelta(seconds=SESSION_TTL)
+        while True:
+            sessions = store.expired(before, self.batch_size)
+            if not sessions:
+                return report
+            # parts that can not be deleted are orphans for reconcile once the session is gone
+            self._delete_objects([part_key for session in sessions for _, part_key in session.parts], report)
+            report.sessions_expired += len(sessions)
+            if self.dry_run:
+                return report
+            for session in sessions:
+                store.delete(session.upload_id)
+            logger.info("Expired {} upload sessions".format(report.sessions_expired))
+
+    def reconcile(self, prefix: str = "", report: typing.Optional[ReaperReport] = None, now=None) -> ReaperReport:
+        report = report or ReaperReport()
+        cutoff = (now or timezone.now()) - self.orphan_grace
+        batch = []
+        for name, modified_at in iter_objects(self.storage, prefix):
+            report.objects_scanned += 1
+            if "scanned:{}".format(name) in self.checkpoint:
+                continue
+            batch.append((name, modified_at))
+            if len(batch) >= self.batch_size:
+                self._reconcile_batch(batch, cutoff, report)
+                batch = []
+        if batch:
+            self._reconcile_batch(batch, cutoff, report)
+        if not self.dry_run:
+            # the pass is complete, objects kept this time are looked at again by the next run
+            self.checkpoint.clear("scanned:")
+        return report
+
+    def _reconcile_batch(self, batch, cutoff, report: ReaperReport):
+        names = [name for name, _ in batch]
+        referenced = set(
+            self.file_services.get_file_repo().filter(location__in=names).values_list("location", flat=True)
+        )
+        orphans = [
+            name for name, modified_at in batch
+            if name not in referenced and modified_at < cutoff and not self._live_part(name)
+        ]
+        report.orphans_found += len(orphans)
+        failed = set(self._delete_objects(orphans, report))
+        if not self.dry_run:
+            metrics.inc("files_reaped_total", len(orphans) - len(failed), kind="orphan")
+            # only decided objects are checkpointed, young unreferenced ones are looked at again
+            decided = referenced | (set(orphans) - failed)
+            self.checkpoint.mark_done("scanned:{}".format(name) for name in names if name in decided)
+
+    def _live_part(self, name: str) -> bool:
+        # parts of a running resumable upload have no File yet, they may be older than the grace window
+        upload_id = part_upload_id(name)
+        if upload_id is None:
+            return False
+        session = self._session_store.get(upload_id)
+        return session is not None and not session.complete
+
+    def _delete_objects(self, names, report: ReaperReport) -> typing.List[str]:
+        if self.dry_run or not names:
+            return []
+        failed = []
+        for start in range(0, len(names), S3_DELETE_BATCH):
+            batch = names[start:start + S3_DELETE_BATCH]
+            self.rate_limiter.acquire(len(batch))
+            try:
+                failed += delete_many(self.storage, batch)
+            except Exception as e:
+                logger.warning("Objects could not be deleted - {}".format(e))
+                failed += batch
+        for name in failed:
+            report.errors.append("{}: could not be deleted".format(name))
+        report.objects_deleted += len(names) - len(failed)
+        failed_names = set(failed)
+        self.checkpoint.mark_done("object:{}".format(name) for name in names if name not in failed_names)
+        return failed
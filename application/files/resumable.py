@@ -0,0 +1,350 @@
+# python imports
+import os
+import uuid
+import typing
+import logging
+import tempfile
+import datetime
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+
+# django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files import File as DjangoFile
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+# app imports
+from domain.files.services import FileServices
+from application.app_access_control.services import UserAccessController
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .exceptions import FileUploadException
+from .idempotency import lock_value, release_lock
+from .instrumentation import instrumented, metrics
+from .services import FileAppServices, SIZE_HARD_LIMIT_MB
+from .storages import get_media_storage
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+DEFAULT_SESSION_STORE = "application.files.resumable.CacheSessionStore"
+SESSION_TTL = getattr(settings, "FILES_RESUMABLE_SESSION_TTL", 24 * 60 * 60)
+MAX_CHUNK_BYTES = getattr(settings, "FILES_RESUMABLE_MAX_CHUNK_MB", 16) * 1000000
+READ_SIZE = 64 * 1024
+# chunks larger than this are spooled to disk before they are stored
+SPOOL_BYTES = 1024 * 1024
+PARTS_DIR = ".parts"
+
+
+def part_upload_id(name: str) -> typing.Optional[str]:
+    """
+    Upload id of a part object key (<username>/.parts/<upload id>/<offset>-<suffix>), None for other keys
+    """
+    segments = name.split("/")
+    if len(segments) >= 3 and segments[-3] == PARTS_DIR:
+        return segments[-2]
+    return None
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    user_id: str
+    filename: str
+    size: int
+    offset: int = 0
+    parts: typing.List[typing.List] = field(default_factory=list)
+    file_type: typing.Optional[str] = None
+    size_soft_limit_mb: typing.Optional[int] = None
+    file_id: typing.Optional[str] = None
+    upload_key: typing.Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.file_id is not None
+
+
+class CacheSessionStore:
+    """
+    Sessions in the Django cache (FILES_RESUMABLE_SESSION_CACHE), they expire after FILES_RESUMABLE_SESSION_TTL
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "FILES_RESUMABLE_SESSION_CACHE", "default")]
+
+    def _key(self, upload_id: str) -> str:
+        return "files:upload-session:{}".format(upload_id)
+
+    def create(self, session: UploadSession):
+        self.cache.set(self._key(session.upload_id), asdict(session), SESSION_TTL)
+
+    def get(self, upload_id: str) -> typing.Optional[UploadSession]:
+        data = self.cache.get(self._key(upload_id))
+        return UploadSession(**data) if data is not None else None
+
+    def save(self, session: UploadSession):
+        self.cache.set(self._key(session.upload_id), asdict(session), SESSION_TTL)
+
+    def advance(self, session: UploadSession, part_key: str, length: int) -> bool:
+        lock_key = "{}:lock".format(self._key(session.upload_id))
+        value = lock_value(part_key)
+        if not self.cache.add(lock_key, value, 60):
+            return False
+        try:
+            current = self.get(session.upload_id)
+            if current is None or current.offset != session.offset:
+                return False
+            current.parts.append([current.offset, part_key])
+            current.offset += length
+            self.save(current)
+            session.parts, session.offset = current.parts, current.offset
+            return True
+        finally:
+            release_lock(self.cache, lock_key, value)
+
+    def expired(self, before: datetime.datetime, limit: int) -> typing.List[UploadSession]:
+        # the cache expires sessions by itself, their parts are left to the reaper's reconcile
+        return []
+
+    def delete(self, upload_id: str):
+        self.cache.delete(self._key(upload_id))
+
+
+class DatabaseSessionStore:
+    """
+    Sessions as FileUploadSession rows, they survive cache evictions and restarts
+    """
+
+    def __init__(self):
+        self.repo = FileServices(logger).get_upload_session_repo()
+
+    def _to_session(self, row) -> UploadSession:
+        return UploadSession(
+            upload_id=str(row.id),
+            user_id=str(row.uploader),
+            filename=row.origin_name,
+            size=row.size,
+            offset=row.offset,
+            parts=row.parts,
+            file_type=row.file_type,
+            size_soft_limit_mb=row.size_soft_limit_mb,
+            file_id=str(row.file_id) if row.file_id else None,
+            upload_key=row.upload_key,
+        )
+
+    def create(self, session: UploadSession):
+        self.repo.create(
+            id=session.upload_id,
+            uploader=session.user_id,
+            origin_name=session.filename,
+            size=session.size,
+            file_type=session.file_type,
+            size_soft_limit_mb=session.size_soft_limit_mb,
+        )
+
+    def get(self, upload_id: str) -> typing.Optional[UploadSession]:
+        expired_before = timezone.now() - datetime.timedelta(seconds=SESSION_TTL)
+        row = self.repo.filter(id=upload_id, created_at__gte=expired_before).first()
+        return self._to_session(row) if row is not None else None
+
+    def save(self, session: UploadSession):
+        self.repo.filter(id=session.upload_id).update(
+            offset=session.offset,
+            parts=session.parts,
+            file_id=session.file_id,
+            upload_key=session.upload_key,
+            modified_at=timezone.now(),
+        )
+
+    def advance(self, session: UploadSession, part_key: str, length: int) -> bool:
+        parts = session.parts + [[session.offset, part_key]]
+        # compare and set on the offset, a concurrent chunk for the same offset loses
+        updated = self.repo.filter(id=session.upload_id, offset=session.offset).update(
+            offset=session.offset + length, parts=parts, modified_at=timezone.now()
+        )
+        if updated:
+            session.parts, session.offset = parts, session.offset + length
+        return bool(updated)
+
+    def expired(self, before: datetime.datetime, limit: int) -> typing.List[UploadSession]:
+        """
+        Sessions created before before, abandoned or finalized, oldest first
+        """
+        return [self._to_session(row) for row in self.repo.filter(created_at__lt=before).order_by("created_at")[:limit]]
+
+    def delete(self, upload_id: str):
+        self.repo.filter(id=upload_id).delete()
+
+
+@lru_cache(maxsize=None)
+def _session_store_class(path: str):
+    return import_string(path)
+
+
+def get_session_store():
+    """
+    Returns the session store configured with FILES_RESUMABLE_SESSION_STORE,
+    CacheSessionStore by default and DatabaseSessionStore for durable sessions
+    """
+    return _session_store_class(getattr(settings, "FILES_RESUMABLE_SESSION_STORE", DEFAULT_SESSION_STORE))()
+
+
+class ResumableUploadAppServices:
+    """
+    Resumable uploads: a session announces the file, chunks are appended at the current offset and stored
+    as part objects as they arrive, so an interrupted transfer resumes from the last stored byte.
+    finalize assembles the parts and registers the File through FileAppServices.upload_file, which runs
+    file_validation and build_meta_data on the assembled content.
+    """
+
+    def __init__(self, user_access_controller: UserAccessController, log: AttributeLogger):
+        self.user_access_controller = user_access_controller
+        self.log = log
+        self.file_app_services = FileAppServices(user_access_controller, log)
+        self.session_store = get_session_store()
+
+    @instrumented("resumable_create")
+    def create_session(self, user, data) -> UploadSession:
+        filename = os.path.basename(data.get("filename") or "")
+        if not filename:
+            raise ValidationError("filename is required.")
+        try:
+            size = int(data.get("size"))
+        except (TypeError, ValueError):
+            raise ValidationError("Upload-Length is not valid - {}.".format(data.get("size")))
+        try:
+            mime_type = self.file_app_services.get_mime_type(filename)["mime_type"]
+        except KeyError:
+            raise ValidationError("File type not permitted - {}.".format(filename))
+        file_type = data.get("file_type") or None
+        if file_type is not None and file_type != mime_type:
+            raise ValidationError(
+                "File ( {} ) does not match file_type {}.".format(mime_type, file_type)
+            )
+        size_soft_limit_mb = data.get("size_soft_limit_mb") or None
+        limits_mb = [SIZE_HARD_LIMIT_MB] + ([int(size_soft_limit_mb)] if size_soft_limit_mb else [])
+        if not 0 < size <= min(limits_mb) * 1000000:
+            raise ValidationError("File size not permitted - {} bytes.".format(size))
+
+        session = UploadSession(
+            upload_id=str(uuid.uuid4()),
+            user_id=str(user.id),
+            filename=filename,
+            size=size,
+            file_type=file_type,
+            size_soft_limit_mb=int(size_soft_limit_mb) if size_soft_limit_mb else None,
+        )
+        self.session_store.create(session)
+        return session
+
+    def get_session(self, user, upload_id) -> UploadSession:
+        session = self.session_store.get(str(upload_id))
+        if session is None or session.user_id != str(user.id):
+            raise FileUploadException("upload-session-not-found", "The upload session does not exist or expired")
+        return session
+
+    @instrumented("resumable_append")
+    def append_chunk(self, user, upload_id, offset, stream, length=None) -> UploadSession:
+        """
+        Stores the bytes read from stream as the part starting at offset. Whatever arrived before the client
+        went away is kept, the client resumes at the returned session's offset.
+        """
+        session = self.get_session(user, upload_id)
+        if session.complete:
+            raise FileUploadException("upload-session-complete", "The upload is already finalized")
+        if offset != session.offset:
+            raise FileUploadException(
+                "upload-offset-mismatch", "Upload-Offset {} does not match {}".format(offset, session.offset)
+            )
+        remaining = session.size - session.offset
+        if length is not None and length > min(remaining, MAX_CHUNK_BYTES):
+            raise ValidationError(
+                "Chunk too large - {} > {} bytes.".format(length, min(remaining, MAX_CHUNK_BYTES))
+            )
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as chunk:
+            received = self._receive(stream, chunk, min(remaining, MAX_CHUNK_BYTES, length or MAX_CHUNK_BYTES))
+            if not received:
+                return session
+            chunk.seek(0)
+            part_key = os.path.join(
+                user.username, PARTS_DIR, session.upload_id, "{:012d}-{}".format(offset, get_random_string(6))
+            )
+            storage = get_media_storage()
+            storage.save(part_key, DjangoFile(chunk, name=os.path.basename(part_key)))
+
+        if not self.session_store.advance(session, part_key, received):
+            storage.delete(part_key)
+            raise FileUploadException("upload-offset-mismatch", "Another chunk was stored at offset {}".format(offset))
+        metrics.inc("files_bytes_in_total", received)
+        return session
+
+    def _receive(self, stream, chunk, limit: int) -> int:
+        received = 0
+        try:
+            while received < limit:
+                data = stream.read(min(READ_SIZE, limit - received))
+                if not data:
+                    break
+                chunk.write(data)
+                received += len(data)
+        except OSError as e:
+            # the client went away, keep the bytes that made it
+            logger.info("Chunk interrupted after {} bytes - {}".format(received, e))
+        return received
+
+    @instrumented("resumable_finalize")
+    def finalize(self, user, upload_id) -> UploadSession:
+        session = self.get_session(user, upload_id)
+        if session.complete:
+            return session
+        if session.offset != session.size:
+            raise FileUploadException(
+                "upload-incomplete", "Received {} of {} bytes".format(session.offset, session.size)
+            )
+
+        storage = get_media_storage()
+        content_type = self.file_app_services.get_mime_type(session.filename)["mime_type"]
+        assembled = TemporaryUploadedFile(session.filename, content_type, session.size, None)
+        try:
+            for _, part_key in session.parts:
+                with storage.open(part_key) as part:
+                    for data in part.chunks():
+                        assembled.write(data)
+            assembled.flush()
+            assembled.seek(0)
+            # the upload id doubles as idempotency key, a repeated finalize does not register a second File
+            upload_key, fobj = self.file_app_services.upload_file(
+                {
+                    "upload_file": assembled,
+                    "file_type": session.file_type,
+                    "size_soft_limit_mb": session.size_soft_limit_mb,
+                    "idempotency_key": "resumable:{}".format(session.upload_id),
+                }
+            )
+        finally:
+            assembled.close()
+
+        session.file_id, session.upload_key = str(fobj.id), upload_key
+        self.session_store.save(session)
+        self._delete_parts(storage, session)
+        return session
+
+    @instrumented("resumable_abort")
+    def abort(self, user, upload_id):
+        session = self.get_session(user, upload_id)
+        self._delete_parts(get_media_storage(), session)
+        self.session_store.delete(session.upload_id)
+
+    def _delete_parts(self, storage, session: UploadSession):
+        for _, part_key in session.parts:
+            try:
+                storage.delete(part_key)
+            except Exception as e:
+                # the reaper removes unreferenced parts later
+                logger.warning("Upload part {} could not be deleted - {}".format(part_key, e))
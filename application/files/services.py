@@ -1,31 +1,87 @@
 # python imports
 from io import BytesIO
+import uuid
+import json
+import time
+import asyncio
+import hashlib
+import base64
+import datetime
+import typing
+from decimal import Decimal
+import itertools
 import os
 import logging
-from PIL import Image
 import copy
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # django imports
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
-from django.http import FileResponse
+from django.core.files import File as DjangoFile
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.utils.crypto import get_random_string
-from storages.backends.s3boto3 import S3Boto3Storage
-from rest_framework import serializers
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
 from django.conf import settings
 
 # app imports
 from domain.files.services import FileServices
-from domain.files.models import File, FileFactory
-from interface.storages.custom_storage import MediaStorage
+from domain.files.models import File, FileFactory, FileMetaData
 from application.app_access_control.services import UserAccessController
-from application.files.exceptions import FileUploadException
+from application.files.exceptions import FileUploadException, IdempotencyException
+from application.files.async_storage import AsyncStorage
+from application.files.storages import get_media_storage
+from application.files.instrumentation import instrumented, metrics
+from application.files.image_probe import probe_image_size
+from application.files.sniffing import SNIFF_BYTES, content_matches
+from application.files.idempotency import file_fingerprint
+from application.files.compression import (
+    accepts_encoding,
+    adecompress_chunks,
+    compress_file,
+    decompress_chunks,
+    get_storage_encoding,
+    iter_file_chunks,
+    DecompressingReader,
+    is_compressible,
+)
+from application.files.archives import ArchiveLimits, iter_archive_members
+from application.files.access import access_recorder
+from application.files.bundles import (
+    ARCHIVE_FORMATS,
+    BundleMember,
+    stream_archive,
+    unique_archive_names,
+)
 from infrastructure.logger.models import AttributeLogger
 
-# local imports
-from .tests_helper import create_test_file, create_file_with_bytes
-
 logger = AttributeLogger(logging.getLogger(__name__))
 
+SIZE_HARD_LIMIT_MB = getattr(settings, "FILES_SIZE_HARD_LIMIT_MB", 50)
+BATCH_UPLOAD_MAX_WORKERS = getattr(settings, "FILE_BATCH_UPLOAD_MAX_WORKERS", 8)
+BATCH_UPLOAD_MAX_FILES = getattr(settings, "FILE_BATCH_UPLOAD_MAX_FILES", 500)
+# extracted archive member bytes collected before a batch is stored, members are spooled to temporary
+# files beyond FILES_ARCHIVE_MEMBER_MAX_MEMORY each
+ARCHIVE_BATCH_MAX_BYTES = getattr(settings, "FILES_ARCHIVE_BATCH_MAX_BYTES", 16 * 1000 * 1000)
+UPLOAD_ATTEMPTS = getattr(settings, "FILES_UPLOAD_ATTEMPTS", 3)
+UPLOAD_RETRY_BACKOFF = getattr(settings, "FILES_UPLOAD_RETRY_BACKOFF", 0.2)
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+# how long a request waits for a concurrent request with the same idempotency key
+IDEMPOTENCY_WAIT_TIMEOUT = getattr(settings, "FILES_IDEMPOTENCY_WAIT_TIMEOUT", 30)
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+SEARCH_PAGE_SIZE = getattr(settings, "FILES_SEARCH_PAGE_SIZE", 50)
+SEARCH_MAX_PAGE_SIZE = getattr(settings, "FILES_SEARCH_MAX_PAGE_SIZE", 200)
+SEARCH_MAX_QUERY_LENGTH = 200
+BUNDLE_MAX_FILES = getattr(settings, "FILES_BUNDLE_MAX_FILES", 1000)
+BUNDLE_PREFETCH = getattr(settings, "FILES_BUNDLE_PREFETCH", 4)
+# PIL's decompression bomb limit, PIL itself is only imported for images the header prober does not know
+DEFAULT_MAX_IMAGE_PIXELS = 1024 * 1024 * 1024 // 4 // 3
+
 
 class FileAppServices:
     def __init__(self, user_access_controller: UserAccessController, log: AttributeLogger):
@@ -37,13 +93,140 @@ class FileAppServices:
         # TODO:
         # Fetch controller by user id
         # If controller does not exist propagate or handle exception
-        return self.file_services.get_file_repo().get(id=id)
+        return self.file_services.get_file_read_repo(user.id).get(id=id)
 
-    def list_files(self, user) -> QuerySet:
+    def list_files(self, user, filters=None, for_update=False) -> QuerySet:
+        """
+        Files uploaded by the user, narrowed down by the optional filters
+        (status, created_after, created_before, modified_after, modified_before, mime_type, name_prefix).
+        for_update reads from the primary, for Files that are saved again.
+        """
         # TODO:
         # Fetch controller by user id
         # If controller does not exist propagate or handle exception
-        return self.file_services.get_file_repo().all()
+        return self.file_services.filter_files(
+            uploader=user.id, for_update=for_update, **self._filter_kwargs(filters)
+        )
+
+    @instrumented("search_files")
+    def search_files(self, user, query, cursor=None, page_size=None, filters=None):
+        """
+        Ranked search over the user's files, takes the filters of list_files.
+        Pages are cut with a (rank, id) keyset instead of offsets, so deep pages cost the same as the first one.
+        Returns the files of the page and the cursor of the next page, None on the last page.
+        """
+        query = (query or "").strip()
+        if not query:
+            raise ValidationError("q is required.")
+        if len(query) > SEARCH_MAX_QUERY_LENGTH:
+            raise ValidationError(
+                "q is too long - {} > {}.".format(len(query), SEARCH_MAX_QUERY_LENGTH)
+            )
+        page_size = self._page_size(page_size)
+
+        queryset = self.file_services.search_files(
+            query, uploader=user.id, **self._filter_kwargs(filters)
+        ).order_by("-search_rank", "id")
+        if cursor:
+            rank, last_id = self._decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(search_rank__lt=rank) | Q(search_rank=rank, id__gt=last_id)
+            )
+
+        files = list(queryset[: page_size + 1])
+        next_cursor = None
+        if len(files) > page_size:
+            files = files[:page_size]
+            next_cursor = self._encode_cursor(files[-1])
+        return files, next_cursor
+
+    @instrumented("list_files_page")
+    def list_files_page(self, user, cursor=None, page_size=None, filters=None):
+        """
+        The user's files newest first, cut into pages with a (created_at, id) keyset. Every page bounds
+        created_at from above, so on a partitioned table it only reads the partitions up to the cursor.
+        Returns the files of the page and the cursor of the next page, None on the last page.
+        """
+        page_size = self._page_size(page_size)
+        queryset = self.list_files(user, filters).order_by("-created_at", "-id")
+        if cursor:
+            created_at, last_id = self._decode_list_cursor(cursor)
+            # the redundant upper bound is what lets postgres prune partitions
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=last_id)
+            )
+
+        files = list(queryset[: page_size + 1])
+        next_cursor = None
+        if len(files) > page_size:
+            files = files[:page_size]
+            value = json.dumps([files[-1].created_at.isoformat(), str(files[-1].id)]).encode()
+            next_cursor = base64.urlsafe_b64encode(value).decode()
+        return files, next_cursor
+
+    def _decode_list_cursor(self, cursor):
+        try:
+            created_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(created_at)
+            return created_at, uuid.UUID(last_id)
+        except (ValueError, TypeError):
+            raise ValidationError("cursor is not valid.")
+
+    def _page_size(self, page_size) -> int:
+        try:
+            page_size = int(page_size or SEARCH_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError("page_size is not valid - {}.".format(page_size))
+        if not 0 < page_size <= SEARCH_MAX_PAGE_SIZE:
+            raise ValidationError(
+                "page_size must be between 1 and {}.".format(SEARCH_MAX_PAGE_SIZE)
+            )
+        return page_size
+
+    def _encode_cursor(self, file):
+        value = json.dumps([str(file.search_rank), str(file.id)]).encode()
+        return base64.urlsafe_b64encode(value).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            rank, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return Decimal(rank), uuid.UUID(last_id)
+        except (ValueError, TypeError, ArithmeticError):
+            raise ValidationError("cursor is not valid.")
+
+    def _filter_kwargs(self, filters) -> dict:
+        filters = filters or {}
+        status = filters.get("status") or None
+        if status is not None and status not in dict(File.STATUS_CHOICES):
+            raise ValidationError("status is not valid - {}.".format(status))
+        return {
+            "status": status,
+            "created_after": self._parse_datetime(filters, "created_after"),
+            "created_before": self._parse_datetime(filters, "created_before"),
+            "modified_after": self._parse_datetime(filters, "modified_after"),
+            "modified_before": self._parse_datetime(filters, "modified_before"),
+            "mime_type": filters.get("mime_type") or None,
+            "name_prefix": filters.get("name_prefix") or None,
+        }
+
+    def _parse_datetime(self, filters, key):
+        value = filters.get(key)
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            try:
+                parsed_date = parse_date(value)
+            except ValueError:
+                parsed_date = None
+            if parsed_date is None:
+                raise ValidationError("{} is not a valid date - {}.".format(key, value))
+            parsed = datetime.datetime.combine(parsed_date, datetime.time.min)
+        if settings.USE_TZ and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
 
     def delete_file_soft(self, id) -> QuerySet:
         # TODO:
@@ -52,10 +235,12 @@ class FileAppServices:
         file = self.file_services.get_file_repo().get(id=id)
         file.status = "deactivated"
         file.save()
+        self.file_services.record_write(file.uploader)
         return file
 
+    @instrumented("file_validation")
     def file_validation(self, file_obj, file_type=None, size_soft_limit_mb=None):
-        size_hard_limit_mb = 50
+        size_hard_limit_mb = SIZE_HARD_LIMIT_MB
         content_type = self.get_mime_type(file_obj.name)
         if file_type != "" and file_type != None:
             if file_obj.content_type != file_type:
@@ -64,7 +249,7 @@ class FileAppServices:
                         file_obj.content_type, file_type
                     )
                 )
-                raise serializers.ValidationError(
+                raise ValidationError(
                     "File ( {} ) does not match file_type {}.".format(
                         file_obj.content_type, file_type
                     )
@@ -73,9 +258,18 @@ class FileAppServices:
             logger.warning(
                 "File type not permitted - {} .  ".format(file_obj.content_type)
             )
-            raise serializers.ValidationError(
+            raise ValidationError(
                 "File type not permitted - {}.".format(file_obj.content_type)
             )
+        head = file_obj.read(SNIFF_BYTES)
+        file_obj.seek(0)
+        if not content_matches(content_type["mime_type"], head):
+            logger.warning(
+                "File content does not match {} - {}".format(content_type["mime_type"], file_obj.name)
+            )
+            raise ValidationError(
+                "File content does not match its type - {}.".format(content_type["mime_type"])
+            )
         if size_soft_limit_mb != "" and size_soft_limit_mb != None:
             if (int(size_soft_limit_mb) * 1000000) < file_obj.size:
                 logger.warning(
@@ -83,7 +277,7 @@ class FileAppServices:
                         file_obj.size
                     )
                 )
-                raise serializers.ValidationError(
+                raise ValidationError(
                     "File not permitted - {} MB > size_soft_limit.".format(
                         file_obj.size
                     )
@@ -94,7 +288,7 @@ class FileAppServices:
                     file_obj.size
                 )
             )
-            raise serializers.ValidationError(
+            raise ValidationError(
                 "File size not permitted - {} MB > size_hard_limit.".format(
                     file_obj.size
                 )
@@ -102,36 +296,43 @@ class FileAppServices:
         if content_type["mime_type"].split("/")[0] == "image":
             allowed_max_width = settings.MAX_PROFILE_PIC_WIDTH
             allowed_max_height = settings.MAX_PROFILE_PIC_HEIGHT
-            image_height = self.build_meta_data(file_obj).get("height")
-            image_width = self.build_meta_data(file_obj).get("width")
+            meta_data = self.build_meta_data(file_obj)
+            image_height = meta_data.get("height")
+            image_width = meta_data.get("width")
             if image_height > allowed_max_height or image_width > allowed_max_width:
                 logger.warning(
                     "Image Height or Width not permitted - Height:{} Pixel, Width:{}Pixel > allowed_max_height: {} Pixel,  allowed_max_width: {} Pixel ".format(
                         image_height, image_width, allowed_max_height, allowed_max_width
                     )
                 )
-                raise serializers.ValidationError(
+                raise ValidationError(
                     "Image Height or Width not permitted - Height:{} Pixel, Width:{}Pixel > allowed_max_height: {} Pixel,  allowed_max_width: {} Pixel ".format(
                         image_height, image_width, allowed_max_height, allowed_max_width
                     )
                 )
 
-    def file_upload_s3(self, user, file_obj, deepcopy=True) -> str:
+    @instrumented("file_upload_s3")
+    def file_upload_s3(self, user, file_obj, deepcopy=True, key=None) -> str:
         # TODO:
         # Fetch controller by user id
         # If controller does not exist propagate or handle exception
-        file_path_within_bucket = os.path.join(user.username, get_random_string(12))
+        file_path_within_bucket = key or os.path.join(user.username, get_random_string(12))
         if(deepcopy):
             file_obj_copy = copy.deepcopy(file_obj)
         else: # added because of a pickle problem on terms and conditions, does not impact any module
             file_obj_copy = file_obj
-        media_storage = MediaStorage()
+        content_encoding = self.get_storage_encoding(file_obj)
+        if content_encoding is not None:
+            file_obj_copy = compress_file(file_obj_copy, content_encoding)
+        media_storage = get_media_storage()
         media_storage.save(file_path_within_bucket, file_obj_copy)
         file_url = media_storage.url(file_path_within_bucket)
+        metrics.inc("files_bytes_in_total", self._file_size(file_obj))
 
         # return key of the s3 object
         return file_path_within_bucket
 
+    @instrumented("create_file_from_s3")
     def create_file_from_s3(self, user, file_obj, upload_key) -> File:
         # TODO:
         # Fetch controller by user id
@@ -157,45 +358,78 @@ class FileAppServices:
             content_type = self.get_mime_type(file_obj.origin_name)["mime_type"]
             if content_type in allowed_files:
                 return self.read_file_from_s3(
-                    user, file_obj.location, file_obj.origin_name
+                    user,
+                    file_obj.location,
+                    file_obj.origin_name,
+                    content_encoding=self.get_content_encoding(file_obj),
+                    size=self.get_file_size(file_obj),
                 )
             else:
                 logger.warning(
                     "File type not permitted - {}.".format(file_obj.content_type)
                 )
-                raise serializers.ValidationError(
+                raise ValidationError(
                     "File type not permitted - {}.".format(file_obj.content_type)
                 )
         else:
-            raise serializers.ValidationError(
+            raise ValidationError(
                 "file_id does not exist - {}.".format(file_id)
             )
 
-    def read_file_from_s3(self, user, key, filename) -> S3Boto3Storage:
+    @instrumented("read_file_from_s3")
+    def read_file_from_s3(self, user, key, filename, content_encoding=None, size=None):
         # TODO:
         # Fetch controller by user id
         # If controller does not exist propagate or handle exception
-        media_storage = MediaStorage()
-        read_file = media_storage.open(key)
+        media_storage = get_media_storage()
+        if content_encoding is not None:
+            read_file = DjangoFile(
+                DecompressingReader(media_storage.open(key), content_encoding, size=size), name=filename
+            )
+        elif hasattr(media_storage, "open_mapped"):
+            read_file = media_storage.open_mapped(key)
+        else:
+            read_file = media_storage.open(key)
         return read_file
 
+    @instrumented("file_delete_s3")
     def file_delete_s3(self, user, key) -> bool:
-        media_storage = MediaStorage()
+        media_storage = get_media_storage()
         media_storage.delete(key)
         return True
 
-    def file_download_from_s3(self, user, key, filename) -> FileResponse:
+    @instrumented("file_download_from_s3")
+    def file_download_from_s3(
+        self, user, key, filename, content_encoding=None, accept_encoding=None
+    ) -> FileResponse:
+        """
+        Compressed objects are sent as stored when the client accepts their encoding,
+        otherwise they are decompressed while they stream out
+        """
         # TODO:
         # Fetch controller by user id
         # If controller does not exist propagate or handle exception
-        media_storage = MediaStorage()
+        media_storage = get_media_storage()
         download_file = media_storage.open(key)
-        content_type = self.get_mime_type(filename)
+        content_type = self.get_mime_type(filename)["mime_type"]
 
-        response = FileResponse(download_file, content_type=content_type)
+        if content_encoding is not None and not accepts_encoding(accept_encoding, content_encoding):
+            response = StreamingHttpResponse(
+                decompress_chunks(iter_file_chunks(download_file), content_encoding),
+                content_type=content_type,
+            )
+        else:
+            response = FileResponse(download_file, content_type=content_type)
+            if content_encoding is not None:
+                response["Content-Encoding"] = content_encoding
+        if content_encoding is not None:
+            response["Vary"] = "Accept-Encoding"
         response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        if response.has_header("Content-Length"):
+            metrics.inc("files_bytes_out_total", int(response["Content-Length"]))
         return response
 
+    @instrumented("create_file_from_dict")
     def create_file_from_dict(self, user, data: dict) -> File:
         # TODO:
         # Fetch controller by user id
@@ -211,8 +445,10 @@ class FileAppServices:
             user.id, title, description, origin_name, location, status, meta_data
         )
         data_file.save()
+        self.file_services.record_write(user.id)
         return data_file
 
+    @instrumented("update_file_from_dict")
     def update_file_from_dict(self, user, instance: File, data: dict) -> File:
         # TODO:
         # Fetch controller by user id
@@ -229,7 +465,9 @@ class FileAppServices:
         instance.update_entity(
             user.id, title, description, origin_name, location, status, meta_data
         )
-        instance.save()
+        # instances read from a replica are written to the primary
+        instance.save(using=router.db_for_write(File))
+        self.file_services.record_write(user.id)
         return instance
 
     def get_mime_type(self, filename):
@@ -436,30 +674,28 @@ class FileAppServices:
         resp["mime_type"] = mimeTypes[extension]
         return resp
 
+    @instrumented("build_meta_data")
     def build_meta_data(self, file_obj) -> dict:
         """
         read meta data for uploaded file
         """
-        meta_data = dict()
-        if type(file_obj) == BytesIO:
-            filesize_in_bytes = file_obj.getbuffer().nbytes
-        else:
-            filesize_in_bytes = file_obj.size
+        filesize_in_bytes = self._file_size(file_obj)
         mime_type = self.get_mime_type(filename=file_obj.name)["mime_type"]
-        meta_data["mime_type"] = mime_type
-        meta_data["filesize_in_bytes"] = filesize_in_bytes
+        content_encoding = get_storage_encoding(mime_type, filesize_in_bytes)
+        width = height = None
         if mime_type.split("/")[0] == "image":
-            with Image.open(file_obj) as img:
-                width, height = img.size
-            meta_data["width"] = width
-            meta_data["height"] = height
-        return meta_data
+            width, height = self.get_image_size(file_obj)
+        return FileMetaData(
+            mime_type=mime_type,
+            filesize_in_bytes=filesize_in_bytes,
+            width=width,
+            height=height,
+            content_encoding=content_encoding,
+        ).to_dict()
 
     def upload_file_from_terminal(self, user, file_obj) -> str:
-        file_path_within_bucket = os.path.join(user.username, get_random_string(12))
-        media_storage = MediaStorage()
-        media_storage.save(file_path_within_bucket, file_obj)
-        file_url = media_storage.url(file_path_within_bucket)
+        meta_data = self.build_meta_data(file_obj)
+        file_path_within_bucket = self.file_upload_s3(user, file_obj, deepcopy=False)
 
         validated_data = {
             "uploader": user.id,
@@ -468,31 +704,515 @@ class FileAppServices:
             "origin_name": file_obj.name,
             "location": file_path_within_bucket,
             "status": "active",
-            "meta_data":"",
+            "meta_data": meta_data,
         }
         fobj = self.create_file_from_dict(user, validated_data)
         return fobj
 
+    @instrumented("upload_file")
     def upload_file(self, data):
+        """
+        Two phase upload: a pending File is registered first, the object is written (with retries) and
+        the File is activated in a transaction once the object exists. With an idempotency key the object
+        key is derived from it, so a repeated request rewrites the same object and returns the same File.
+        Uploads interrupted halfway stay pending until the retry_pending_uploads command finishes or
+        rolls them back.
+        """
         user = self.user_access_controller.get_user()
+        file_obj = data["upload_file"]
+        idempotency_key = self._idempotency_key(data)
+
+        self.file_validation(file_obj, data["file_type"], data["size_soft_limit_mb"])
+        meta_data = self.build_meta_data(file_obj)
+        fobj, created = self._begin_upload(user, file_obj, meta_data, idempotency_key)
+        if not created:
+            # replayed request, only the request that registered the File writes or removes its object
+            fobj = self._await_upload(fobj)
+            return fobj.location, fobj
 
         try:
-            self.file_validation(
-                data["upload_file"], data["file_type"], data["size_soft_limit_mb"]
+            self._with_retries(self._store_object, user, file_obj, fobj.location)
+        except Exception as e:
+            logger.warning("File {} could not be uploaded - {}".format(file_obj.name, e))
+            self._abort_upload(user, fobj)
+            raise FileUploadException(
+                "file-upload-exception",
+                "The specified file cannot be uploaded"
+            )
+        fobj = self._activate_upload(fobj)
+        return fobj.location, fobj
+
+    def _idempotency_key(self, data):
+        idempotency_key = data.get("idempotency_key") or None
+        if idempotency_key is not None and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValidationError(
+                "idempotency_key is too long - {} > {}.".format(len(idempotency_key), IDEMPOTENCY_KEY_MAX_LENGTH)
             )
-            upload_key = self.file_upload_s3(
-                user, 
-                data["upload_file"]
+        return idempotency_key
+
+    def _upload_location(self, user, idempotency_key=None) -> str:
+        if idempotency_key is None:
+            return os.path.join(user.username, get_random_string(12))
+        digest = hashlib.sha256("{}:{}".format(user.id, idempotency_key).encode("utf-8")).hexdigest()
+        return os.path.join(user.username, digest[:24])
+
+    def _begin_upload(self, user, file_obj, meta_data, idempotency_key=None):
+        """
+        Registers the pending File, returns the File of an earlier request with the same idempotency key instead.
+        Raises IdempotencyException when that request uploaded a different file.
+        """
+        entity = FileFactory.build_entity_with_id(
+            user.id,
+            "{} uploaded".format(file_obj.name),
+            "A file is uploaded to s3",
+            file_obj.name,
+            self._upload_location(user, idempotency_key),
+            File.PENDING_STATUS,
+            meta_data,
+        )
+        entity.idempotency_key = idempotency_key
+        if idempotency_key is not None:
+            entity.idempotency_fingerprint = file_fingerprint(file_obj)
+        try:
+            with transaction.atomic():
+                entity.save(force_insert=True)
+        except IntegrityError:
+            if idempotency_key is None:
+                raise
+            existing = self.file_services.get_file_repo().get(uploader=user.id, idempotency_key=idempotency_key)
+            # the key outlives the cached response of the first request, the File still tells a reuse apart
+            if existing.idempotency_fingerprint not in (None, entity.idempotency_fingerprint):
+                raise IdempotencyException(
+                    "idempotency-key-reused", "The Idempotency-Key was already used for a different request"
+                )
+            return existing, False
+        return entity, True
+
+    def _settled_upload(self, fobj) -> typing.Optional[File]:
+        """
+        The File registered by another request with the same idempotency key, None while it is still pending
+        """
+        settled = self.file_services.get_file_repo().filter(id=fobj.id).first()
+        if settled is None:
+            # the other request failed and rolled its File back
+            raise IdempotencyException(
+                "idempotency-key-failed", "The request with this Idempotency-Key failed, it can be retried"
             )
-            file_object = self.create_file_from_s3(
-                user, 
-                data["upload_file"], 
-                upload_key
+        return None if settled.status == File.PENDING_STATUS else settled
+
+    def _upload_in_progress(self) -> IdempotencyException:
+        return IdempotencyException(
+            "idempotency-key-in-progress", "A request with this Idempotency-Key is still in progress"
+        )
+
+    def _await_upload(self, fobj) -> File:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            settled = self._settled_upload(fobj)
+            if settled is not None:
+                return settled
+            if time.monotonic() >= deadline:
+                raise self._upload_in_progress()
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    def _store_object(self, user, file_obj, key):
+        file_obj.seek(0)
+        # spooled uploads can not be deep copied, the storage only reads them
+        deepcopy = not isinstance(file_obj, TemporaryUploadedFile)
+        return self.file_upload_s3(user, file_obj, deepcopy=deepcopy, key=key)
+
+    def _with_retries(self, func, *args):
+        # storage writes go to a fixed key, repeating one is safe
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt + 1 == UPLOAD_ATTEMPTS:
+                    raise
+                logger.warning("Storage write failed, retrying - {}".format(e))
+                time.sleep(UPLOAD_RETRY_BACKOFF * 2 ** attempt)
+
+    def _activate_upload(self, fobj) -> File:
+        with transaction.atomic():
+            try:
+                fobj = self.file_services.get_file_repo().select_for_update().get(id=fobj.id)
+            except File.DoesNotExist:
+                raise FileUploadException(
+                    "file-upload-exception",
+                    "The specified file cannot be uploaded"
+                )
+            if fobj.status == File.PENDING_STATUS:
+                fobj.status = File.ACTIVE_STATUS
+                fobj.save(update_fields=["status", "modified_at"])
+        self.file_services.record_write(fobj.uploader)
+        return fobj
+
+    def _abort_upload(self, user, fobj):
+        try:
+            self.file_delete_s3(user, fobj.location)
+            self.file_services.get_file_repo().filter(id=fobj.id, status=File.PENDING_STATUS).delete()
+        except Exception as e:
+            # left to retry_pending_uploads
+            logger.warning("Pending file {} could not be rolled back - {}".format(fobj.id, e))
+
+    @instrumented("upload_files")
+    def upload_files(self, data) -> list:
+        """
+        Validates, stores and registers many files at once. Storage uploads run on a bounded
+        thread pool and the File rows are inserted with a single bulk insert.
+        Returns one result dict per uploaded file, in request order.
+        """
+        user = self.user_access_controller.get_user()
+        upload_files = data["upload_files"]
+        if len(upload_files) > BATCH_UPLOAD_MAX_FILES:
+            raise ValidationError(
+                "Too many files - {} > {}.".format(len(upload_files), BATCH_UPLOAD_MAX_FILES)
             )
-            return upload_key, file_object
 
-        except:
-            FileUploadException(
-                "file-upload-exception",
-                "The specified file cannot be uploaded"
+        results, validated = self._validate_files(
+            upload_files, data["file_type"], data["size_soft_limit_mb"]
+        )
+        self._store_files(user, results, validated)
+        return results
+
+    @instrumented("upload_archive")
+    def upload_archive(self, data) -> list:
+        """
+        Extracts a zip or tar archive and registers every member as its own File. Members are
+        extracted one at a time and stored in batches like upload_files, each one goes through
+        file_validation and build_meta_data. When an archive limit is exceeded everything stored
+        from the archive so far is removed again and FileUploadException is raised.
+        """
+        user = self.user_access_controller.get_user()
+        archive = data["upload_file"]
+        self.file_validation(archive, data["file_type"], None)
+        mime_type = self.get_mime_type(archive.name)["mime_type"]
+
+        def content_type(name):
+            try:
+                return self.get_mime_type(name)["mime_type"]
+            except KeyError:
+                return None
+
+        limits = ArchiveLimits.from_settings(SIZE_HARD_LIMIT_MB * 1000000)
+        members = iter_archive_members(archive, mime_type, limits, content_type)
+        results = []
+        stored = []
+        batch = []
+        try:
+            batch_bytes = 0
+            for member in itertools.chain(members, [None]):
+                if member is not None:
+                    batch.append(member)
+                    batch_bytes += member.size
+                    if len(batch) < BATCH_UPLOAD_MAX_FILES and batch_bytes < ARCHIVE_BATCH_MAX_BYTES:
+                        continue
+                if batch:
+                    batch_results, validated = self._validate_files(
+                        batch, None, data["size_soft_limit_mb"]
+                    )
+                    stored += self._store_files(user, batch_results, validated)
+                    results += batch_results
+                    self._close_files(batch)
+                    batch = []
+                    batch_bytes = 0
+        except FileUploadException:
+            self._discard_files(user, stored)
+            raise
+        finally:
+            self._close_files(batch)
+        return results
+
+    def _close_files(self, files):
+        for file_obj in files:
+            file_obj.close()
+
+    def _validate_files(self, upload_files, file_type, size_soft_limit_mb):
+        results = []
+        validated = []
+        for file_obj in upload_files:
+            result = {"origin_name": file_obj.name, "status": "failed"}
+            results.append(result)
+            try:
+                self.file_validation(file_obj, file_type, size_soft_limit_mb)
+                meta_data = self.build_meta_data(file_obj)
+            except Exception as e:
+                result["error"] = self._error_message(e)
+                continue
+            validated.append((result, file_obj, meta_data))
+        return results, validated
+
+    def _store_files(self, user, results, validated) -> list:
+        """
+        Uploads the validated files concurrently and registers them with one bulk insert,
+        updates results in place and returns the stored (file_id, upload_key) pairs
+        """
+        uploaded = []
+        if validated:
+            max_workers = min(BATCH_UPLOAD_MAX_WORKERS, len(validated))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    # spooled files can not be deep copied, the storage only reads them
+                    executor.submit(
+                        self.file_upload_s3, user, file_obj, isinstance(file_obj, InMemoryUploadedFile)
+                    ): (result, file_obj, meta_data)
+                    for result, file_obj, meta_data in validated
+                }
+                for future in as_completed(futures):
+                    result, file_obj, meta_data = futures[future]
+                    try:
+                        upload_key = future.result()
+                    except Exception as e:
+                        logger.warning(
+                            "File {} could not be uploaded - {}".format(file_obj.name, e)
+                        )
+                        result["error"] = "The specified file cannot be uploaded"
+                        continue
+                    uploaded.append((result, file_obj, meta_data, upload_key))
+
+        # keep the insert order stable regardless of upload completion order
+        position = {id(result): index for index, result in enumerate(results)}
+        uploaded.sort(key=lambda item: position[id(item[0])])
+        entities = [
+            FileFactory.build_entity_with_id(
+                user.id,
+                "{} uploaded".format(file_obj.name),
+                "A file is uploaded to s3",
+                file_obj.name,
+                upload_key,
+                File.ACTIVE_STATUS,
+                meta_data,
             )
+            for _, file_obj, meta_data, upload_key in uploaded
+        ]
+        try:
+            self.file_services.bulk_create_files(entities)
+        except Exception as e:
+            logger.warning("Files could not be registered - {}".format(e))
+            for result, _, _, upload_key in uploaded:
+                self.file_delete_s3(user, upload_key)
+                result["error"] = "The specified file cannot be registered"
+            return []
+        self.file_services.record_write(user.id)
+
+        for (result, _, _, upload_key), entity in zip(uploaded, entities):
+            result.update(
+                {"status": "uploaded", "upload_key": upload_key, "file_id": entity.id}
+            )
+        return [(entity.id, upload_key) for (_, _, _, upload_key), entity in zip(uploaded, entities)]
+
+    def _discard_files(self, user, stored):
+        self.file_services.get_file_repo().filter(id__in=[file_id for file_id, _ in stored]).delete()
+        for _, upload_key in stored:
+            self.file_delete_s3(user, upload_key)
+
+    def get_image_size(self, file_obj) -> tuple:
+        """
+        Reads the image dimensions from the header bytes, PIL is only used for formats the prober does not know.
+        Images above FILES_MAX_IMAGE_PIXELS are rejected before anything is decoded.
+        """
+        size = probe_image_size(file_obj)
+        if size is None:
+            try:
+                from PIL import Image
+
+                # Image.open only parses the header, pixel data is decoded lazily
+                with Image.open(file_obj) as img:
+                    size = img.size
+            except Image.DecompressionBombError:
+                raise ValidationError("Image pixel count not permitted.")
+            finally:
+                file_obj.seek(0)
+        width, height = size
+        max_pixels = getattr(settings, "FILES_MAX_IMAGE_PIXELS", DEFAULT_MAX_IMAGE_PIXELS)
+        if max_pixels and width * height > max_pixels:
+            logger.warning(
+                "Image pixel count not permitted - {} x {} > {} pixels".format(width, height, max_pixels)
+            )
+            raise ValidationError(
+                "Image pixel count not permitted - {} x {} > {} pixels.".format(width, height, max_pixels)
+            )
+        return width, height
+
+    @instrumented("bundle_files")
+    def bundle_files(self, user, file_ids, archive_format="zip") -> StreamingHttpResponse:
+        """
+        Streams many of the user's Files as one ZIP or TAR archive. The rows are fetched with one query and
+        the storage reads are prefetched on a thread pool ahead of the archive writer.
+        """
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValidationError(
+                "archive_format not permitted - {}.".format(archive_format)
+            )
+        if not file_ids or len(file_ids) > BUNDLE_MAX_FILES:
+            raise ValidationError(
+                "Between 1 and {} file_ids are required.".format(BUNDLE_MAX_FILES)
+            )
+        try:
+            file_ids = list(dict.fromkeys(uuid.UUID(str(file_id)) for file_id in file_ids))
+        except ValueError:
+            raise ValidationError("file_ids must be UUIDs.")
+
+        files = {
+            fobj.id: fobj
+            for fobj in self.file_services.get_file_read_repo(user.id).filter(
+                id__in=file_ids, uploader=user.id, status=File.ACTIVE_STATUS
+            )
+        }
+        missing = [str(file_id) for file_id in file_ids if file_id not in files]
+        if missing:
+            raise ValidationError(
+                "file_id does not exist - {}.".format(", ".join(missing))
+            )
+
+        ordered = [files[file_id] for file_id in file_ids]
+        for fobj in ordered:
+            self.record_access(fobj)
+        members = []
+        for arcname, fobj in zip(unique_archive_names(f.origin_name for f in ordered), ordered):
+            meta_data = fobj.get_meta_data()
+            members.append(
+                BundleMember(
+                    arcname=arcname,
+                    location=fobj.location,
+                    origin_name=fobj.origin_name,
+                    content_encoding=meta_data.content_encoding if meta_data else None,
+                    size=meta_data.filesize_in_bytes if meta_data else None,
+                    compressible=meta_data is not None and is_compressible(meta_data.mime_type),
+                    modified_at=fobj.modified_at.timestamp() if fobj.modified_at else None,
+                )
+            )
+
+        def open_member(member):
+            return self.read_file_from_s3(
+                user,
+                member.location,
+                member.origin_name,
+                content_encoding=member.content_encoding,
+                size=member.size,
+            )
+
+        response = StreamingHttpResponse(
+            stream_archive(members, archive_format, open_member, prefetch=BUNDLE_PREFETCH),
+            content_type=ARCHIVE_FORMATS[archive_format],
+        )
+        response["Content-Disposition"] = 'attachment; filename="files.{}"'.format(archive_format)
+        return response
+
+    def get_storage_encoding(self, file_obj):
+        try:
+            mime_type = self.get_mime_type(file_obj.name)["mime_type"]
+        except KeyError:
+            return None
+        return get_storage_encoding(mime_type, self._file_size(file_obj))
+
+    def record_access(self, file: File):
+        """
+        Counts a read of the File for the tiering policy, the statistics are written in batches
+        """
+        meta_data = file.get_meta_data()
+        access_recorder.record(file.id, meta_data.filesize_in_bytes if meta_data is not None else None)
+
+    def get_content_encoding(self, file: File):
+        meta_data = file.get_meta_data()
+        return meta_data.content_encoding if meta_data is not None else None
+
+    def get_file_size(self, file: File):
+        meta_data = file.get_meta_data()
+        return meta_data.filesize_in_bytes if meta_data is not None else None
+
+    def _file_size(self, file_obj) -> int:
+        if type(file_obj) == BytesIO:
+            return file_obj.getbuffer().nbytes
+        return file_obj.size
+
+    def _error_message(self, error) -> str:
+        if isinstance(error, ValidationError):
+            return " ".join(str(detail) for detail in error.detail)
+        if isinstance(error, KeyError):
+            return "File type not permitted."
+        return "The specified file cannot be uploaded"
+
+    async def aget_file(self, user, id) -> File:
+        return await sync_to_async(self.get_file)(user, id)
+
+    async def arecord_access(self, file: File):
+        await sync_to_async(self.record_access)(file)
+
+    async def acreate_file_from_dict(self, user, data: dict) -> File:
+        return await sync_to_async(self.create_file_from_dict)(user, data)
+
+    @instrumented("file_upload_s3")
+    async def afile_upload_s3(self, user, file_obj, key=None) -> str:
+        file_path_within_bucket = key or os.path.join(user.username, get_random_string(12))
+        size = self._file_size(file_obj)
+        content_encoding = self.get_storage_encoding(file_obj)
+        if content_encoding is not None:
+            file_obj = await sync_to_async(compress_file, thread_sensitive=False)(
+                file_obj, content_encoding
+            )
+        await AsyncStorage(get_media_storage()).save(file_path_within_bucket, file_obj)
+        metrics.inc("files_bytes_in_total", size)
+
+        # return key of the s3 object
+        return file_path_within_bucket
+
+    async def afile_download_from_s3(
+        self, user, key, filename, content_encoding=None, accept_encoding=None
+    ) -> StreamingHttpResponse:
+        """
+        Streams the storage object in chunks without blocking the event loop.
+        Async iterators as streaming content require Django >= 4.2.
+        """
+        content_type = self.get_mime_type(filename)["mime_type"]
+        chunks = AsyncStorage(get_media_storage()).iter_chunks(key)
+        decompress = content_encoding is not None and not accepts_encoding(accept_encoding, content_encoding)
+        if decompress:
+            chunks = adecompress_chunks(chunks, content_encoding)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        if content_encoding is not None:
+            response["Vary"] = "Accept-Encoding"
+            if not decompress:
+                response["Content-Encoding"] = content_encoding
+        response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+        return response
+
+    @instrumented("upload_file")
+    async def aupload_file(self, data):
+        user = await sync_to_async(self.user_access_controller.get_user)()
+        file_obj = data["upload_file"]
+        idempotency_key = self._idempotency_key(data)
+
+        # validation may decode images, keep it off the event loop
+        await sync_to_async(self.file_validation, thread_sensitive=False)(
+            file_obj, data["file_type"], data["size_soft_limit_mb"]
+        )
+        meta_data = await sync_to_async(self.build_meta_data, thread_sensitive=False)(file_obj)
+        fobj, created = await sync_to_async(self._begin_upload)(user, file_obj, meta_data, idempotency_key)
+        if not created:
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+            while True:
+                settled = await sync_to_async(self._settled_upload)(fobj)
+                if settled is not None:
+                    return settled.location, settled
+                if time.monotonic() >= deadline:
+                    raise self._upload_in_progress()
+                await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                file_obj.seek(0)
+                await self.afile_upload_s3(user, file_obj, key=fobj.location)
+                break
+            except Exception as e:
+                logger.warning("File {} could not be uploaded - {}".format(file_obj.name, e))
+                if attempt + 1 == UPLOAD_ATTEMPTS:
+                    await sync_to_async(self._abort_upload)(user, fobj)
+                    raise FileUploadException(
+                        "file-upload-exception",
+                        "The specified file cannot be uploaded"
+                    )
+                await asyncio.sleep(UPLOAD_RETRY_BACKOFF * 2 ** attempt)
+
+        fobj = await sync_to_async(self._activate_upload)(fobj)
+        return fobj.location, fobj
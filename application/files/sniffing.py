@@ -0,0 +1,89 @@
+# python imports
+import typing
+
+# number of leading bytes needed to recognise every signature below (tar keeps its magic at offset 257)
+SNIFF_BYTES = 512
+
+# (offset, magic, mime type), checked in order
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"\x00\x00\x01\x00", "image/x-icon"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"PK\x05\x06", "application/zip"),
+    (0, b"\x1f\x8b", "application/x-gzip"),
+    (0, b"\x1f\x9d", "application/x-compress"),
+    (0, b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"),
+    (0, b"{\\rtf", "application/rtf"),
+    (0, b"ID3", "audio/mpeg"),
+    (257, b"ustar", "application/x-tar"),
+)
+
+# content types that a declared (extension based) mime type may legitimately contain
+EQUIVALENT_CONTENT = {
+    "application/x-compressed": {"application/x-gzip"},
+    "vnd.ms-excel": {"application/zip"},
+    "application/msword": {"application/x-ole-storage"},
+    "application/vnd.ms-excel": {"application/x-ole-storage"},
+    "application/vnd.ms-powerpoint": {"application/x-ole-storage"},
+    "application/vnd.ms-project": {"application/x-ole-storage"},
+}
+
+# a valid MP3 may start with a frame instead of an ID3 tag and a pre-POSIX tar has no ustar magic,
+# their signatures identify content but are not required of it
+OPTIONAL_SIGNATURE_MIME_TYPES = {"audio/mpeg", "application/x-tar"}
+
+SIGNED_MIME_TYPES = (
+    {mime_type for _, _, mime_type in SIGNATURES} | {"image/webp", "image/bmp"}
+) - OPTIONAL_SIGNATURE_MIME_TYPES
+
+TEXT_MIME_TYPES = {"application/json", "application/x-javascript", "application/x-sh", "image/svg+xml"}
+
+
+def sniff_mime_type(head: bytes) -> typing.Optional[str]:
+    """
+    Detects the content type from the magic bytes at the start of a file, None if no signature matches
+    """
+    for offset, magic, mime_type in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    # "BM" alone is too weak, the bitmap file header also has four reserved zero bytes
+    if head[:2] == b"BM" and head[6:10] == b"\x00\x00\x00\x00":
+        return "image/bmp"
+    return None
+
+
+# control characters that do not occur in text files
+BINARY_BYTES = bytes(set(range(32)) - {7, 8, 9, 10, 12, 13, 27})
+
+
+def looks_like_text(head: bytes) -> bool:
+    """
+    Any encoding passes, text only has to be free of control characters
+    """
+    return len(head.translate(None, BINARY_BYTES)) == len(head)
+
+
+def is_text_mime_type(mime_type: str) -> bool:
+    return mime_type.startswith("text/") or mime_type in TEXT_MIME_TYPES
+
+
+def content_matches(declared_mime_type: str, head: bytes) -> bool:
+    """
+    Checks that the leading bytes of a file agree with the mime type derived from its name.
+    Files with a recognised signature must match it, text types must look like text and
+    formats with a mandatory signature must carry it. Everything else can not be told apart and passes.
+    """
+    sniffed = sniff_mime_type(head)
+    if sniffed is not None:
+        return sniffed == declared_mime_type or sniffed in EQUIVALENT_CONTENT.get(declared_mime_type, ())
+    if is_text_mime_type(declared_mime_type):
+        return looks_like_text(head)
+    return declared_mime_type not in SIGNED_MIME_TYPES
@@ -0,0 +1,29 @@
+# python imports
+from functools import lru_cache
+
+# django imports
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.utils.module_loading import import_string
+
+# local imports
+from .instrumentation import InstrumentedStorage
+
+DEFAULT_STORAGE_BACKEND = "interface.storages.custom_storage.MediaStorage"
+
+
+@lru_cache(maxsize=None)
+def _storage_class(path: str):
+    return import_string(path)
+
+
+def get_media_storage() -> Storage:
+    """
+    Returns an instance of the storage backend configured with FILES_STORAGE_BACKEND.
+    Backends are django storages (save, open, delete, exists, url, listdir), the S3 MediaStorage is the default
+    and interface.storages.local_storage.LocalMediaStorage serves single node deployments and tests.
+    Calls on the returned storage are counted in the file metrics.
+    """
+    return InstrumentedStorage(
+        _storage_class(getattr(settings, "FILES_STORAGE_BACKEND", DEFAULT_STORAGE_BACKEND))()
+    )
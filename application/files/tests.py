@@ -1,11 +1,25 @@
 # python imports
 from time import sleep
+import io
+import os
+import sys
 import json
 import logging
+import datetime
+import tempfile
+import threading
+import subprocess
+from unittest import mock
+from PIL import Image
 
 # django imports
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Count
 from django.db.models.query import QuerySet
+from django.utils import timezone
+from rest_framework import serializers
 
 # app imoprts
 from domain.files.models import File
@@ -18,11 +32,26 @@ from lib.django.test_helper import set_random_seeds
 
 # local imports
 from .services import FileAppServices as fas
-from .tests_helper import create_test_file
+from .tests_helper import InMemoryStorageMixin, create_test_file
+from .checkpoints import FileCheckpoint
+from .storages import get_media_storage
+from .instrumentation import metrics
+from .image_probe import probe_image_size
+from .ingestion import FileIngestionAppServices, iter_directory
+from .reaper import FileReaper, ReaperReport
+from .access import AccessRecorder
+from .tiering import StorageTier, TieringEngine, TieringPolicy, simulate
+from .datasets import DatasetLoader, DatasetSpec, SyntheticFileGenerator, object_content
+from .outbox import PendingUploadRetrier
+from .resumable import ResumableUploadAppServices
+from .idempotency import IdempotencyStore, lock_value, release_lock, request_fingerprint
+from .exceptions import IdempotencyException
+from .sniffing import content_matches
+from .bundles import BundleMember, stream_archive
 
 log = AttributeLogger(logging.getLogger(__name__))
 
-class FileAppServicesTests(TestCase):
+class FileAppServicesTests(InMemoryStorageMixin, TestCase):
     @classmethod
     def setUpTestData(cls):
 
@@ -45,6 +74,52 @@ class FileAppServicesTests(TestCase):
         nqs = self.file_app_services.list_files(self.user_01)
         self.assertEqual(type(nqs), QuerySet)
 
+    def test_list_files_scoped_to_user(self):
+        data = {
+            "title": "Test title",
+            "description": "Test description",
+            "origin_name": "test.png",
+            "location": "test.png",
+            "status": "active",
+            "meta_data": {"mime_type": "image/png", "filesize_in_bytes": 2000},
+        }
+        own = self.file_app_services.create_file_from_dict(self.user_01, data)
+        File.objects.filter(id=self.file_app_services.create_file_from_dict(self.user_01, data).id).update(
+            uploader="c13cce88-42e3-40a1-9402-abf7e2f0a297"
+        )
+
+        self.assertEqual([f.id for f in self.file_app_services.list_files(self.user_01)], [own.id])
+        self.assertEqual(
+            [f.id for f in self.file_app_services.list_files(self.user_01, {"mime_type": "image/png", "created_after": "2000-01-01"})],
+            [own.id],
+        )
+        with self.assertRaises(serializers.ValidationError):
+            self.file_app_services.list_files(self.user_01, {"created_after": "yesterday"})
+
+    def test_list_files_page(self):
+        data = {
+            "title": "Test title",
+            "description": "Test description",
+            "origin_name": "test.png",
+            "location": "test.png",
+            "status": "active",
+            "meta_data": {"mime_type": "image/png", "filesize_in_bytes": 2000},
+        }
+        created = [self.file_app_services.create_file_from_dict(self.user_01, data) for _ in range(5)]
+        # equal timestamps are ordered by id
+        File.objects.filter(id__in=[f.id for f in created[:2]]).update(created_at=created[0].created_at)
+        expected = [f.id for f in File.objects.filter(uploader=self.user_01.id).order_by("-created_at", "-id")]
+
+        found, cursor = [], None
+        while True:
+            files, cursor = self.file_app_services.list_files_page(self.user_01, cursor=cursor, page_size=2)
+            found += [f.id for f in files]
+            if cursor is None:
+                break
+        self.assertEqual(found, expected)
+        with self.assertRaises(serializers.ValidationError):
+            self.file_app_services.list_files_page(self.user_01, cursor="not-a-cursor")
+
     def test_create_file(self):
         data = {
             "uploader": "c13cce88-42e3-40a1-9402-abf7e2f0a297",
@@ -53,7 +128,7 @@ class FileAppServicesTests(TestCase):
             "origin_name": "test.png",
             "location": "https://s3.console.aws.amazon.com/s3/object/dev-general-bucket?region=us-east-2&prefix=test.jpg",
             "status": "active",
-            "meta_data" : json.dumps({'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000})
+            "meta_data" : {'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
         }
         ftc = self.file_app_services.create_file_from_dict(self.user_01, data)
         self.assertEqual(type(ftc), File)
@@ -62,6 +137,51 @@ class FileAppServicesTests(TestCase):
         stored_file = self.file_app_services.file_services.get_file_repo().get(id=ftc.id)
         self.assertEqual(type(stored_file), File)
 
+    def test_create_file_normalizes_encoded_meta_data(self):
+        meta_data = {'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
+        data = {
+            "uploader": "c13cce88-42e3-40a1-9402-abf7e2f0a297",
+            "title": "Test title",
+            "description": "Test description",
+            "origin_name": "test.png",
+            "location": "https://s3.console.aws.amazon.com/s3/object/dev-general-bucket?region=us-east-2&prefix=test.jpg",
+            "status": "active",
+            "meta_data" : json.dumps(json.dumps(meta_data))
+        }
+        ftc = self.file_app_services.create_file_from_dict(self.user_01, data)
+        ftc.refresh_from_db()
+        self.assertEqual(ftc.meta_data, meta_data)
+
+    def test_build_meta_data(self):
+        meta_data = self.file_app_services.build_meta_data(create_test_file(fmt="json"))
+        self.assertEqual(meta_data, {"mime_type": "application/json", "filesize_in_bytes": 17})
+
+    def test_stage_metrics(self):
+        metrics.reset()
+        self.file_app_services.build_meta_data(create_test_file(fmt="png"))
+        self.assertEqual(metrics.histogram_count("files_stage_duration_seconds", stage="build_meta_data"), 1)
+
+        test_url = self.file_app_services.file_upload_s3(self.user_01, create_test_file(fmt="csv"))
+        self.file_app_services.file_delete_s3(self.user_01, test_url)
+        self.assertEqual(metrics.counter_value("files_storage_calls_total", operation="save"), 1)
+        self.assertEqual(metrics.counter_value("files_bytes_in_total"), len(create_test_file(fmt="csv").read()))
+        self.assertIn(
+            'files_stage_duration_seconds_count{stage="file_upload_s3"} 1',
+            metrics.render_prometheus(),
+        )
+
+    def test_probe_image_size(self):
+        for fmt, mode in (("png", "RGBA"), ("jpeg", "RGB"), ("gif", "P"), ("webp", "RGB"), ("tiff", "RGB"), ("bmp", "RGB")):
+            file_obj = io.BytesIO()
+            Image.new(mode, (120, 45)).save(file_obj, fmt)
+            self.assertEqual(probe_image_size(file_obj), (120, 45), fmt)
+        self.assertIsNone(probe_image_size(create_test_file(fmt="csv")))
+
+    def test_build_meta_data_rejects_pixel_bomb(self):
+        with override_settings(FILES_MAX_IMAGE_PIXELS=50 * 50):
+            with self.assertRaises(serializers.ValidationError):
+                self.file_app_services.build_meta_data(create_test_file(fmt="png"))
+
     def test_update_file(self):
         data = {
             "uploader": "c13cce88-42e3-40a1-9402-abf7e2f0a297",
@@ -70,7 +190,7 @@ class FileAppServicesTests(TestCase):
             "origin_name": "test.png",
             "location": "https://s3.console.aws.amazon.com/s3/object/dev-general-bucket?region=us-east-2&prefix=test.jpg",
             "status": "active",
-            "meta_data" : json.dumps({'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000})
+            "meta_data" : {'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
         }
         ftc = self.file_app_services.create_file_from_dict(self.user_01, data)
 
@@ -84,7 +204,7 @@ class FileAppServicesTests(TestCase):
             "origin_name": "test.png",
             "location": "https://s3.console.aws.amazon.com/s3/object/dev-general-bucket?region=us-east-2&prefix=test.jpg",
             "status": "active",
-            "meta_data" : json.dumps({'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000})
+            "meta_data" : {'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
         }
 
         sleep(0.000001)
@@ -104,7 +224,7 @@ class FileAppServicesTests(TestCase):
             "origin_name": "test.png",
             "location": "https://s3.console.aws.amazon.com/s3/object/dev-general-bucket?region=us-east-2&prefix=test.jpg",
             "status": "active",
-            "meta_data" : json.dumps({'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000})
+            "meta_data" : {'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
         }
         ftc = self.file_app_services.create_file_from_dict(self.user_01, data)
         self.assertEqual(type(ftc), File)
@@ -131,3 +251,421 @@ class FileAppServicesTests(TestCase):
         self.assertEqual(
             self.file_app_services.file_delete_s3(self.user_01, test_url), True
         )
+
+    def test_local_storage_backend(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(
+            FILES_STORAGE_BACKEND="interface.storages.local_storage.LocalMediaStorage",
+            FILES_LOCAL_STORAGE_ROOT=tmp_dir,
+        ):
+            test_file = create_test_file(fmt="csv")
+            upload_key = self.file_app_services.file_upload_s3(self.user_01, test_file)
+
+            read_file = self.file_app_services.read_file_from_s3(self.user_01, upload_key, "test.csv")
+            self.assertEqual(read_file.size, len(create_test_file(fmt="csv").read()))
+            self.assertEqual(read_file.read(), create_test_file(fmt="csv").read())
+            read_file.close()
+
+            self.assertEqual(
+                self.file_app_services.file_delete_s3(self.user_01, upload_key), True
+            )
+            self.assertFalse(get_media_storage().exists(upload_key))
+
+    def test_upload_file_idempotency_key(self):
+        data = {"file_type": "", "size_soft_limit_mb": "", "idempotency_key": "upload-1"}
+        upload_key, fobj = self.file_app_services.upload_file(
+            dict(data, upload_file=SimpleUploadedFile("test.csv", create_test_file(fmt="csv").read(), content_type="text/csv"))
+        )
+        self.assertEqual(fobj.status, File.ACTIVE_STATUS)
+
+        replay_key, replay = self.file_app_services.upload_file(
+            dict(data, upload_file=SimpleUploadedFile("test.csv", create_test_file(fmt="csv").read(), content_type="text/csv"))
+        )
+        self.assertEqual((replay_key, replay.id), (upload_key, fobj.id))
+        self.assertEqual(File.objects.filter(uploader=self.user_01.id, idempotency_key="upload-1").count(), 1)
+        self.assertEqual(list(get_media_storage().iter_keys()), [upload_key])
+
+    def test_upload_file_idempotency_key_reused(self):
+        data = {"file_type": "", "size_soft_limit_mb": "", "idempotency_key": "upload-3"}
+        upload_key, fobj = self.file_app_services.upload_file(
+            dict(data, upload_file=SimpleUploadedFile("test.csv", b"a,b\n1,2\n", content_type="text/csv"))
+        )
+        # no cached response is involved here, the File itself rejects a different upload
+        with self.assertRaises(IdempotencyException):
+            self.file_app_services.upload_file(
+                dict(data, upload_file=SimpleUploadedFile("test.csv", b"a,b\n3,4\n", content_type="text/csv"))
+            )
+        self.assertEqual(list(get_media_storage().iter_keys()), [upload_key])
+
+    def test_upload_file_idempotency_key_in_progress(self):
+        test_file = SimpleUploadedFile("test.csv", create_test_file(fmt="csv").read(), content_type="text/csv")
+        # another request registered the File and is still writing its object
+        pending, created = self.file_app_services._begin_upload(
+            self.user_01, test_file, self.file_app_services.build_meta_data(test_file), "upload-2"
+        )
+        self.file_app_services.file_upload_s3(self.user_01, create_test_file(fmt="csv"), key=pending.location)
+
+        data = {"file_type": "", "size_soft_limit_mb": "", "idempotency_key": "upload-2", "upload_file": test_file}
+        with mock.patch("application.files.services.IDEMPOTENCY_WAIT_TIMEOUT", 0):
+            with self.assertRaises(IdempotencyException):
+                self.file_app_services.upload_file(data)
+        # the duplicate never touches the other request's object
+        self.assertTrue(get_media_storage().exists(pending.location))
+
+        self.file_app_services._activate_upload(pending)
+        upload_key, fobj = self.file_app_services.upload_file(data)
+        self.assertEqual((upload_key, fobj.id), (pending.location, pending.id))
+
+    def test_retry_pending_uploads(self):
+        pending = []
+        for key in ("stored", "lost"):
+            test_file = SimpleUploadedFile("test.csv", create_test_file(fmt="csv").read(), content_type="text/csv")
+            fobj, created = self.file_app_services._begin_upload(
+                self.user_01, test_file, self.file_app_services.build_meta_data(test_file), key
+            )
+            self.assertTrue(created)
+            pending.append(fobj)
+        stored, lost = pending
+        self.file_app_services.file_upload_s3(self.user_01, create_test_file(fmt="csv"), key=stored.location)
+        self.assertFalse(self.file_app_services.list_files(self.user_01).filter(id=stored.id).exists())
+
+        report = PendingUploadRetrier(log).run(now=timezone.now() + datetime.timedelta(hours=2))
+        self.assertEqual((report.activated, report.rolled_back), (1, 1))
+        self.assertEqual(File.objects.get(id=stored.id).status, File.ACTIVE_STATUS)
+        self.assertFalse(File.objects.filter(id=lost.id).exists())
+
+    def test_idempotency_store_waits_for_in_flight_request(self):
+        store = IdempotencyStore()
+        fingerprint = request_fingerprint(self.user_01.id, "upload", {"file_type": ""})
+        cache_key = store._cache_key(self.user_01.id, "in-flight")
+        store.cache.add("{}:lock".format(cache_key), lock_value(fingerprint))
+
+        def finish_original():
+            sleep(0.2)
+            store.cache.set(cache_key, {"fingerprint": fingerprint, "result": {"file_id": "1"}})
+            store.cache.delete("{}:lock".format(cache_key))
+
+        original = threading.Thread(target=finish_original)
+        original.start()
+        result, replayed = store.run(self.user_01.id, "in-flight", fingerprint, lambda: self.fail("work repeated"))
+        original.join()
+        self.assertEqual((result, replayed), ({"file_id": "1"}, True))
+
+        with self.assertRaises(IdempotencyException):
+            store.run(self.user_01.id, "in-flight", "other", lambda: {"file_id": "2"})
+
+    def test_idempotency_lock_release_keeps_lock_of_next_holder(self):
+        store = IdempotencyStore()
+        lock_key = "{}:lock".format(store._cache_key(self.user_01.id, "expired"))
+        expired = lock_value("fingerprint")
+        # the first holder's lock expired and another request took it
+        store.cache.set(lock_key, lock_value("fingerprint"))
+        release_lock(store.cache, lock_key, expired)
+        self.assertIsNotNone(store.cache.get(lock_key))
+        release_lock(store.cache, lock_key, store.cache.get(lock_key))
+        self.assertIsNone(store.cache.get(lock_key))
+
+
+class FileIngestionAppServicesTests(InMemoryStorageMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.u_data_01 = UserPersonalData(
+            username="Teser",
+            first_name="Testerman",
+            last_name="Testerson",
+            email="testerman@example.com",
+        )
+        cls.u_permissions_01 = UserBasePermissions(is_staff=False, is_active=False)
+        cls.user_01 = UserAppServices.create_user(cls.u_data_01, cls.u_permissions_01)
+
+    def test_ingest_directory_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for fmt in ("json", "csv", "png"):
+                with open(os.path.join(tmp_dir, "test.{}".format(fmt)), "wb") as fh:
+                    fh.write(create_test_file(fmt=fmt).read())
+            checkpoint_path = os.path.join(tmp_dir, "checkpoint.txt")
+
+            ingestion = FileIngestionAppServices(self.user_01, log, processes=0, batch_size=2)
+            paths = [path for path in iter_directory(tmp_dir) if not path.endswith(".txt")]
+            report = ingestion.ingest(paths, FileCheckpoint(checkpoint_path))
+            self.assertEqual(report.ingested, 3)
+            self.assertEqual(report.failed, 0)
+
+            report = ingestion.ingest(paths, FileCheckpoint(checkpoint_path))
+            self.assertEqual(report.ingested, 0)
+            self.assertEqual(report.skipped, 3)
+
+            # a run that lost its checkpoint finds the Files it registered instead of ingesting them again
+            report = ingestion.ingest(paths, FileCheckpoint(os.path.join(tmp_dir, "lost.txt")))
+            self.assertEqual((report.ingested, report.skipped), (0, 3))
+
+        files = File.objects.filter(uploader=self.user_01.id)
+        self.assertEqual(files.count(), 3)
+        self.assertEqual(
+            files.get(origin_name="test.png").meta_data["width"], 100
+        )
+        for file in files:
+            ingestion.file_app_services.file_delete_s3(self.user_01, file.location)
+
+
+class FileReaperTests(InMemoryStorageMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.u_data_01 = UserPersonalData(
+            username="Teser",
+            first_name="Testerman",
+            last_name="Testerson",
+            email="testerman@example.com",
+        )
+        cls.u_permissions_01 = UserBasePermissions(is_staff=False, is_active=False)
+        cls.user_01 = UserAppServices.create_user(cls.u_data_01, cls.u_permissions_01)
+        cls.file_app_services = fas(
+            AppAccessControlServices(cls.user_01).get_access_controller(), log.with_attributes(user_id=cls.user_01.id)
+        )
+
+    def test_sweep_and_reconcile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            keys = [
+                self.file_app_services.file_upload_s3(self.user_01, create_test_file(fmt="csv"))
+                for _ in range(3)
+            ]
+            active, deactivated = [
+                self.file_app_services.create_file_from_s3(self.user_01, create_test_file(fmt="csv"), key)
+                for key in keys[:2]
+            ]
+            self.file_app_services.delete_file_soft(deactivated.id)
+            checkpoint_path = os.path.join(tmp_dir, "checkpoint.txt")
+
+            later = timezone.now() + datetime.timedelta(days=60)
+            reaper = FileReaper(log, retention_days=30, checkpoint=FileCheckpoint(checkpoint_path))
+            report = reaper.sweep(now=later)
+            self.assertEqual(report.rows_deleted, 1)
+            self.assertFalse(File.objects.filter(id=deactivated.id).exists())
+
+            report = reaper.reconcile()
+            self.assertEqual((report.objects_scanned, report.orphans_found), (2, 0))
+
+            # an interrupted run checkpoints the referenced object, the orphan within the grace window stays open
+            checkpoint = FileCheckpoint(checkpoint_path)
+            reaper = FileReaper(log, checkpoint=checkpoint)
+            now = timezone.now()
+            reaper._reconcile_batch([(keys[0], now), (keys[2], now)], now - datetime.timedelta(hours=1), ReaperReport())
+            self.assertIn("scanned:{}".format(keys[0]), checkpoint)
+            self.assertNotIn("scanned:{}".format(keys[2]), checkpoint)
+
+            # a resumed run skips what the checkpoint already covers
+            report = FileReaper(log, checkpoint=FileCheckpoint(checkpoint_path)).reconcile(now=later)
+            self.assertEqual(report.objects_scanned, 2)
+            self.assertEqual(report.orphans_found, 1)
+
+            storage = get_media_storage()
+            self.assertEqual([storage.exists(key) for key in keys], [True, False, False])
+            self.assertTrue(File.objects.filter(id=active.id).exists())
+            # a completed pass clears its checkpoint entries
+            self.assertEqual(len(FileCheckpoint(checkpoint_path)), 0)
+
+
+    @override_settings(FILES_RESUMABLE_SESSION_STORE="application.files.resumable.DatabaseSessionStore")
+    def test_upload_sessions(self):
+        resumable = ResumableUploadAppServices(AppAccessControlServices(self.user_01).get_access_controller(), log)
+        session = resumable.create_session(self.user_01, {"filename": "test.csv", "size": 100})
+        session = resumable.append_chunk(self.user_01, session.upload_id, 0, io.BytesIO(b"x" * 10), 10)
+        part_key = session.parts[0][1]
+
+        # parts of a live session are not orphans, whatever their age
+        later = timezone.now() + datetime.timedelta(days=2)
+        self.assertEqual(FileReaper(log).reconcile(now=later).orphans_found, 0)
+        self.assertTrue(get_media_storage().exists(part_key))
+
+        # abandoned sessions expire with their parts
+        report = FileReaper(log).sweep(now=later)
+        self.assertEqual((report.sessions_expired, report.objects_deleted), (1, 1))
+        self.assertFalse(get_media_storage().exists(part_key))
+        self.assertIsNone(resumable.session_store.get(session.upload_id))
+
+
+class FileTieringTests(InMemoryStorageMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.u_data_01 = UserPersonalData(
+            username="Teser",
+            first_name="Testerman",
+            last_name="Testerson",
+            email="testerman@example.com",
+        )
+        cls.u_permissions_01 = UserBasePermissions(is_staff=False, is_active=False)
+        cls.user_01 = UserAppServices.create_user(cls.u_data_01, cls.u_permissions_01)
+        cls.file_app_services = fas(
+            AppAccessControlServices(cls.user_01).get_access_controller(), log.with_attributes(user_id=cls.user_01.id)
+        )
+
+    def test_access_statistics_drive_tiering(self):
+        file_obj = create_test_file(fmt="csv")
+        key = self.file_app_services.file_upload_s3(self.user_01, file_obj)
+        fobj = self.file_app_services.create_file_from_s3(self.user_01, file_obj, key)
+
+        recorder = AccessRecorder()
+        recorder.record(fobj.id)
+        recorder.record(fobj.id)
+        self.assertEqual(recorder.flush(), 1)
+        fobj.refresh_from_db()
+        self.assertEqual(fobj.access_count, 2)
+        self.assertIsNotNone(fobj.last_accessed)
+
+        engine = TieringEngine(log, policy=TieringPolicy(min_size_bytes=0))
+        later = timezone.now() + datetime.timedelta(days=45)
+        self.assertEqual(engine.run(now=later).transitions["STANDARD_IA"], 1)
+        self.assertEqual(File.objects.get(id=fobj.id).storage_class, "STANDARD_IA")
+        self.assertEqual(engine.run(now=later).moved, 0)
+
+        # a read moves the File back to the default tier
+        recorder.record(fobj.id, at=later.timestamp())
+        recorder.flush()
+        self.assertEqual(engine.run(now=later).transitions["STANDARD"], 1)
+        self.assertEqual(File.objects.get(id=fobj.id).storage_class, File.STANDARD_STORAGE_CLASS)
+
+        # small Files never leave the default tier
+        engine = TieringEngine(log, policy=TieringPolicy(min_size_bytes=10 ** 9))
+        self.assertEqual(engine.run(now=later + datetime.timedelta(days=100)).moved, 0)
+
+    @override_settings(FILES_ACCESS_FLUSH_MAX_FILES=2)
+    def test_access_flush_off_request_path(self):
+        recorder = AccessRecorder()
+        flushed = threading.Event()
+        flush_threads = []
+
+        def flush():
+            flush_threads.append(threading.current_thread())
+            flushed.set()
+            return 0
+
+        with mock.patch.object(recorder, "flush", side_effect=flush):
+            recorder.record("a")
+            recorder.record("b")
+            self.assertTrue(flushed.wait(5))
+        self.assertIsNot(flush_threads[0], threading.current_thread())
+
+    def test_simulate(self):
+        policy = TieringPolicy(
+            tiers=[StorageTier("STANDARD", 0, 0.02), StorageTier("STANDARD_IA", 30, 0.01, retrieval_cost=0.01)],
+            min_size_bytes=0,
+        )
+        day = 24 * 60 * 60
+        size = 10 * 1000 ** 3
+        # one File read daily and one read once, over 90 days
+        events = [(n * day, "hot", size) for n in range(90)] + [(0, "cold", size)]
+        report = simulate(events, policy)
+        self.assertEqual(report.days, 90)
+        self.assertEqual(report.reads, 91)
+        self.assertEqual(report.transitions, 1)
+        self.assertAlmostEqual(report.baseline_cost, 2 * 10 * 0.02 * 3)
+        self.assertLess(report.tiered_cost, report.baseline_cost)
+
+
+class FileDatasetTests(InMemoryStorageMixin, TestCase):
+    def test_generate_and_load(self):
+        end = timezone.now().replace(microsecond=0)
+        shape = dict(rows=300, uploaders=20, end=end, span_days=30)
+        spec = DatasetSpec(seed=7, **shape)
+        rows = list(SyntheticFileGenerator(spec).iter_rows())
+        self.assertEqual(rows, list(SyntheticFileGenerator(DatasetSpec(seed=7, **shape)).iter_rows()))
+        self.assertNotEqual(rows, list(SyntheticFileGenerator(DatasetSpec(seed=8, **shape)).iter_rows()))
+
+        storage = get_media_storage()
+        loaded = DatasetLoader(batch_size=128, storage=storage, object_max_bytes=1024).load(
+            SyntheticFileGenerator(spec)
+        )
+        self.assertEqual(loaded, 300)
+        fobj = File.objects.get(id=rows[0]["id"])
+        # generated timestamps are kept
+        self.assertEqual(fobj.created_at, rows[0]["created_at"])
+        self.assertEqual(fobj.meta_data, rows[0]["meta_data"])
+        with storage.open(fobj.location) as stored:
+            self.assertEqual(stored.read(), object_content(rows[0], 1024))
+
+        counts = sorted(
+            File.objects.values("uploader").annotate(n=Count("id")).values_list("n", flat=True), reverse=True
+        )
+        # the zipf skew gives the first uploader several times the average share
+        self.assertGreater(counts[0], 3 * 300 / 20)
+
+
+class FileBundleTests(SimpleTestCase):
+    def test_aborted_bundle_closes_prefetched_readers(self):
+        opened = []
+
+        def open_member(member):
+            reader = io.BytesIO(b"x" * 10)
+            opened.append(reader)
+            return reader
+
+        members = [
+            BundleMember("{}.csv".format(i), "key/{}".format(i), "{}.csv".format(i), None, 10, True)
+            for i in range(6)
+        ]
+        stream = stream_archive(members, "tar", open_member, prefetch=3)
+        next(stream)
+        # the client disconnects after the first header, the members opened ahead are never read
+        stream.close()
+        self.assertGreaterEqual(len(opened), 3)
+        self.assertTrue(all(reader.closed for reader in opened))
+
+
+class FileSniffingTests(SimpleTestCase):
+    def test_mp3_without_id3_tag(self):
+        # MPEG-1 layer III frame header, 128 kbit/s at 44.1 kHz
+        frame = b"\xff\xfb\x90\x64" + b"\x00" * 413
+        self.assertTrue(content_matches("audio/mpeg", frame))
+        self.assertTrue(content_matches("audio/mpeg", b"ID3\x04\x00" + frame))
+        self.assertFalse(content_matches("audio/mpeg", b"%PDF-1.4"))
+
+    def test_v7_tar_without_ustar_magic(self):
+        # a version 7 header only has name, mode, ids, size, mtime, checksum, type and link name
+        header = b"notes.txt".ljust(100, b"\x00") + b"0000644\x000001750\x000001750\x00" + b"0" * 150
+        self.assertTrue(content_matches("application/x-tar", header.ljust(512, b"\x00")))
+        self.assertTrue(content_matches("application/x-tar", (header[:257] + b"ustar\x0000").ljust(512, b"\x00")))
+        self.assertFalse(content_matches("application/x-tar", b"\x89PNG\r\n\x1a\n"))
+        # mandatory signatures are still required
+        self.assertFalse(content_matches("application/pdf", header.ljust(512, b"\x00")))
+
+
+class FileImportTimeTests(SimpleTestCase):
+    # modules a worker or management command importing the file services must not pay for
+    LAZY_MODULES = ("PIL", "reportlab", "rest_framework.serializers", "storages.backends.s3boto3", "boto3")
+    MARKER = "files-import-time"
+
+    def import_times(self, module):
+        """
+        Imports module in a fresh interpreter with -X importtime after django.setup and returns
+        {imported module: cumulative microseconds} of everything that import pulled in.
+        A first import writes the bytecode cache, the measured one reads it like a deployed worker does.
+        """
+        code = "import sys, django; django.setup(); sys.stderr.write('{}\\n'); import {}".format(self.MARKER, module)
+        for _ in range(2):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                capture_output=True,
+                text=True,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+        lines = result.stderr.split(self.MARKER, 1)[1].splitlines()
+        times = {}
+        for line in lines:
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+        return times
+
+    def test_services_import_budget(self):
+        times = self.import_times("application.files.services")
+        self.assertIn("application.files.services", times)
+        self.assertNotIn("application.files.tests_helper", times)
+        for name in times:
+            self.assertFalse(
+                any(name == lazy or name.startswith(lazy + ".") for lazy in self.LAZY_MODULES),
+                "{} is imported eagerly by application.files.services".format(name),
+            )
+        budget_ms = getattr(settings, "FILES_IMPORT_TIME_BUDGET_MS", 300)
+        self.assertLessEqual(times["application.files.services"] / 1000, budget_ms)
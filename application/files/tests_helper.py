@@ -1,36 +1,140 @@
 # python imports
 import io
-import json
-from PIL import Image
-from django.http.request import validate_host
-from reportlab.pdfgen import canvas
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
 
+# django imports
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.test import override_settings
 
-def create_test_file(fmt="png"):
-    file = io.BytesIO()
+MEMORY_STORAGE_BACKEND = "application.files.tests_helper.InMemoryStorage"
+
+
+class InMemoryStorage(Storage):
+    """
+    Storage fake for tests with the key semantics of the S3 MediaStorage (keys are overwritten, not renamed).
+    Objects live in a class level dict, so every instance get_media_storage creates sees the same objects,
+    and each test process has its own, which keeps parallel test runs apart.
+    """
+
+    _objects = {}
+    _lock = threading.Lock()
+
+    def __init__(self, location=None, base_url=None):
+        self.base_url = base_url or "/media/"
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._objects.clear()
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _open(self, name, mode="rb"):
+        with self._lock:
+            if name not in self._objects:
+                raise FileNotFoundError(name)
+            data, _ = self._objects[name]
+        return ContentFile(data, name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        data = b"".join(
+            chunk.encode("utf-8") if isinstance(chunk, str) else chunk for chunk in content.chunks()
+        )
+        with self._lock:
+            self._objects[name] = (data, datetime.now(timezone.utc))
+        return name
+
+    def delete(self, name):
+        with self._lock:
+            self._objects.pop(name, None)
+
+    def delete_many(self, names):
+        for name in names:
+            self.delete(name)
+        return []
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._objects
+
+    def size(self, name):
+        with self._lock:
+            return len(self._objects[name][0])
+
+    def url(self, name):
+        return self.base_url + name
+
+    def get_modified_time(self, name):
+        with self._lock:
+            return self._objects[name][1]
+
+    def listdir(self, path):
+        directories, files = set(), []
+        prefix = path.rstrip("/") + "/" if path else ""
+        for name in self.iter_keys(prefix):
+            rest = name[len(prefix):]
+            if "/" in rest:
+                directories.add(rest.split("/", 1)[0])
+            else:
+                files.append(rest)
+        return sorted(directories), sorted(files)
+
+    def iter_keys(self, prefix=""):
+        with self._lock:
+            names = sorted(self._objects)
+        return iter([name for name in names if name.startswith(prefix)])
+
+
+class InMemoryStorageMixin:
+    """
+    Runs the tests of a TestCase against an empty InMemoryStorage instead of the configured backend.
+    A test can still override FILES_STORAGE_BACKEND itself, its override is applied after this one.
+    """
+
+    def setUp(self):
+        super().setUp()
+        InMemoryStorage.reset()
+        storage_override = override_settings(FILES_STORAGE_BACKEND=MEMORY_STORAGE_BACKEND)
+        storage_override.enable()
+        self.addCleanup(storage_override.disable)
+        self.addCleanup(InMemoryStorage.reset)
+
+
+@lru_cache(maxsize=None)
+def _test_file_bytes(fmt: str) -> bytes:
+    # generated once per process, PIL and reportlab are only imported when a test needs an image or a pdf
     if fmt == "png":
-        image = Image.new("RGBA", size=(100, 100), color=(155, 0, 0))
-        image.save(file, "png")
-        file.name = "test.png"
-        file.seek(0)
-    elif fmt == "json":
-        data = b'{"hello":"World"}'
-        file.write(data)
-        file.name = "test.json"
-        file.seek(0)
-    elif fmt == "csv":
-        data = b"file_test\r\nhello\r\nworld"
-        file.write(data)
-        file.name = "test.csv"
-        file.seek(0)
-    elif fmt == "pdf":
-        file = io.BytesIO()
-        pdf = canvas.Canvas(file)
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGBA", size=(100, 100), color=(155, 0, 0)).save(buffer, "png")
+        return buffer.getvalue()
+    if fmt == "json":
+        return b'{"hello":"World"}'
+    if fmt == "csv":
+        return b"file_test\r\nhello\r\nworld"
+    if fmt == "pdf":
+        from reportlab.pdfgen import canvas
+
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer)
         pdf.drawString(100, 100, "Hello world.")
         pdf.showPage()
         pdf.save()
-        file.name = "test.pdf"
-        file.seek(0)
+        return buffer.getvalue()
+    return b""
+
+
+def create_test_file(fmt="png"):
+    file = io.BytesIO(_test_file_bytes(fmt))
+    if fmt in ("png", "json", "csv", "pdf"):
+        file.name = "test.{}".format(fmt)
     return file
 
 
@@ -0,0 +1,292 @@
+# python imports
+import typing
+import logging
+import datetime
+from dataclasses import dataclass, field
+
+# django imports
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+# app imports
+from domain.files.models import File
+from domain.files.services import FileServices
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .instrumentation import metrics
+from .reaper import RateLimiter
+from .storages import get_media_storage
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+GB = 1000 ** 3
+
+
+class StorageTier(typing.NamedTuple):
+    storage_class: str
+    # days without access before a File moves into the tier
+    min_idle_days: int
+    # USD per GB and month
+    storage_cost: float
+    # USD per GB read while in the tier
+    retrieval_cost: float = 0.0
+    # USD per transition into the tier
+    transition_cost: float = 0.0
+
+
+# S3 classes with millisecond reads, colder classes would break serve
+DEFAULT_TIERS = (
+    StorageTier("STANDARD", 0, 0.023),
+    StorageTier("STANDARD_IA", 30, 0.0125, retrieval_cost=0.01, transition_cost=0.00001),
+    StorageTier("GLACIER_IR", 90, 0.004, retrieval_cost=0.03, transition_cost=0.00002),
+)
+
+
+class TieringPolicy:
+    """
+    Maps the idle time of a File to the coldest tier it qualifies for. Files below min_size_bytes stay in the
+    first tier, the infrequent access classes bill small objects as if they had min_size_bytes anyway.
+    A File that was read again qualifies for a warmer tier and is moved back.
+    """
+
+    def __init__(self, tiers: typing.Sequence[StorageTier] = None, min_size_bytes: int = None):
+        if tiers is None:
+            tiers = [StorageTier(**tier) for tier in getattr(settings, "FILES_STORAGE_TIERS", [])] or DEFAULT_TIERS
+        self.tiers = sorted(tiers, key=lambda tier: tier.min_idle_days)
+        self.min_size_bytes = (
+            min_size_bytes if min_size_bytes is not None else getattr(settings, "FILES_TIERING_MIN_SIZE_BYTES", 128 * 1024)
+        )
+
+    @property
+    def default_tier(self) -> StorageTier:
+        return self.tiers[0]
+
+    def tier(self, storage_class: str) -> StorageTier:
+        for tier in self.tiers:
+            if tier.storage_class == storage_class:
+                return tier
+        return self.default_tier
+
+    def target_tier(self, idle: datetime.timedelta, size: typing.Optional[int]) -> StorageTier:
+        if size is None or size < self.min_size_bytes:
+            return self.default_tier
+        target = self.default_tier
+        for tier in self.tiers:
+            if idle >= datetime.timedelta(days=tier.min_idle_days):
+                target = tier
+        return target
+
+
+def transition(storage, name: str, storage_class: str):
+    """
+    Changes the storage class of an object in place. S3 does this with a copy onto the same key,
+    backends without storage classes only record it.
+    """
+    if hasattr(storage, "bucket"):
+        from storages.utils import clean_name
+
+        key = storage._normalize_name(clean_name(name))
+        storage.bucket.Object(key).copy_from(
+            CopySource={"Bucket": storage.bucket.name, "Key": key},
+            StorageClass=storage_class,
+            MetadataDirective="COPY",
+        )
+        metrics.inc("files_storage_calls_total", operation="copy_object")
+    elif hasattr(storage, "set_storage_class"):
+        storage.set_storage_class(name, storage_class)
+
+
+@dataclass
+class TieringReport:
+    transitions: typing.Dict[str, int] = field(default_factory=dict)
+    errors: typing.List[str] = field(default_factory=list)
+
+    @property
+    def moved(self) -> int:
+        return sum(self.transitions.values())
+
+
+class TieringEngine:
+    """
+    Applies the policy to the active Files. Each tier only looks at Files whose idle time falls in its window
+    and that are in another class, so a run touches the candidates and not the whole table.
+    Idle time counts from last_accessed, or from created_at for Files never read.
+    """
+
+    def __init__(
+        self,
+        log: AttributeLogger,
+        policy: TieringPolicy = None,
+        batch_size: int = 500,
+        rate: typing.Optional[float] = None,
+        dry_run: bool = False,
+    ):
+        self.log = log
+        self.file_services = FileServices(log)
+        self.policy = policy or TieringPolicy()
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(rate)
+        self.dry_run = dry_run
+        self.storage = get_media_storage()
+
+    def candidates(self, tier: StorageTier, colder: typing.Optional[StorageTier], now) -> typing.List[QuerySet]:
+        """
+        Querysets of the active Files outside tier whose idle time is at least tier.min_idle_days and below
+        colder.min_idle_days. Each queryset selects one source class with storage_class equality and a range
+        on last_accessed, or on created_at for Files never read, so postgres walks the
+        (storage_class, last_accessed) index instead of computing the idle time of every row.
+        Files in a class outside the policy are left alone.
+        """
+        files = self.file_services.get_file_repo().filter(status=File.ACTIVE_STATUS)
+        idle_from = now - datetime.timedelta(days=tier.min_idle_days)
+        idle_until = now - datetime.timedelta(days=colder.min_idle_days) if colder is not None else None
+        accessed = Q(last_accessed__lte=idle_from)
+        created = Q(last_accessed__isnull=True, created_at__lte=idle_from)
+        if idle_until is not None:
+            accessed &= Q(last_accessed__gt=idle_until)
+            created &= Q(created_at__gt=idle_until)
+        large = Q(meta_data__filesize_in_bytes__gte=self.policy.min_size_bytes)
+        querysets = []
+        for source in self.policy.tiers:
+            if source.storage_class == tier.storage_class:
+                continue
+            in_class = files.filter(storage_class=source.storage_class)
+            querysets.append(in_class.filter(accessed & large))
+            querysets.append(in_class.filter(created & large))
+            if tier == self.policy.default_tier:
+                # Files that are too small for a colder tier belong here regardless of their idle time
+                querysets.append(in_class.filter(~large | Q(meta_data__filesize_in_bytes__isnull=True)))
+        return querysets
+
+    def run(self, now=None) -> TieringReport:
+        now = now or timezone.now()
+        report = TieringReport()
+        tiers = self.policy.tiers
+        for index, tier in enumerate(tiers):
+            # the next colder tier bounds this tier's idle window
+            colder = tiers[index + 1] if index + 1 < len(tiers) else None
+            for queryset in self.candidates(tier, colder, now):
+                self._move(queryset.order_by("id"), tier, report)
+        return report
+
+    def _move(self, queryset: QuerySet, tier: StorageTier, report: TieringReport):
+        last_id = None
+        while True:
+            batch = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            rows = list(batch.values_list("id", "location")[: self.batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            moved = []
+            for file_id, location in rows:
+                self.rate_limiter.acquire()
+                try:
+                    if not self.dry_run:
+                        transition(self.storage, location, tier.storage_class)
+                except Exception as e:
+                    logger.warning("File {} could not move to {} - {}".format(file_id, tier.storage_class, e))
+                    report.errors.append("{}: {}".format(file_id, e))
+                    continue
+                moved.append(file_id)
+            if moved and not self.dry_run:
+                self.file_services.get_file_repo().filter(id__in=moved).update(storage_class=tier.storage_class)
+                metrics.inc("files_tier_transitions_total", len(moved), storage_class=tier.storage_class)
+            report.transitions[tier.storage_class] = report.transitions.get(tier.storage_class, 0) + len(moved)
+
+
+@dataclass
+class SimulationReport:
+    days: int
+    files: int
+    reads: int
+    baseline_cost: float
+    tiered_cost: float
+    storage_cost: float
+    retrieval_cost: float
+    transition_cost: float
+    transitions: int
+
+    @property
+    def savings(self) -> float:
+        return self.baseline_cost - self.tiered_cost
+
+
+def read_access_log(path: str) -> typing.Iterator[typing.Tuple[float, str, typing.Optional[int]]]:
+    """
+    Reads the "<epoch> <file id> <bytes>" lines written by the AccessRecorder
+    """
+    with open(path, "r") as access_log:
+        for line in access_log:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            yield float(parts[0]), parts[1], int(parts[2]) if parts[2] != "-" else None
+
+
+def simulate(
+    events: typing.Iterable[typing.Tuple[float, str, typing.Optional[int]]],
+    policy: TieringPolicy,
+    inventory: typing.Optional[typing.Dict[str, typing.Tuple[float, int]]] = None,
+) -> SimulationReport:
+    """
+    Replays an access log day by day against the policy and prices the result against keeping every
+    File in the default tier. inventory maps file ids to (created epoch, bytes) for Files the log never
+    reads, Files only known from the log exist from their first read on. Reads are charged with the
+    retrieval cost of the tier the File is in when it is read and bring it back to the default tier the
+    next day, as the TieringEngine would.
+    """
+    events = sorted(events)
+    inventory = dict(inventory or {})
+    for at, file_id, size in events:
+        if file_id not in inventory:
+            inventory[file_id] = (at, size or 0)
+    if not inventory:
+        return SimulationReport(0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+    day = 24 * 60 * 60
+    start = min(created for created, _ in inventory.values())
+    end = max([at for at, _, _ in events] + [start])
+    days = int((end - start) // day) + 1
+    daily = 1 / 30.0
+
+    last_read = {file_id: created for file_id, (created, _) in inventory.items()}
+    tier_of = {file_id: policy.default_tier for file_id in inventory}
+    baseline = storage = retrieval = transition_total = 0.0
+    transitions = reads = 0
+    event_index = 0
+    for day_index in range(days):
+        day_end = start + (day_index + 1) * day
+        while event_index < len(events) and events[event_index][0] < day_end:
+            at, file_id, size = events[event_index]
+            event_index += 1
+            reads += 1
+            gigabytes = (size if size is not None else inventory[file_id][1]) / GB
+            retrieval += gigabytes * tier_of[file_id].retrieval_cost
+            last_read[file_id] = at
+
+        for file_id, (created, size) in inventory.items():
+            if created >= day_end:
+                continue
+            gigabytes = size / GB
+            target = policy.target_tier(datetime.timedelta(seconds=day_end - last_read[file_id]), size)
+            if target != tier_of[file_id]:
+                tier_of[file_id] = target
+                transitions += 1
+                transition_total += target.transition_cost
+            billed = max(gigabytes, policy.min_size_bytes / GB) if target != policy.default_tier else gigabytes
+            storage += billed * target.storage_cost * daily
+            baseline += gigabytes * policy.default_tier.storage_cost * daily
+
+    return SimulationReport(
+        days=days,
+        files=len(inventory),
+        reads=reads,
+        baseline_cost=baseline,
+        tiered_cost=storage + retrieval + transition_total,
+        storage_cost=storage,
+        retrieval_cost=retrieval,
+        transition_cost=transition_total,
+        transitions=transitions,
+    )
@@ -0,0 +1,166 @@
+# python imports
+import os
+import logging
+import tempfile
+
+# django imports
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from rest_framework.test import force_authenticate, APIRequestFactory
+from rest_framework.test import APITestCase
+
+# app imports
+from domain.users.models import UserPersonalData, UserBasePermissions
+from domain.files.tests_helper import TestFileFactory
+from application.users.services import UserAppServices
+from application.files.services import FileAppServices as fas
+from application.files.tests_helper import create_test_file, create_file_with_bytes
+from application.app_access_control.services import AppAccessControlServices
+from infrastructure.logger.models import AttributeLogger
+from interface import views
+
+# local imports
+from .harness import run_benchmark, load_baseline, save_baseline, find_regressions
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+FILE_SIZES = {"1kb": 1000, "1mb": 1000000, "10mb": 10000000}
+DATASET_SIZES = (100, 1000)
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "30"))
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+
+
+class FileEndpointBenchmarks(APITestCase):
+    """
+    End to end benchmarks of the file endpoints against the local storage backend.
+
+    python manage.py test benchmarks --pattern="bench_*.py"
+
+    Set BENCHMARK_UPDATE_BASELINE=1 to record the results as the new baseline instead of comparing against it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage_dir = tempfile.TemporaryDirectory()
+        cls.storage_settings = override_settings(
+            FILES_STORAGE_BACKEND="interface.storages.local_storage.LocalMediaStorage",
+            FILES_LOCAL_STORAGE_ROOT=cls.storage_dir.name,
+        )
+        cls.storage_settings.enable()
+        cls.results = []
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.storage_settings.disable()
+        cls.storage_dir.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.factory = APIRequestFactory()
+        cls.file_resource_view = views.FileViewSet.as_view({"get": "retrieve"})
+        cls.file_collection_view = views.FileViewSet.as_view({"get": "list"})
+        cls.file_upload_view = views.FileUploadViewSet.as_view({"post": "create"})
+        cls.file_download_view = views.FileDownloadViewSet.as_view({"post": "create"})
+        cls.file_serve_view = views.FileViewSet.as_view({"get": "serve"})
+
+        cls.user_01 = UserAppServices.create_user(
+            UserPersonalData(
+                username="Bencher",
+                first_name="Bencherman",
+                last_name="Bencherson",
+                email="bencherman@example.com",
+            ),
+            UserBasePermissions(is_staff=False, is_active=False),
+        )
+        cls.file_app_services = fas(
+            AppAccessControlServices(cls.user_01).get_access_controller(),
+            log.with_attributes(user_id=cls.user_01.id)
+        )
+
+    def tearDown(self):
+        for result in self.results:
+            print(result.as_row())
+        if UPDATE_BASELINE:
+            save_baseline(self.results)
+        else:
+            regressions = find_regressions(self.results, load_baseline())
+            self.assertEqual(regressions, [], "\n".join(regressions))
+        self.results.clear()
+
+    def upload(self, content, name="bench.csv", content_type="text/csv"):
+        request = self.factory.post(
+            "/api/v0/file/upload/",
+            {
+                "upload_file": SimpleUploadedFile(name, content, content_type=content_type),
+                "file_type": "",
+                "size_soft_limit_mb": "",
+            },
+            format="multipart",
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_upload_view(request)
+        self.assertIs(response.status_code, 200)
+        return response.data
+
+    def consume(self, response):
+        self.assertIs(response.status_code, 200)
+        for _ in response.streaming_content:
+            pass
+        response.close()
+
+    def test_upload(self):
+        for label, size in FILE_SIZES.items():
+            content = create_file_with_bytes(b"a" * size, "bench.csv").read()
+            self.results.append(
+                run_benchmark("upload_csv_{}".format(label), lambda: self.upload(content), ITERATIONS)
+            )
+        png = create_test_file(fmt="png").read()
+        self.results.append(
+            run_benchmark(
+                "upload_png_100x100",
+                lambda: self.upload(png, "bench.png", "image/png"),
+                ITERATIONS,
+            )
+        )
+
+    def test_serve_and_download(self):
+        for label, size in FILE_SIZES.items():
+            file_id = self.upload(b"a" * size)["file_id"]
+
+            def serve():
+                request = self.factory.get("/api/v0/file/{}/serve/".format(file_id))
+                force_authenticate(request, user=self.user_01)
+                self.consume(self.file_serve_view(request, pk=file_id))
+
+            def download():
+                request = self.factory.post("/api/v0/file/download/", {"file_id": file_id})
+                force_authenticate(request, user=self.user_01)
+                self.consume(self.file_download_view(request))
+
+            self.results.append(run_benchmark("serve_{}".format(label), serve, ITERATIONS))
+            self.results.append(run_benchmark("download_{}".format(label), download, ITERATIONS))
+
+    def test_list_and_retrieve(self):
+        created = 0
+        for dataset_size in DATASET_SIZES:
+            file_ids = TestFileFactory.create_files(dataset_size - created, uploader=self.user_01.id)
+            created = dataset_size
+
+            def list_files():
+                request = self.factory.get("/api/v0/file/")
+                force_authenticate(request, user=self.user_01)
+                response = self.file_collection_view(request)
+                self.assertIs(response.status_code, 200)
+                response.render()
+
+            def retrieve():
+                request = self.factory.get("/api/v0/file/{}".format(file_ids[0].value))
+                force_authenticate(request, user=self.user_01)
+                response = self.file_resource_view(request, pk=file_ids[0].value)
+                self.assertIs(response.status_code, 200)
+                response.render()
+
+            self.results.append(run_benchmark("list_{}_rows".format(dataset_size), list_files, ITERATIONS))
+            self.results.append(run_benchmark("retrieve_{}_rows".format(dataset_size), retrieve, ITERATIONS))
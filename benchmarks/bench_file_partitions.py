@@ -0,0 +1,125 @@
+# python imports
+import os
+import uuid
+import datetime
+import unittest
+
+# django imports
+from django.db import connection
+from django.test import TestCase
+
+# app imports
+from domain.files import partitioning
+from domain.files.models import File
+from application.files.datasets import DatasetLoader, DatasetSpec, SyntheticFileGenerator
+
+# local imports
+from .harness import run_benchmark, load_baseline, save_baseline, find_regressions
+
+CORPUS_ROWS = int(os.environ.get("BENCHMARK_PARTITION_ROWS", "100000"))
+CORPUS_MONTHS = 36
+UPLOADERS = 1000
+LOAD_BATCH = 50000
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "30"))
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+
+MONOLITHIC_TABLE = "bench_files_monolithic"
+PARTITIONED_TABLE = "bench_files_partitioned"
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+END = partitioning.add_months(START, CORPUS_MONTHS)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "range partitioning only exists on postgres")
+class FilePartitionBenchmarks(TestCase):
+    """
+    The File list, range, retention and lookup queries against a monolithic and a partitioned copy of the
+    File table, BENCHMARK_PARTITION_ROWS synthetic rows each (default 100 thousand) spread over three years.
+    The reference numbers come from 100 million rows, loading them takes hours and about 60GB per table.
+
+    python manage.py test benchmarks --pattern="bench_file_partitions.py"
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        table = File._meta.db_table
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)".format(quote(MONOLITHIC_TABLE), quote(table))
+            )
+            cursor.execute("ALTER TABLE {} ADD PRIMARY KEY (id)".format(quote(MONOLITHIC_TABLE)))
+            partitioning.copy_indexes(connection, cursor, table, MONOLITHIC_TABLE, suffix="mono")
+        partitioning.create_partitioned_table(connection, table, PARTITIONED_TABLE, START, END, suffix="part")
+
+        generator = SyntheticFileGenerator(
+            DatasetSpec(rows=CORPUS_ROWS, uploaders=UPLOADERS, end=END, span_days=(END - START).days)
+        )
+        DatasetLoader(using=connection.alias, batch_size=LOAD_BATCH, table=MONOLITHIC_TABLE).load(generator)
+        # the uploader with the most files
+        cls.uploader = generator.uploader_ids[0]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {} SELECT * FROM {}".format(quote(PARTITIONED_TABLE), quote(MONOLITHIC_TABLE))
+            )
+            cursor.execute("ANALYZE {}".format(quote(MONOLITHIC_TABLE)))
+            cursor.execute("ANALYZE {}".format(quote(PARTITIONED_TABLE)))
+            cursor.execute(
+                "SELECT id FROM {} ORDER BY id OFFSET %s LIMIT 1".format(quote(MONOLITHIC_TABLE)), [CORPUS_ROWS // 2]
+            )
+            cls.lookup_id = cursor.fetchone()[0]
+
+    def query(self, table, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=connection.ops.quote_name(table)), params)
+            return cursor.fetchall()
+
+    def queries(self):
+        uploader = self.uploader
+        middle = partitioning.add_months(START, CORPUS_MONTHS // 2)
+        retention_cutoff = partitioning.add_months(START, 3)
+        return {
+            # newest page of a user, FileAppServices.list_files_page without a cursor
+            "list_first_page": (
+                "SELECT id FROM {table} WHERE uploader = %s AND status = 'active' "
+                "ORDER BY created_at DESC, id DESC LIMIT 50",
+                [uploader],
+            ),
+            # a page deep into the history, the cursor bounds created_at
+            "list_cursor_page": (
+                "SELECT id FROM {table} WHERE uploader = %s AND status = 'active' AND created_at <= %s "
+                "AND (created_at < %s OR (created_at = %s AND id < %s)) ORDER BY created_at DESC, id DESC LIMIT 50",
+                [uploader, middle, middle, middle, uuid.UUID(int=0)],
+            ),
+            "created_month_count": (
+                "SELECT count(*) FROM {table} WHERE created_at >= %s AND created_at < %s",
+                [middle, partitioning.add_months(middle, 1)],
+            ),
+            # FileReaper.sweep
+            "retention_batch": (
+                "SELECT id, location FROM {table} WHERE status = 'deactivated' AND modified_at < %s "
+                "AND created_at < %s ORDER BY id LIMIT 500",
+                [retention_cutoff, retention_cutoff],
+            ),
+            # without created_at every partition is probed, the cost of partitioning
+            "get_by_id": ("SELECT id FROM {table} WHERE id = %s", [self.lookup_id]),
+        }
+
+    def test_partitioned_vs_monolithic(self):
+        results = []
+        for name, (sql, params) in self.queries().items():
+            for table, label in ((MONOLITHIC_TABLE, "monolithic"), (PARTITIONED_TABLE, "partitioned")):
+                results.append(
+                    run_benchmark(
+                        "partitions_{}_{}".format(name, label),
+                        lambda table=table, sql=sql, params=params: self.query(table, sql, params),
+                        ITERATIONS,
+                    )
+                )
+        for result in results:
+            print(result.as_row())
+
+        if UPDATE_BASELINE:
+            save_baseline(results)
+        else:
+            regressions = find_regressions(results, load_baseline())
+            self.assertEqual(regressions, [], "\n".join(regressions))
@@ -0,0 +1,103 @@
+# python imports
+import os
+import uuid
+import random
+import logging
+import unittest
+
+# django imports
+from django.db import connection
+from rest_framework.test import force_authenticate, APIRequestFactory
+from rest_framework.test import APITestCase
+
+# app imports
+from domain.users.models import UserPersonalData, UserBasePermissions
+from domain.files.models import File
+from domain.files.services import FileServices
+from application.users.services import UserAppServices
+from infrastructure.logger.models import AttributeLogger
+from interface import views
+
+# local imports
+from .harness import run_benchmark, load_baseline, save_baseline, find_regressions
+
+log = AttributeLogger(logging.getLogger(__name__))
+
+CORPUS_ROWS = int(os.environ.get("BENCHMARK_SEARCH_ROWS", "1000000"))
+INSERT_BATCH = 10000
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "30"))
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+WORDS = (
+    "invoice", "report", "scan", "contract", "receipt", "statement", "summary", "draft", "final", "budget",
+    "forecast", "audit", "payroll", "inventory", "shipment", "order", "quote", "claim", "policy", "memo",
+)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "search indexes only exist on postgres")
+class FileSearchBenchmarks(APITestCase):
+    """
+    Search endpoint against a corpus of BENCHMARK_SEARCH_ROWS files (default one million) of a single uploader.
+
+    python manage.py test benchmarks --pattern="bench_file_search.py"
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.factory = APIRequestFactory()
+        cls.file_search_view = views.FileViewSet.as_view({"get": "search"})
+        cls.user_01 = UserAppServices.create_user(
+            UserPersonalData(
+                username="Searcher",
+                first_name="Searcherman",
+                last_name="Searcherson",
+                email="searcherman@example.com",
+            ),
+            UserBasePermissions(is_staff=False, is_active=False),
+        )
+
+        rng = random.Random(40)
+        file_services = FileServices(log)
+        for start in range(0, CORPUS_ROWS, INSERT_BATCH):
+            files = []
+            for i in range(start, min(start + INSERT_BATCH, CORPUS_ROWS)):
+                words = rng.sample(WORDS, 3)
+                files.append(
+                    File(
+                        id=uuid.UUID(int=rng.getrandbits(128)),
+                        uploader=cls.user_01.id,
+                        title=" ".join(words[:2]),
+                        description="{} number {}".format(words[2], i),
+                        origin_name="{}_{}.pdf".format(words[0], i),
+                        location="bench/{}".format(i),
+                        status=File.ACTIVE_STATUS,
+                        meta_data={"mime_type": "application/pdf", "filesize_in_bytes": 1000},
+                    )
+                )
+            file_services.bulk_create_files(files, batch_size=INSERT_BATCH)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE {}".format(connection.ops.quote_name(File._meta.db_table)))
+
+    def search(self, params):
+        request = self.factory.get("/api/v0/file/search/", params)
+        force_authenticate(request, user=self.user_01)
+        response = self.file_search_view(request)
+        self.assertIs(response.status_code, 200)
+        response.render()
+        return response
+
+    def test_search(self):
+        cursor = self.search({"q": "audit payroll"}).data["next_cursor"]
+        results = [
+            run_benchmark("search_words", lambda: self.search({"q": "audit payroll"}), ITERATIONS),
+            run_benchmark("search_next_page", lambda: self.search({"q": "audit payroll", "cursor": cursor}), ITERATIONS),
+            run_benchmark("search_name_prefix", lambda: self.search({"q": "invoice_12345"}), ITERATIONS),
+            run_benchmark("search_no_match", lambda: self.search({"q": "nonexistent"}), ITERATIONS),
+        ]
+        for result in results:
+            print(result.as_row())
+
+        if UPDATE_BASELINE:
+            save_baseline(results)
+        else:
+            regressions = find_regressions(results, load_baseline())
+            self.assertEqual(regressions, [], "\n".join(regressions))
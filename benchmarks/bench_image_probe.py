@@ -0,0 +1,59 @@
+# python imports
+import io
+import os
+
+# django imports
+from django.test import SimpleTestCase
+from PIL import Image
+
+# app imports
+from application.files.image_probe import probe_image_size
+
+# local imports
+from .harness import run_benchmark, load_baseline, save_baseline, find_regressions
+
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "200"))
+UPDATE_BASELINE = os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1"
+FORMATS = (("png", "RGBA"), ("jpeg", "RGB"), ("gif", "P"), ("webp", "RGB"), ("tiff", "RGB"), ("bmp", "RGB"))
+
+
+def pil_size(file_obj):
+    with Image.open(file_obj) as img:
+        size = img.size
+    file_obj.seek(0)
+    return size
+
+
+class ImageProbeBenchmarks(SimpleTestCase):
+    """
+    Cost per image of the header prober against Image.open
+
+    python manage.py test benchmarks --pattern="bench_image_probe.py"
+    """
+
+    def test_probe_against_pil(self):
+        results = []
+        for fmt, mode in FORMATS:
+            file_obj = io.BytesIO()
+            Image.new(mode, (2000, 1500)).save(file_obj, fmt)
+            file_obj.seek(0)
+            self.assertEqual(probe_image_size(file_obj), pil_size(file_obj))
+
+            results.append(
+                run_benchmark(
+                    "probe_{}".format(fmt), lambda: probe_image_size(file_obj), ITERATIONS, count_queries=False
+                )
+            )
+            results.append(
+                run_benchmark(
+                    "pil_open_{}".format(fmt), lambda: pil_size(file_obj), ITERATIONS, count_queries=False
+                )
+            )
+
+        for result in results:
+            print(result.as_row())
+        if UPDATE_BASELINE:
+            save_baseline(results)
+        else:
+            regressions = find_regressions(results, load_baseline())
+            self.assertEqual(regressions, [], "\n".join(regressions))
@@ -0,0 +1,167 @@
+# python imports
+import gc
+import json
+import math
+import os
+import time
+import typing
+import tracemalloc
+import warnings
+from contextlib import ExitStack
+from dataclasses import dataclass, asdict
+
+# django imports
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+# relative slack allowed against the baseline before a run counts as a regression
+DEFAULT_TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.25"))
+# with BENCHMARK_STRICT=1 a benchmark without a baseline entry fails the run instead of warning
+STRICT_BASELINE = os.environ.get("BENCHMARK_STRICT") == "1"
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    iterations: int
+    throughput_per_s: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    queries_per_call: float
+    peak_memory_kb: float
+
+    def as_row(self) -> str:
+        return "{:<45} {:>9.1f}/s  p50 {:>8.2f}ms  p95 {:>8.2f}ms  p99 {:>8.2f}ms  {:>5.1f} q  {:>9.1f} KB".format(
+            self.name,
+            self.throughput_per_s,
+            self.p50_ms,
+            self.p95_ms,
+            self.p99_ms,
+            self.queries_per_call,
+            self.peak_memory_kb,
+        )
+
+
+def percentile(sorted_values: typing.List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_benchmark(
+    name: str,
+    func: typing.Callable[[], typing.Any],
+    iterations: int = 50,
+    warmup: int = 3,
+    setup: typing.Callable[[], typing.Any] = None,
+    count_queries: bool = True,
+    profile_iterations: int = 3,
+) -> BenchmarkResult:
+    """
+    Calls func iterations times (after warmup calls) and records latency percentiles and throughput.
+    Database queries per call and the peak traced memory of a single call come from a separate pass of
+    profile_iterations calls, tracing would otherwise slow down the timed calls. setup runs before
+    every call and is not measured.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        func()
+
+    latencies = []
+    gc.collect()
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+
+    queries = 0
+    peak_memory = 0
+    profile_iterations = max(1, profile_iterations)
+    for _ in range(profile_iterations):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) if count_queries else ExitStack() as captured:
+            func()
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        if count_queries:
+            queries += len(captured)
+
+    latencies.sort()
+    total = sum(latencies)
+    return BenchmarkResult(
+        name=name,
+        iterations=iterations,
+        throughput_per_s=iterations / total if total else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        queries_per_call=queries / profile_iterations,
+        peak_memory_kb=peak_memory / 1024,
+    )
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(results: typing.Iterable[BenchmarkResult], path: str = BASELINE_PATH):
+    baseline = load_baseline(path)
+    baseline.update({result.name: asdict(result) for result in results})
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write("\n")
+
+
+def find_regressions(
+    results: typing.Iterable[BenchmarkResult],
+    baseline: dict,
+    tolerance: float = DEFAULT_TOLERANCE,
+    strict: bool = STRICT_BASELINE,
+) -> typing.List[str]:
+    """
+    Compares results with the stored baseline. Latency, memory and throughput may drift within tolerance,
+    the number of queries per call must not grow at all. A result without a baseline entry only warns,
+    unless strict is set.
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            message = "{}: no baseline, record one with BENCHMARK_UPDATE_BASELINE=1".format(result.name)
+            if strict:
+                regressions.append(message)
+            else:
+                warnings.warn(message)
+            continue
+        if result.throughput_per_s < expected["throughput_per_s"] * (1 - tolerance):
+            regressions.append(
+                "{}: throughput {:.1f}/s < baseline {:.1f}/s".format(
+                    result.name, result.throughput_per_s, expected["throughput_per_s"]
+                )
+            )
+        for metric in ("p95_ms", "p99_ms", "peak_memory_kb"):
+            if getattr(result, metric) > expected[metric] * (1 + tolerance):
+                regressions.append(
+                    "{}: {} {:.2f} > baseline {:.2f}".format(
+                        result.name, metric, getattr(result, metric), expected[metric]
+                    )
+                )
+        if result.queries_per_call > expected["queries_per_call"]:
+            regressions.append(
+                "{}: queries per call {:.1f} > baseline {:.1f}".format(
+                    result.name, result.queries_per_call, expected["queries_per_call"]
+                )
+            )
+    return regressions
@@ -0,0 +1,62 @@
+import json
+
+from django.db import migrations, models
+
+import domain.files.models
+
+BATCH_SIZE = 1000
+
+
+def _normalize(meta_data):
+    # meta_data used to be stored as a JSON encoded string inside the JSON column (sometimes more than once) or as ""
+    while isinstance(meta_data, str):
+        if meta_data == "":
+            return None
+        try:
+            meta_data = json.loads(meta_data)
+        except ValueError:
+            return None
+    if isinstance(meta_data, dict):
+        return {key: value for key, value in meta_data.items() if value is not None}
+    return meta_data
+
+
+def normalize_meta_data(apps, schema_editor):
+    File = apps.get_model("files", "File")
+    db_alias = schema_editor.connection.alias
+    last_pk = None
+    while True:
+        qs = File.objects.using(db_alias).only("id", "meta_data").order_by("pk")
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        batch = list(qs[:BATCH_SIZE])
+        if not batch:
+            break
+        changed = []
+        for file in batch:
+            normalized = _normalize(file.meta_data)
+            if normalized != file.meta_data:
+                file.meta_data = normalized
+                changed.append(file)
+        if changed:
+            File.objects.using(db_alias).bulk_update(changed, ["meta_data"])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    # every batch is committed on its own so that big tables are not locked for the whole run
+    atomic = False
+
+    dependencies = [
+        ('files', '0002_file_meta_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='meta_data',
+            field=models.JSONField(blank=True, encoder=domain.files.models.CompactJSONEncoder, null=True),
+        ),
+        migrations.RunPython(normalize_meta_data, migrations.RunPython.noop),
+    ]
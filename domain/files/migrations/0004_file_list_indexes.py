@@ -0,0 +1,29 @@
+import django.db.models.expressions
+import django.db.models.fields.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0003_normalize_file_meta_data'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['uploader', 'status', 'created_at'], name='file_uploader_status_created'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['uploader', 'modified_at'], name='file_uploader_modified'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['uploader', 'origin_name'], name='file_uploader_origin_name', opclasses=['uuid_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(django.db.models.expressions.F('uploader'), django.db.models.fields.json.KeyTransform('mime_type', 'meta_data'), name='file_uploader_mime_type'),
+        ),
+    ]
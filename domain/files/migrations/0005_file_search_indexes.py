@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# must match domain.files.services.SEARCH_VECTOR_SQL
+SEARCH_VECTOR_SQL = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+
+
+def create_search_indexes(apps, schema_editor):
+    # tsvector and pg_trgm only exist on postgres, search falls back to unindexed lookups elsewhere
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("files", "File")._meta.db_table)
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS file_search_vector ON {} USING gin (({}))".format(
+            table, SEARCH_VECTOR_SQL
+        )
+    )
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS file_origin_name_trgm ON {} USING gin (origin_name gin_trgm_ops)".format(
+            table
+        )
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS file_search_vector")
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS file_origin_name_trgm")
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY does not block writes but can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('files', '0004_file_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_file_pending_status_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileUploadSession',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('uploader', models.UUIDField()),
+                ('origin_name', models.CharField(max_length=100)),
+                ('size', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('parts', models.JSONField(default=list)),
+                ('file_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('size_soft_limit_mb', models.IntegerField(blank=True, null=True)),
+                ('file_id', models.UUIDField(blank=True, null=True)),
+                ('upload_key', models.CharField(blank=True, max_length=200, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_fileuploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='last_accessed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='access_count',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='storage_class',
+            field=models.CharField(default='STANDARD', max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['storage_class', 'last_accessed'], name='file_storage_class_accessed'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from domain.files import partitioning
+
+
+def partition_file_table(apps, schema_editor):
+    # declarative partitioning only exists on postgres, other databases keep the plain table
+    if not partitioning.supports_partitioning(schema_editor.connection):
+        return
+    table = apps.get_model("files", "File")._meta.db_table
+    partitioning.convert_to_partitioned(schema_editor.connection, table)
+
+
+def unpartition_file_table(apps, schema_editor):
+    if not partitioning.supports_partitioning(schema_editor.connection):
+        return
+    table = apps.get_model("files", "File")._meta.db_table
+    partitioning.convert_to_monolithic(
+        schema_editor.connection, table, [("file_uploader_idempotency_key", ["uploader", "idempotency_key"])]
+    )
+
+
+class Migration(migrations.Migration):
+
+    # the rows are copied in batches, each batch commits on its own while the table stays writable
+    atomic = False
+
+    dependencies = [
+        ('files', '0008_file_access_statistics'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_file_table, unpartition_file_table),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_partition_file_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='idempotency_fingerprint',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -1,10 +1,14 @@
 # python imports
 import uuid
 import json
-from dataclasses import dataclass, field
+import typing
+from dataclasses import dataclass, field, asdict
 
 # django imports
 from django.db import models
+from django.db.models import F
+from django.db.models.fields.json import KeyTransform
+from django.core.serializers.json import DjangoJSONEncoder
 
 # app imports
 from lib.django import custom_models
@@ -25,14 +29,109 @@ class FileID:
     value: uuid.UUID
 
 
+@dataclass(frozen=True)
+class FileMetaData:
+    """
+    This is a value object that holds the canonical meta data of a File. It is stored as a compact JSON object in File.meta_data
+    """
+
+    mime_type: str
+    filesize_in_bytes: int
+    width: typing.Optional[int] = None
+    height: typing.Optional[int] = None
+    # encoding of the stored object, None when it is stored as uploaded
+    content_encoding: typing.Optional[str] = None
+
+    CONTENT_ENCODINGS = ("gzip", "zstd")
+
+    def __post_init__(self):
+        if not isinstance(self.mime_type, str) or not self.mime_type:
+            raise VOValidationExcpetion(
+                "meta_data", "mime_type is not valid - {}".format(self.mime_type)
+            )
+        if self.content_encoding is not None and self.content_encoding not in self.CONTENT_ENCODINGS:
+            raise VOValidationExcpetion(
+                "meta_data", "content_encoding is not valid - {}".format(self.content_encoding)
+            )
+        for name in ("filesize_in_bytes", "width", "height"):
+            value = getattr(self, name)
+            if value is None and name != "filesize_in_bytes":
+                continue
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise VOValidationExcpetion(
+                    "meta_data", "{} is not valid - {}".format(name, value)
+                )
+
+    @classmethod
+    def from_value(cls, value) -> typing.Optional["FileMetaData"]:
+        """
+        Builds the value object from a dict, a (possibly repeatedly) JSON encoded string or an existing instance.
+        Empty values return None.
+        """
+        while isinstance(value, str):
+            if value == "":
+                return None
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise VOValidationExcpetion(
+                    "meta_data", "meta_data is not valid JSON - {}".format(value)
+                )
+        if value is None or isinstance(value, cls):
+            return value
+        if not isinstance(value, dict):
+            raise VOValidationExcpetion(
+                "meta_data", "meta_data must be an object - {}".format(value)
+            )
+        unknown_keys = set(value) - set(cls.__dataclass_fields__)
+        if unknown_keys:
+            raise VOValidationExcpetion(
+                "meta_data", "unknown keys - {}".format(sorted(unknown_keys))
+            )
+        try:
+            return cls(**value)
+        except TypeError as e:
+            raise VOValidationExcpetion("meta_data", str(e))
+
+    def to_dict(self) -> dict:
+        """
+        Returns the compact representation stored in the database, unset values are omitted
+        """
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+def normalize_meta_data(meta_data) -> typing.Optional[dict]:
+    meta = FileMetaData.from_value(meta_data)
+    return meta.to_dict() if meta is not None else None
+
+
+class CompactJSONEncoder(DjangoJSONEncoder):
+    """
+    Serializes JSON without whitespace and with sorted keys so that equal meta data is stored byte for byte equal
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs["separators"] = (",", ":")
+        kwargs["sort_keys"] = True
+        super().__init__(*args, **kwargs)
+
+
 class File(custom_models.DatedModel):
     """
     A File represents the entrypoint for any type of trades of a given security
     """
 
+    STANDARD_STORAGE_CLASS = "STANDARD"
+
+    # pending Files are registered before their object is stored and become active once it is
+    PENDING_STATUS = "pending"
     ACTIVE_STATUS = "active"
     DEACTIVATED_STATUS = "deactivated"
-    STATUS_CHOICES = [(ACTIVE_STATUS, "Active"), (DEACTIVATED_STATUS, "Deactivated")]
+    STATUS_CHOICES = [
+        (PENDING_STATUS, "Pending"),
+        (ACTIVE_STATUS, "Active"),
+        (DEACTIVATED_STATUS, "Deactivated"),
+    ]
 
     id = models.UUIDField(primary_key=True, editable=False)
     uploader = models.UUIDField()
@@ -41,7 +140,14 @@ class File(custom_models.DatedModel):
     origin_name = models.CharField(max_length=100)
     location = models.CharField(max_length=200)
     status = models.CharField(max_length=250, choices=STATUS_CHOICES)
-    meta_data = models.JSONField(null=True,blank=True)
+    meta_data = models.JSONField(null=True, blank=True, encoder=CompactJSONEncoder)
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+    # digest of the upload that registered idempotency_key, a later upload with the key must match it
+    idempotency_fingerprint = models.CharField(max_length=64, null=True, blank=True)
+    # access statistics are flushed in batches, they lag behind by up to FILES_ACCESS_FLUSH_INTERVAL
+    last_accessed = models.DateTimeField(null=True, blank=True)
+    access_count = models.BigIntegerField(default=0)
+    storage_class = models.CharField(max_length=32, default=STANDARD_STORAGE_CLASS)
 
     def update_entity(
         self,
@@ -66,10 +172,29 @@ class File(custom_models.DatedModel):
         if status is not None:
             self.status = status
         if meta_data is not None:
-            self.meta_data = meta_data
+            self.meta_data = normalize_meta_data(meta_data)
+
+    def get_meta_data(self) -> typing.Optional[FileMetaData]:
+        return FileMetaData.from_value(self.meta_data)
 
     class Meta:
         ordering = ["id"]
+        indexes = [
+            models.Index(fields=["uploader", "status", "created_at"], name="file_uploader_status_created"),
+            models.Index(fields=["uploader", "modified_at"], name="file_uploader_modified"),
+            # varchar_pattern_ops lets postgres use the index for prefix (LIKE 'abc%') lookups in any locale
+            models.Index(
+                fields=["uploader", "origin_name"],
+                name="file_uploader_origin_name",
+                opclasses=["uuid_ops", "varchar_pattern_ops"],
+            ),
+            models.Index(F("uploader"), KeyTransform("mime_type", "meta_data"), name="file_uploader_mime_type"),
+            models.Index(fields=["status", "modified_at"], name="file_status_modified"),
+            models.Index(fields=["storage_class", "last_accessed"], name="file_storage_class_accessed"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["uploader", "idempotency_key"], name="file_uploader_idempotency_key"),
+        ]
 
 
 class FileFactory:
@@ -92,7 +217,7 @@ class FileFactory:
             origin_name=origin_name,
             location=location,
             status=status,
-            meta_data=meta_data
+            meta_data=normalize_meta_data(meta_data),
         )
 
     @classmethod
@@ -110,3 +235,24 @@ class FileFactory:
         return cls.build_entity(
             file_id, uploader, title, description, origin_name, location, status, meta_data
         )
+
+
+class FileUploadSession(custom_models.DatedModel):
+    """
+    Server side state of a resumable upload, the received chunks are stored as separate part objects
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    uploader = models.UUIDField()
+    origin_name = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # [[offset, storage key], ...] in upload order
+    parts = models.JSONField(default=list)
+    file_type = models.CharField(max_length=100, null=True, blank=True)
+    size_soft_limit_mb = models.IntegerField(null=True, blank=True)
+    file_id = models.UUIDField(null=True, blank=True)
+    upload_key = models.CharField(max_length=200, null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
@@ -0,0 +1,401 @@
+# python imports
+import time
+import logging
+import datetime
+from typing import Iterator, List, Optional, Tuple
+
+# django imports
+from django.conf import settings
+from django.db import transaction
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+# Range partitioning of the File table by created_at, one partition per month plus a default partition
+# for rows outside every range. Only postgres supports it, every function expects a postgres connection.
+# A partitioned table can only have unique indexes that contain the partition key, so the primary key
+# becomes (id, created_at) and the uniqueness of (uploader, idempotency_key) is kept in a side table
+# that a trigger maintains. Queries that filter on created_at only read the matching partitions.
+PARTITION_KEY = "created_at"
+# bound expressions and select_for_update on partitioned tables need postgres 12
+MIN_PG_VERSION = 120000
+BACKFILL_BATCH = 10000
+
+
+def month_start(value: datetime.datetime) -> datetime.datetime:
+    value = value.astimezone(datetime.timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value: datetime.datetime, months: int) -> datetime.datetime:
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def iter_months(start: datetime.datetime, end: datetime.datetime) -> Iterator[datetime.datetime]:
+    """
+    Yields the first instant of every month from start's month to end's month, both included
+    """
+    month = month_start(start)
+    while month <= end:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table: str, month: datetime.datetime) -> str:
+    return "{}_p{:%Y_%m}".format(table, month)
+
+
+def default_partition_name(table: str) -> str:
+    return "{}_pdefault".format(table)
+
+
+def idempotency_table_name(table: str) -> str:
+    return "{}_idempotency_key".format(table)
+
+
+def months_ahead() -> int:
+    return getattr(settings, "FILES_PARTITION_MONTHS_AHEAD", 3)
+
+
+def supports_partitioning(connection) -> bool:
+    return connection.vendor == "postgresql" and connection.pg_version >= MIN_PG_VERSION
+
+
+def is_partitioned(connection, table: str) -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid))",
+            [table],
+        )
+        return cursor.fetchone()[0]
+
+
+def list_partitions(connection, table: str) -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s ORDER BY c.relname",
+            [table],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_partition(connection, table: str, month: datetime.datetime) -> bool:
+    """
+    Creates the partition of month unless it exists. Rows of the month that landed in the default
+    partition are moved into it in the same transaction, attaching would fail otherwise, and keep their
+    idempotency keys. Returns whether it was created.
+    """
+    name = partition_name(table, month)
+    if name in list_partitions(connection, table):
+        return False
+    quote = connection.ops.quote_name
+    bounds = [month, add_months(month, 1)]
+    default = default_partition_name(table)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        has_default = default in list_partitions(connection, table)
+        stray = False
+        if has_default:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM {} WHERE {} >= %s AND {} < %s)".format(
+                    quote(default), PARTITION_KEY, PARTITION_KEY
+                ),
+                bounds,
+            )
+            stray = cursor.fetchone()[0]
+        if not stray:
+            cursor.execute(
+                "CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)".format(quote(name), quote(table)),
+                bounds,
+            )
+        else:
+            cursor.execute(
+                "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)".format(quote(name), quote(table))
+            )
+            cursor.execute(
+                "WITH moved AS (DELETE FROM {default} WHERE {key} >= %s AND {key} < %s RETURNING *) "
+                "INSERT INTO {name} SELECT * FROM moved".format(
+                    default=quote(default), key=PARTITION_KEY, name=quote(name)
+                ),
+                bounds,
+            )
+            side = idempotency_table_name(table)
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [side])
+            if cursor.fetchone()[0]:
+                # the DELETE fired the idempotency trigger of the default partition, the INSERT into the
+                # detached table fires none, so the keys of the moved rows are registered again here
+                cursor.execute(
+                    "INSERT INTO {} (uploader, idempotency_key) SELECT uploader, idempotency_key FROM {} "
+                    "WHERE idempotency_key IS NOT NULL".format(quote(side), quote(name))
+                )
+            cursor.execute(
+                "ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)".format(quote(table), quote(name)),
+                bounds,
+            )
+    logger.info("Created partition {}".format(name))
+    return True
+
+
+def ensure_partitions(connection, table: str, start: datetime.datetime, end: datetime.datetime) -> List[str]:
+    """
+    Creates the missing monthly partitions between start and end and the default partition
+    """
+    created = [
+        partition_name(table, month) for month in iter_months(start, end) if create_partition(connection, table, month)
+    ]
+    default = default_partition_name(table)
+    if default not in list_partitions(connection, table):
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE {} PARTITION OF {} DEFAULT".format(quote(default), quote(table)))
+        created.append(default)
+    return created
+
+
+def ensure_future_partitions(
+    connection, table: str, months: Optional[int] = None, now: Optional[datetime.datetime] = None
+) -> List[str]:
+    """
+    Creates the partitions of the current and the next months (FILES_PARTITION_MONTHS_AHEAD by default)
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    months = months if months is not None else months_ahead()
+    return ensure_partitions(connection, table, now, add_months(month_start(now), months))
+
+
+def _index_definitions(cursor, table: str) -> List[Tuple[str, str]]:
+    # primary keys and unique indexes are rebuilt by hand, they have to change on a partitioned table
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(x.indexrelid) FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE t.relname = %s AND pg_table_is_visible(t.oid) AND NOT x.indisunique ORDER BY i.relname",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def copy_indexes(connection, cursor, source: str, target: str, suffix: str = "new") -> List[Tuple[str, str]]:
+    """
+    Creates source's non unique indexes on target named <index>_<suffix>, returns (copy, original) names
+    """
+    quote = connection.ops.quote_name
+    renames = []
+    for name, definition in _index_definitions(cursor, source):
+        temporary = "{}_{}".format(name[:50], suffix)
+        # "CREATE INDEX name ON [ONLY] schema.table USING method (columns) [WHERE ...]"
+        using = definition.split(" USING ", 1)[1]
+        cursor.execute("CREATE INDEX {} ON {} USING {}".format(quote(temporary), quote(target), using))
+        renames.append((temporary, name))
+    return renames
+
+
+def _create_idempotency_table(connection, cursor, table: str):
+    quote = connection.ops.quote_name
+    side = idempotency_table_name(table)
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS {} (uploader uuid NOT NULL, idempotency_key varchar(100) NOT NULL, "
+        "PRIMARY KEY (uploader, idempotency_key))".format(quote(side))
+    )
+    cursor.execute(
+        """
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.idempotency_key IS NOT NULL THEN
+                DELETE FROM {side} WHERE uploader = OLD.uploader AND idempotency_key = OLD.idempotency_key;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.idempotency_key IS NOT NULL THEN
+                -- a duplicate raises unique_violation, the same error the unique constraint raised
+                INSERT INTO {side} (uploader, idempotency_key) VALUES (NEW.uploader, NEW.idempotency_key);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """.format(function=quote("{}_idempotency".format(table)), side=quote(side))
+    )
+
+
+def _attach_idempotency_trigger(connection, cursor, table: str, function_table: str):
+    quote = connection.ops.quote_name
+    cursor.execute(
+        "CREATE TRIGGER {} AFTER INSERT OR DELETE OR UPDATE OF uploader, idempotency_key ON {} "
+        "FOR EACH ROW EXECUTE PROCEDURE {}()".format(
+            quote("{}_idempotency".format(function_table)), quote(table), quote("{}_idempotency".format(function_table))
+        )
+    )
+
+
+def create_partitioned_table(
+    connection, source: str, target: str, start, end, suffix: str = "new"
+) -> List[Tuple[str, str]]:
+    """
+    Creates target as an empty partitioned copy of source's columns and indexes with partitions from
+    start to end. Returns the (temporary, original) index names.
+    """
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+            "PARTITION BY RANGE ({})".format(quote(target), quote(source), PARTITION_KEY)
+        )
+        cursor.execute(
+            "ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY (id, {})".format(
+                quote(target), quote("{}_pkey_{}".format(source, suffix)), PARTITION_KEY
+            )
+        )
+        renames = copy_indexes(connection, cursor, source, target, suffix)
+    ensure_partitions(connection, target, start, end)
+    return renames
+
+
+def _mirror_function(table: str) -> str:
+    return "{}_mirror".format(table)
+
+
+def convert_to_partitioned(connection, table: str, batch_size: int = BACKFILL_BATCH, pause: float = 0.0):
+    """
+    Converts table in place without blocking reads or writes for longer than the final swap:
+    1. an empty partitioned copy is created
+    2. a trigger mirrors every write on table into the copy
+    3. the existing rows are copied in id order, one short transaction per batch
+    4. table is dropped and the copy renamed to it under an exclusive lock
+    A run that stopped before the swap is restarted by dropping the copy.
+    """
+    if is_partitioned(connection, table):
+        return
+    quote = connection.ops.quote_name
+    target = "{}_partitioned".format(table)
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS {} CASCADE".format(quote(target)))
+        cursor.execute("SELECT min({}) FROM {}".format(PARTITION_KEY, quote(table)))
+        oldest = cursor.fetchone()[0]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    renames = create_partitioned_table(
+        connection, table, target, oldest or now, add_months(month_start(now), months_ahead())
+    )
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        _create_idempotency_table(connection, cursor, table)
+        cursor.execute("TRUNCATE {}".format(quote(idempotency_table_name(table))))
+        _attach_idempotency_trigger(connection, cursor, target, table)
+        # the copy of a row is replaced on every write, a backfilled version never overwrites a newer one
+        cursor.execute(
+            """
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {target} WHERE id = OLD.id;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {target} SELECT (NEW).*;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """.format(function=quote(_mirror_function(table)), target=quote(target))
+        )
+        cursor.execute(
+            "CREATE TRIGGER {name} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+            "FOR EACH ROW EXECUTE PROCEDURE {name}()".format(name=quote(_mirror_function(table)), table=quote(table))
+        )
+
+    copied = backfill(connection, table, target, batch_size, pause)
+    logger.info("Copied {} rows of {} into {}".format(copied, table, target))
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(quote(table)))
+        cursor.execute("DROP TABLE {}".format(quote(table)))
+        cursor.execute("DROP FUNCTION {}()".format(quote(_mirror_function(table))))
+        cursor.execute("ALTER TABLE {} RENAME TO {}".format(quote(target), quote(table)))
+        cursor.execute(
+            "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                quote(table), quote("{}_pkey_new".format(table)), quote("{}_pkey".format(table))
+            )
+        )
+        for temporary, original in renames:
+            cursor.execute("ALTER INDEX {} RENAME TO {}".format(quote(temporary), quote(original)))
+        for partition in list_partitions(connection, table):
+            if partition.startswith(target):
+                cursor.execute(
+                    "ALTER TABLE {} RENAME TO {}".format(quote(partition), quote(table + partition[len(target):]))
+                )
+        cursor.execute("ANALYZE {}".format(quote(table)))
+
+
+def backfill(connection, source: str, target: str, batch_size: int = BACKFILL_BATCH, pause: float = 0.0) -> int:
+    """
+    Copies the rows of source into target in id order. The source rows of a batch are share locked,
+    so a concurrent update or delete waits and its trigger then replaces or removes the copy.
+    """
+    quote = connection.ops.quote_name
+    copied = 0
+    last_id = None
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            if last_id is None:
+                cursor.execute("SELECT id FROM {} ORDER BY id LIMIT %s".format(quote(source)), [batch_size])
+            else:
+                cursor.execute(
+                    "SELECT id FROM {} WHERE id > %s ORDER BY id LIMIT %s".format(quote(source)), [last_id, batch_size]
+                )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return copied
+            cursor.execute(
+                "INSERT INTO {} SELECT * FROM {} WHERE id >= %s AND id <= %s FOR SHARE "
+                "ON CONFLICT DO NOTHING".format(quote(target), quote(source)),
+                [ids[0], ids[-1]],
+            )
+            copied += cursor.rowcount
+            last_id = ids[-1]
+        if pause:
+            # leaves room for replication and autovacuum on busy primaries
+            time.sleep(pause)
+
+
+def convert_to_monolithic(connection, table: str, unique_constraints: List[Tuple[str, List[str]]] = ()):
+    """
+    Turns the partitioned table back into a plain table with the given (name, columns) unique constraints.
+    It copies the rows under an exclusive lock and is meant for rolling the migration back, not for large tables.
+    """
+    if not is_partitioned(connection, table):
+        return
+    quote = connection.ops.quote_name
+    target = "{}_monolithic".format(table)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(quote(table)))
+        cursor.execute(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)".format(
+                quote(target), quote(table)
+            )
+        )
+        cursor.execute("INSERT INTO {} SELECT * FROM {}".format(quote(target), quote(table)))
+        cursor.execute(
+            "ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY (id)".format(quote(target), quote("{}_pkey_new".format(table)))
+        )
+        renames = copy_indexes(connection, cursor, table, target)
+        cursor.execute("DROP TABLE {}".format(quote(table)))
+        for name, columns in unique_constraints:
+            cursor.execute(
+                "ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})".format(
+                    quote(target), quote(name), ", ".join(quote(column) for column in columns)
+                )
+            )
+        cursor.execute("DROP TABLE IF EXISTS {}".format(quote(idempotency_table_name(table))))
+        cursor.execute("DROP FUNCTION IF EXISTS {}()".format(quote("{}_idempotency".format(table))))
+        cursor.execute("ALTER TABLE {} RENAME TO {}".format(quote(target), quote(table)))
+        cursor.execute(
+            "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                quote(table), quote("{}_pkey_new".format(table)), quote("{}_pkey".format(table))
+            )
+        )
+        for temporary, original in renames:
+            cursor.execute("ALTER INDEX {} RENAME TO {}".format(quote(temporary), quote(original)))
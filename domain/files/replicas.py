@@ -0,0 +1,136 @@
+# python imports
+import time
+import random
+import logging
+import threading
+import contextvars
+from typing import Dict, List, Optional, Tuple
+
+# django imports
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .models import File
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+# monotonic deadline until which reads in this context stay on the primary
+_pinned_until = contextvars.ContextVar("files_pinned_until", default=0.0)
+
+LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaSelector:
+    """
+    Picks the database alias for File reads. Reads go to one of FILES_READ_REPLICAS unless
+    - the caller wrote within FILES_READ_YOUR_WRITES_SECONDS, in this context or, through the cache, in an
+      earlier request of the same user
+    - no replica is within FILES_REPLICA_MAX_LAG_SECONDS of the primary
+    in which case they go to the primary. Writes always go to the primary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # alias -> (monotonic time of the check, lag in seconds or None when the replica is unreachable)
+        self._lag: Dict[str, Tuple[float, Optional[float]]] = {}
+
+    @property
+    def replicas(self) -> List[str]:
+        return list(getattr(settings, "FILES_READ_REPLICAS", []))
+
+    @property
+    def primary(self) -> str:
+        return router.db_for_write(File)
+
+    @property
+    def stickiness(self) -> float:
+        return getattr(settings, "FILES_READ_YOUR_WRITES_SECONDS", 10)
+
+    @property
+    def max_lag(self) -> float:
+        return getattr(settings, "FILES_REPLICA_MAX_LAG_SECONDS", 5)
+
+    @property
+    def lag_check_interval(self) -> float:
+        return getattr(settings, "FILES_REPLICA_LAG_CHECK_SECONDS", 5)
+
+    def _pin_key(self, user_id) -> str:
+        return "files:primary-pin:{}".format(user_id)
+
+    def _pin_cache(self):
+        return caches[getattr(settings, "FILES_REPLICA_PIN_CACHE", "default")]
+
+    def pin(self, user_id=None):
+        """
+        Sends the following reads of this context, and of user_id's next requests, to the primary
+        """
+        if not self.replicas:
+            return
+        _pinned_until.set(time.monotonic() + self.stickiness)
+        if user_id is not None:
+            try:
+                self._pin_cache().set(self._pin_key(user_id), 1, self.stickiness)
+            except Exception as e:
+                logger.warning("Primary pin of user {} could not be cached - {}".format(user_id, e))
+
+    def is_pinned(self, user_id=None) -> bool:
+        if _pinned_until.get() > time.monotonic():
+            return True
+        if user_id is None:
+            return False
+        try:
+            return self._pin_cache().get(self._pin_key(user_id)) is not None
+        except Exception:
+            # without the cache the replica might miss the user's own writes
+            return True
+
+    def measure_lag(self, alias: str) -> Optional[float]:
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            # test mirrors and single node setups
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0])
+
+    def replica_lag(self, alias: str) -> Optional[float]:
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._lag.get(alias, (None, None))
+            if checked_at is not None and now - checked_at < self.lag_check_interval:
+                return lag
+        try:
+            lag = self.measure_lag(alias)
+        except Exception as e:
+            logger.warning("Replication lag of {} could not be measured - {}".format(alias, e))
+            lag = None
+        with self._lock:
+            self._lag[alias] = (now, lag)
+        return lag
+
+    def healthy_replicas(self) -> List[str]:
+        healthy = []
+        for alias in self.replicas:
+            lag = self.replica_lag(alias)
+            if lag is not None and lag <= self.max_lag:
+                healthy.append(alias)
+        return healthy
+
+    def read_alias(self, user_id=None) -> str:
+        if not self.replicas or self.is_pinned(user_id):
+            return self.primary
+        healthy = self.healthy_replicas()
+        if not healthy:
+            return self.primary
+        return random.choice(healthy)
+
+
+replica_selector = ReplicaSelector()
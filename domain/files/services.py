@@ -1,15 +1,35 @@
 # python imports
-from typing import Type
+import datetime
+from decimal import Decimal
+from typing import List, Optional, Type
 
 # django imports
+from django.db import connections
+from django.db.models import BooleanField, Case, DecimalField, Q, Value, When
+from django.db.models.expressions import RawSQL
 from django.db.models.manager import Manager
+from django.db.models.query import QuerySet
 
 # app imports
 from infrastructure.logger.models import AttributeLogger
 
 # local imports
 from .models import FileFactory
-from .models import File
+from .models import File, FileUploadSession
+from .replicas import replica_selector
+
+# the expression must stay identical to the one indexed in migration 0005, otherwise postgres will not use the index
+SEARCH_VECTOR_SQL = "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))"
+SEARCH_MATCH_SQL = (
+    "(" + SEARCH_VECTOR_SQL + " @@ plainto_tsquery('simple', %s) OR origin_name ILIKE %s OR origin_name %% %s)"
+)
+SEARCH_RANK_SQL = (
+    "round((ts_rank(" + SEARCH_VECTOR_SQL + ", plainto_tsquery('simple', %s)) + similarity(origin_name, %s))::numeric, 6)"
+)
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 
 class FileServices:
@@ -22,3 +42,82 @@ class FileServices:
     def get_file_repo(self) -> Type[Manager]:
         # We expose the whole repository as a service to avoid making a service for each repo action. If some repo action is used constantly in multiple places consider exposing it as a service.
         return File.objects
+
+    def get_file_read_repo(self, user_id=None) -> QuerySet:
+        """
+        Files on a replica for read only queries, on the primary while user_id's own writes may not have
+        replicated yet. Rows that are modified and saved again must come from get_file_repo.
+        """
+        return File.objects.using(replica_selector.read_alias(user_id))
+
+    def record_write(self, user_id=None):
+        """
+        Keeps the following reads of the user on the primary so they see the write
+        """
+        replica_selector.pin(user_id)
+
+    def get_upload_session_repo(self) -> Type[Manager]:
+        return FileUploadSession.objects
+
+    def bulk_create_files(self, files: List[File], batch_size: int = 500) -> List[File]:
+        return File.objects.bulk_create(files, batch_size=batch_size)
+
+    def filter_files(
+        self,
+        uploader: Optional[str] = None,
+        status: Optional[str] = None,
+        created_after: Optional[datetime.datetime] = None,
+        created_before: Optional[datetime.datetime] = None,
+        modified_after: Optional[datetime.datetime] = None,
+        modified_before: Optional[datetime.datetime] = None,
+        mime_type: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        for_update: bool = False,
+    ) -> QuerySet:
+        """
+        Builds the File query with every predicate pushed down to the database. Only active files are
+        returned unless another status is asked for. The predicates are backed by the indexes on File.
+        The query runs on a replica unless for_update asks for rows that will be saved again.
+        """
+        queryset = File.objects.all() if for_update else self.get_file_read_repo(uploader)
+        if uploader is not None:
+            queryset = queryset.filter(uploader=uploader)
+        queryset = queryset.filter(status=status or File.ACTIVE_STATUS)
+        if created_after is not None:
+            queryset = queryset.filter(created_at__gte=created_after)
+        if created_before is not None:
+            queryset = queryset.filter(created_at__lt=created_before)
+        if modified_after is not None:
+            queryset = queryset.filter(modified_at__gte=modified_after)
+        if modified_before is not None:
+            queryset = queryset.filter(modified_at__lt=modified_before)
+        if mime_type is not None:
+            queryset = queryset.filter(meta_data__mime_type=mime_type)
+        if name_prefix is not None:
+            queryset = queryset.filter(origin_name__startswith=name_prefix)
+        return queryset
+
+    def search_files(self, query: str, **filters) -> QuerySet:
+        """
+        Files matching query in title/description (full-text) or origin_name (prefix or trigram similarity),
+        annotated with search_rank. Takes the filters of filter_files.
+        """
+        queryset = self.filter_files(**filters)
+        rank_field = DecimalField(max_digits=12, decimal_places=6)
+        if connections[queryset.db].vendor != "postgresql":
+            # unindexed fallback for databases without tsvector/pg_trgm
+            return queryset.filter(
+                Q(title__icontains=query) | Q(description__icontains=query) | Q(origin_name__icontains=query)
+            ).annotate(
+                search_rank=Case(
+                    When(origin_name__istartswith=query, then=Value(Decimal(1))),
+                    default=Value(Decimal(0)),
+                    output_field=rank_field,
+                )
+            )
+        return queryset.annotate(
+            search_match=RawSQL(
+                SEARCH_MATCH_SQL, (query, _escape_like(query) + "%", query), output_field=BooleanField()
+            ),
+            search_rank=RawSQL(SEARCH_RANK_SQL, (query, query), output_field=rank_field),
+        ).filter(search_match=True)
@@ -1,9 +1,12 @@
 # python imports
 import json
+import uuid
+import contextvars
+import datetime
 import logging
 
 # django imports
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.db.models.manager import Manager
 
 # app imports
@@ -13,8 +16,10 @@ from application.users.services import UserAppServices
 from infrastructure.logger.models import AttributeLogger
 
 # local imports
-from .models import File, FileID, FileFactory
+from .models import File, FileID, FileFactory, FileMetaData
 from .services import FileServices
+from .replicas import ReplicaSelector
+from . import partitioning
 from . import tests_helper as th
 
 log = AttributeLogger(logging.getLogger(__name__))
@@ -47,14 +52,12 @@ class FileTests(TestCase):
                 "test.png",
                 "https://dev-general-bucket.s3.amazonaws.com/media/Teser/test.png",
                 "active",
-                json.dumps(
-                    {
-                        "height": 100,
-                        "width": 100,
-                        "mime_type": "image/png",
-                        "filesize_in_bytes": 2000,
-                    }
-                ),
+                {
+                    "height": 100,
+                    "width": 100,
+                    "mime_type": "image/png",
+                    "filesize_in_bytes": 2000,
+                },
             )
         except Exception:
             self.fail("Unexpected exception")
@@ -64,7 +67,124 @@ class FileTests(TestCase):
         self.assertEquals(len(mkts), 5)
 
 
+class FileMetaDataTests(TestCase):
+    def test_from_encoded_string(self):
+        data = {"height": 100, "width": 100, "mime_type": "image/png", "filesize_in_bytes": 2000}
+        meta = FileMetaData.from_value(json.dumps(json.dumps(data)))
+        self.assertEqual(meta.to_dict(), data)
+
+    def test_compact_dict(self):
+        meta = FileMetaData.from_value({"mime_type": "text/csv", "filesize_in_bytes": 20, "width": None})
+        self.assertEqual(meta.to_dict(), {"mime_type": "text/csv", "filesize_in_bytes": 20})
+
+    def test_empty_value(self):
+        self.assertIsNone(FileMetaData.from_value(""))
+        self.assertIsNone(FileMetaData.from_value(None))
+
+    def test_invalid_value(self):
+        with self.assertRaises(VOValidationExcpetion):
+            FileMetaData.from_value({"mime_type": "image/png", "filesize_in_bytes": 2000, "colour": "red"})
+        with self.assertRaises(VOValidationExcpetion):
+            FileMetaData.from_value({"mime_type": "image/png", "filesize_in_bytes": "2000"})
+
+
 class FileServicesTests(TestCase):
     def test_get_file_repo(self):
         repo = FileServices(log).get_file_repo()
         self.assertEquals(Manager, type(repo))
+
+    def test_filter_files(self):
+        uploader = "4c3b4b5e-0b8f-4a52-9d5b-2f1f2b1f5a11"
+        png_id, = th.TestFileFactory.create_files(1, uploader=uploader)
+        csv = File.objects.get(id=th.TestFileFactory.create_files(1, uploader=uploader)[0].value)
+        csv.origin_name = "report.csv"
+        csv.meta_data = {"mime_type": "text/csv", "filesize_in_bytes": 10}
+        csv.save()
+        deactivated = File.objects.get(id=th.TestFileFactory.create_files(1, uploader=uploader)[0].value)
+        deactivated.status = File.DEACTIVATED_STATUS
+        deactivated.save()
+        th.TestFileFactory.create_files(1)
+
+        file_services = FileServices(log)
+        self.assertEqual(
+            {f.id for f in file_services.filter_files(uploader=uploader)}, {png_id.value, csv.id}
+        )
+        self.assertEqual(
+            [f.id for f in file_services.filter_files(uploader=uploader, status=File.DEACTIVATED_STATUS)],
+            [deactivated.id],
+        )
+        self.assertEqual(
+            [f.id for f in file_services.filter_files(uploader=uploader, mime_type="text/csv")], [csv.id]
+        )
+        self.assertEqual(
+            [f.id for f in file_services.filter_files(uploader=uploader, name_prefix="report")], [csv.id]
+        )
+        self.assertFalse(
+            file_services.filter_files(uploader=uploader, created_after=csv.created_at + datetime.timedelta(days=1)).exists()
+        )
+
+
+class ReplicaSelectorTests(TestCase):
+    class Selector(ReplicaSelector):
+        lags = {}
+
+        def measure_lag(self, alias):
+            lag = self.lags[alias]
+            if isinstance(lag, Exception):
+                raise lag
+            return lag
+
+    def test_read_alias(self):
+        selector = self.Selector()
+        self.assertEqual(selector.read_alias(), selector.primary)
+        with override_settings(FILES_READ_REPLICAS=["replica_1", "replica_2"], FILES_REPLICA_LAG_CHECK_SECONDS=0):
+            selector.lags = {"replica_1": 0.5, "replica_2": 30.0}
+            self.assertEqual(selector.read_alias(), "replica_1")
+            # lagging or unreachable replicas fall back to the primary
+            selector.lags = {"replica_1": OSError("unreachable"), "replica_2": 30.0}
+            self.assertEqual(selector.read_alias(), selector.primary)
+
+    def test_read_your_writes(self):
+        user_id, other_user_id = uuid.uuid4(), uuid.uuid4()
+        selector = self.Selector()
+        selector.lags = {"replica": 0.0}
+
+        def write_then_read():
+            selector.pin(user_id)
+            return selector.read_alias(), selector.read_alias(other_user_id)
+
+        with override_settings(FILES_READ_REPLICAS=["replica"]):
+            self.assertEqual(contextvars.copy_context().run(write_then_read), (selector.primary, selector.primary))
+            # a later request of the writer is pinned through the cache, other users read from the replica
+            self.assertEqual(selector.read_alias(user_id), selector.primary)
+            self.assertEqual(selector.read_alias(other_user_id), "replica")
+
+
+class PartitioningTests(TestCase):
+    def test_monthly_partitions(self):
+        start = datetime.datetime(2025, 11, 17, 5, tzinfo=datetime.timezone.utc)
+        end = partitioning.add_months(partitioning.month_start(start), 2)
+        self.assertEqual(
+            [partitioning.partition_name("files_file", month) for month in partitioning.iter_months(start, end)],
+            ["files_file_p2025_11", "files_file_p2025_12", "files_file_p2026_01"],
+        )
+
+    def test_create_partition_keeps_idempotency_keys_of_moved_rows(self):
+        from django.db import IntegrityError, connection, transaction
+
+        table = File._meta.db_table
+        if not partitioning.is_partitioned(connection, table):
+            self.skipTest("the File table is only partitioned on postgres")
+        # far beyond the created partitions, the row lands in the default partition
+        month = datetime.datetime(2100, 1, 1, tzinfo=datetime.timezone.utc)
+        uploader = uuid.uuid4()
+        fields = dict(
+            uploader=uploader, title="t", description="d", origin_name="a.csv", location="a.csv", status="active"
+        )
+        fobj = File.objects.create(id=uuid.uuid4(), idempotency_key="stray", **fields)
+        File.objects.filter(id=fobj.id).update(created_at=month + datetime.timedelta(days=3))
+
+        self.assertTrue(partitioning.create_partition(connection, table, month))
+        self.assertIn(partitioning.partition_name(table, month), partitioning.list_partitions(connection, table))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            File.objects.create(id=uuid.uuid4(), idempotency_key="stray", **fields)
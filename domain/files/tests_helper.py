@@ -1,7 +1,7 @@
 # python imports
 import typing
-import json
 import uuid
+import random
 
 # django imports
 
@@ -12,42 +12,49 @@ from scripts.db_content_manager.data_generation_helpers import create_string
 # local imports
 from .models import File, FileID, FileFactory
 
-# TODO: set a constant random seed to get repeatable results
-def generate_random_file(user: User) -> File:
-    return FileFactory.build_entity_with_id(
+# a constant seed makes the generated files repeatable, larger datasets come from application.files.datasets
+RANDOM_SEED = 1234
+_random = random.Random(RANDOM_SEED)
+
+
+def random_file_id(rng: random.Random = None) -> FileID:
+    return FileID(uuid.UUID(int=(rng or _random).getrandbits(128), version=4))
+
+
+def generate_random_file(user: User, rng: random.Random = None) -> File:
+    rng = rng or _random
+    side = rng.choice((100, 640, 1024))
+    return FileFactory.build_entity(
+        random_file_id(rng),
         user.id,
         "Test Title",
         "Test Description",
         "test.png",
         "https://dev-general-bucket.s3.amazonaws.com/media/Teser/test.png",
         "active",
-        json.dumps(
-            {
-                "height": 100,
-                "width": 100,
-                "mime_type": "image/png",
-                "filesize_in_bytes": 2000,
-            }
-        ),
+        {
+            "height": side,
+            "width": side,
+            "mime_type": "image/png",
+            "filesize_in_bytes": rng.randint(1000, side * side * 4),
+        },
     )
 
 
-def generate_random_files(user: User, num_of_files: int) -> typing.List[File]:
-    files = []
-    for _ in range(num_of_files):
-        files.append(generate_random_file(user))
-    return files
+def generate_random_files(user: User, num_of_files: int, seed: int = None) -> typing.List[File]:
+    rng = random.Random(seed) if seed is not None else _random
+    return [generate_random_file(user, rng) for _ in range(num_of_files)]
 
 
-def create_file_data() -> dict:
+def create_file_data(uploader=None) -> dict:
     """
     Returns a dict to be used in instance creation or for testing purposes
     """
 
     random_str = create_string()
     data = dict(
-        id=FileID(uuid.uuid4()).value,
-        uploader="c13cce88-42e3-40a1-9402-abf7e2f0a297",
+        id=random_file_id().value,
+        uploader=uploader or "c13cce88-42e3-40a1-9402-abf7e2f0a297",
         title=f"Title {random_str}",
         description=f"Description {random_str}",
         origin_name=f"{random_str}.png",
@@ -59,20 +66,8 @@ def create_file_data() -> dict:
 
 
 class TestFileFactory():
-    def create_files(n: int = 5):
-
-        file_counter = 0
-        created_file_ids = []
-
-        for _ in range(n):
-            data = create_file_data()
-            new_instance = File(**data)
-            new_instance.save()
-
-            created_file_ids.append(FileID(new_instance.id))
-            file_counter += 1
-
-        print(
-            f'Created {file_counter} total files.')
-
-        return created_file_ids
\ No newline at end of file
+    def create_files(n: int = 5, uploader=None):
+        instances = File.objects.bulk_create(
+            [File(**create_file_data(uploader)) for _ in range(n)], batch_size=500
+        )
+        return [FileID(instance.id) for instance in instances]
\ No newline at end of file
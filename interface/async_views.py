@@ -0,0 +1,167 @@
+# python imports
+import logging
+
+# django imports
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.http.response import HttpResponseBase
+from django.utils.decorators import decorator_from_middleware_with_args
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+# app imports
+from domain.files.models import File
+from application.files.services import FileAppServices as fas
+from application.files.exceptions import FileUploadException, IdempotencyException
+from application.files.idempotency import IdempotencyStore, request_fingerprint
+from interface.access_control.middleware import UacMiddlewareWithLogger
+from infrastructure.logger.models import AttributeLogger
+
+# local imports
+from .upload_handlers import StreamingValidationUploadHandler
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+
+class AsyncFileView(View):
+    """
+    Base class for the ASGI file views. Each handler is a coroutine so a slow client or a slow storage
+    transfer only holds a pending task, never a worker thread.
+    Requests are authenticated with the DRF authentication classes and go through the same access control
+    as the file viewsets, both touch the database so they run in a thread before the handler.
+    """
+
+    access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
+
+    def initialize_request(self, request) -> Request:
+        return Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+
+    @access_control()
+    def get_file_app_services(self):
+        return fas(self.user_access_controller, self.log)
+
+    def authorize(self, request):
+        self.request = self.initialize_request(request)
+        try:
+            user = self.request.user
+        except exceptions.APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+        if not user.is_authenticated:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        return self.get_file_app_services()
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in self.http_method_names:
+            return await super().dispatch(request, *args, **kwargs)
+        authorized = await sync_to_async(self.authorize)(request)
+        if isinstance(authorized, HttpResponseBase):
+            return authorized
+        self.file_app_services = authorized
+        return await super().dispatch(self.request, *args, **kwargs)
+
+
+class AsyncFileServeView(AsyncFileView):
+    http_method_names = ["get"]
+
+    async def get(self, request, pk):
+        file_app_services = self.file_app_services
+        try:
+            fobj = await file_app_services.aget_file(request.user, pk)
+        except File.DoesNotExist:
+            return JsonResponse({"detail": "Not found."}, status=404)
+        await file_app_services.arecord_access(fobj)
+        return await file_app_services.afile_download_from_s3(
+            request.user,
+            fobj.location,
+            fobj.origin_name,
+            content_encoding=file_app_services.get_content_encoding(fobj),
+            accept_encoding=request.META.get("HTTP_ACCEPT_ENCODING"),
+        )
+
+
+class AsyncFileDownloadView(AsyncFileView):
+    http_method_names = ["post"]
+
+    async def post(self, request):
+        file_app_services = self.file_app_services
+        # json, form and multipart bodies are parsed like the sync download
+        data = await sync_to_async(lambda: request.data)()
+        try:
+            fobj = await file_app_services.aget_file(request.user, data["file_id"])
+        except (KeyError, File.DoesNotExist):
+            return JsonResponse({"detail": "Not found."}, status=404)
+        await file_app_services.arecord_access(fobj)
+        return await file_app_services.afile_download_from_s3(
+            request.user,
+            fobj.location,
+            fobj.origin_name,
+            content_encoding=file_app_services.get_content_encoding(fobj),
+            accept_encoding=request.META.get("HTTP_ACCEPT_ENCODING"),
+        )
+
+
+class AsyncFileUploadView(AsyncFileView):
+    """
+    Coroutine counterpart of FileUploadViewSet.create, with the same streaming validation of the body
+    and the same Idempotency-Key handling
+    """
+
+    http_method_names = ["post"]
+
+    def initialize_request(self, request) -> Request:
+        request.upload_handlers.insert(0, StreamingValidationUploadHandler(request))
+        return super().initialize_request(request)
+
+    async def post(self, request):
+        file_app_services = self.file_app_services
+
+        try:
+            # parsing the multipart body reads the spooled request body, keep it off the event loop
+            files, post = await sync_to_async(lambda: (request.FILES, request.POST))()
+        except FileUploadException as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        data = {
+            "upload_file": files.get("upload_file"),
+            "size_soft_limit_mb": post.get("size_soft_limit_mb"),
+            "file_type": post.get("file_type"),
+            "idempotency_key": request.headers.get("Idempotency-Key") or post.get("idempotency_key") or None,
+        }
+        if data["upload_file"] is None:
+            return JsonResponse({"upload_file": ["No file was submitted."]}, status=400)
+
+        async def upload():
+            upload_key, fobj = await file_app_services.aupload_file(data)
+            logger.debug(
+                "File created - upload_key {} and file_id {}".format(upload_key, fobj.id)
+            )
+            return {"upload_key": upload_key, "file_id": str(fobj.id)}
+
+        replayed = False
+        try:
+            if data["idempotency_key"] is None:
+                response_data = await upload()
+            else:
+                # retries with the same Idempotency-Key get the first response, concurrent ones wait for it
+                fingerprint = await sync_to_async(request_fingerprint, thread_sensitive=False)(
+                    request.user.id, "upload", {k: v for k, v in data.items() if k != "idempotency_key"}
+                )
+                response_data, replayed = await IdempotencyStore().arun(
+                    request.user.id, data["idempotency_key"], fingerprint, upload
+                )
+        except exceptions.ValidationError as e:
+            return JsonResponse({"detail": e.detail}, status=400)
+        except FileUploadException as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        except IdempotencyException as e:
+            return JsonResponse({"detail": str(e)}, status=409)
+
+        response = JsonResponse(response_data)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
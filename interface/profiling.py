@@ -0,0 +1,213 @@
+# python imports
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+
+# django imports
+from django.conf import settings
+
+# app imports
+from infrastructure.logger.models import AttributeLogger
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread at a fixed interval and aggregates the samples as collapsed stacks,
+    the input format of flamegraph.pl and speedscope
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="file-profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+
+class _ProfiledStream:
+    """
+    Streaming content that keeps the sampler on the thread producing it and calls finish once, when it is
+    exhausted or closed. Django closes it with the response, also when the client disconnects early.
+    """
+
+    def __init__(self, content, sampler: StackSampler, finish):
+        self._content = iter(content)
+        self._sampler = sampler
+        self._finish = finish
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # the server may iterate the body on another thread than the one that ran the view
+        self._sampler.thread_id = threading.get_ident()
+        try:
+            return next(self._content)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        finish, self._finish = self._finish, None
+        if finish is None:
+            return
+        try:
+            if hasattr(self._content, "close"):
+                self._content.close()
+        finally:
+            finish()
+
+
+# tracemalloc is process wide, only one request at a time traces its allocations
+_allocation_lock = threading.Lock()
+
+
+class ProfiledViewMixin:
+    """
+    Opt in per request profiling. A request is profiled when FILES_PROFILING_ENABLED is set and either
+    a staff user sends an "X-Profile: 1" header or it is picked by FILES_PROFILING_SAMPLE_RATE. The decision
+    is made after authentication. The CPU samples are written as a collapsed stack file next to a json file
+    with the request attributes and the top allocation sites, the profile id is returned in the
+    X-Profile-Id response header. Allocations are only traced for one request per process at a time.
+    Streaming responses are profiled until their content is exhausted or closed.
+    """
+
+    profiler = None
+
+    def should_profile(self, request) -> bool:
+        if not getattr(settings, "FILES_PROFILING_ENABLED", False):
+            return False
+        user = getattr(request, "user", None)
+        if request.META.get(PROFILE_HEADER) == "1" and getattr(user, "is_staff", False):
+            return True
+        sample_rate = getattr(settings, "FILES_PROFILING_SAMPLE_RATE", 0.0)
+        return sample_rate > 0 and random.random() < sample_rate
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not self.should_profile(request):
+            return
+        trace_allocations = _allocation_lock.acquire(blocking=False)
+        if trace_allocations and tracemalloc.is_tracing():
+            # traced by someone else, who may stop it at any time
+            _allocation_lock.release()
+            trace_allocations = False
+        if trace_allocations:
+            tracemalloc.start()
+        sampler = StackSampler(
+            threading.get_ident(), getattr(settings, "FILES_PROFILING_INTERVAL", 0.005)
+        )
+        sampler.start()
+        self.profiler = (sampler, trace_allocations, time.perf_counter())
+
+    def stop_profiler(self):
+        sampler, trace_allocations, started = self.profiler
+        self.profiler = None
+        duration = time.perf_counter() - started
+        sampler.stop()
+        snapshot, peak_memory = None, None
+        if trace_allocations:
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                _allocation_lock.release()
+        return duration, sampler, snapshot, peak_memory
+
+    def dispatch(self, request, *args, **kwargs):
+        self.profiler = None
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            if self.profiler is not None:
+                self.stop_profiler()
+            raise
+        if self.profiler is None:
+            return response
+
+        profile_id = uuid.uuid4().hex
+        # self.request is the authenticated DRF request
+        request = self.request
+        if response.streaming and not getattr(response, "is_async", False):
+            # the body of a streaming response is produced after the view returns, the profile ends with it
+            response.streaming_content = _ProfiledStream(
+                response.streaming_content, self.profiler[0], lambda: self.finish_profile(profile_id, request, response)
+            )
+            response[PROFILE_ID_HEADER] = profile_id
+            return response
+        if self.finish_profile(profile_id, request, response):
+            response[PROFILE_ID_HEADER] = profile_id
+        return response
+
+    def finish_profile(self, profile_id, request, response) -> bool:
+        profile = self.stop_profiler()
+        try:
+            self.write_profile(profile_id, request, response, *profile)
+        except OSError as e:
+            logger.warning("Profile {} could not be stored - {}".format(profile_id, e))
+            return False
+        return True
+
+    def write_profile(self, profile_id, request, response, duration, sampler, snapshot, peak_memory):
+        profile_dir = getattr(
+            settings, "FILES_PROFILING_DIR", os.path.join(tempfile.gettempdir(), "file-profiles")
+        )
+        os.makedirs(profile_dir, exist_ok=True)
+        log = getattr(self, "log", None)
+        attributes = {
+            "profile_id": profile_id,
+            "view": type(self).__name__,
+            "action": getattr(self, "action", None),
+            "method": request.method,
+            "path": request.path,
+            "status_code": response.status_code,
+            "duration_ms": duration * 1000,
+            "samples": sum(sampler.stacks.values()),
+            "peak_memory_kb": peak_memory / 1024 if peak_memory is not None else None,
+            "user_id": str(getattr(request.user, "id", "")),
+            "log_attributes": {
+                key: str(value) for key, value in getattr(log, "attributes", {}).items()
+            },
+            "top_allocations": [
+                {"site": str(stat.traceback), "size_kb": stat.size / 1024, "count": stat.count}
+                for stat in (snapshot.statistics("lineno")[:25] if snapshot is not None else [])
+            ],
+        }
+        with open(os.path.join(profile_dir, "{}.folded".format(profile_id)), "w") as folded_file:
+            folded_file.write(sampler.collapsed())
+        with open(os.path.join(profile_dir, "{}.json".format(profile_id)), "w") as json_file:
+            json.dump(attributes, json_file, indent=2)
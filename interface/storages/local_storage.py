@@ -0,0 +1,144 @@
+# python imports
+import os
+import mmap
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+from urllib.parse import urljoin, quote
+
+# django imports
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils._os import safe_join
+
+
+class MappedFile(File):
+    """
+    Read only file backed by a memory map, reads are served straight from the page cache
+    """
+
+    def __init__(self, path, name):
+        with open(path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # empty files can not be mapped
+                mapped = open(path, "rb")
+        super().__init__(mapped, name)
+        # File.size would return mmap.size, a method
+        self.size = size
+
+
+@deconstructible
+class LocalMediaStorage(Storage):
+    """
+    Local filesystem storage with the same key semantics as the S3 MediaStorage (keys are overwritten, not renamed).
+    Objects are spread over a two level sharded directory layout, uploads are written to a temporary
+    file and atomically renamed into place, open returns a real file so FileResponse can use sendfile
+    and open_mapped returns a memory mapped file for reads.
+    """
+
+    def __init__(self, location=None, base_url=None):
+        self.location = os.path.abspath(
+            location or getattr(settings, "FILES_LOCAL_STORAGE_ROOT", os.path.join(settings.BASE_DIR, "media"))
+        )
+        self.base_url = base_url or getattr(settings, "FILES_LOCAL_STORAGE_BASE_URL", "/media/")
+
+    def shard(self, name: str) -> str:
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], name)
+
+    def path(self, name: str) -> str:
+        return safe_join(self.location, self.shard(name))
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _open(self, name, mode="rb"):
+        return File(open(self.path(name), mode), name)
+
+    def open_mapped(self, name) -> File:
+        return MappedFile(self.path(name), name)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in content.chunks():
+                    tmp_file.write(chunk)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, names):
+        """
+        Deletes the objects and returns the names that could not be deleted, like an S3 multi-object delete
+        """
+        failed = []
+        for name in names:
+            try:
+                self.delete(name)
+            except OSError:
+                failed.append(name)
+        return failed
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def url(self, name):
+        return urljoin(self.base_url, quote(name))
+
+    def get_modified_time(self, name):
+        return datetime.fromtimestamp(os.path.getmtime(self.path(name)), tz=timezone.utc)
+
+    def listdir(self, path):
+        """
+        Lists the keys below path, the shard directories are not part of the key space
+        """
+        directories, files = set(), []
+        prefix = path.rstrip("/") + "/" if path else ""
+        for name in self.iter_keys(prefix):
+            rest = name[len(prefix):]
+            if "/" in rest:
+                directories.add(rest.split("/", 1)[0])
+            else:
+                files.append(rest)
+        return sorted(directories), sorted(files)
+
+    def iter_keys(self, prefix=""):
+        if not os.path.isdir(self.location):
+            return
+        for first in sorted(os.listdir(self.location)):
+            first_path = os.path.join(self.location, first)
+            if not os.path.isdir(first_path):
+                continue
+            for second in sorted(os.listdir(first_path)):
+                shard_root = os.path.join(first_path, second)
+                for dirpath, _, filenames in os.walk(shard_root):
+                    for filename in filenames:
+                        if filename.startswith(".upload-"):
+                            continue
+                        name = os.path.relpath(os.path.join(dirpath, filename), shard_root).replace(os.sep, "/")
+                        if name.startswith(prefix):
+                            yield name
@@ -1,17 +1,28 @@
 #python imports
+import io
+import os
+import gzip
+import zipfile
 import json
 import logging
+import tempfile
+import uuid
 
 # django imports
+from asgiref.sync import async_to_sync
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.urls import reverse
 from rest_framework.test import force_authenticate, APIRequestFactory
 from rest_framework.test import APITestCase
 
 # app imports
+from domain.files.models import File
 from domain.users.models import UserPersonalData, UserBasePermissions
 from application.users.services import UserAppServices
 from application.files.services import FileAppServices as fas
-from application.files.tests_helper import create_test_file
+from application.files.idempotency import IdempotencyStore
+from application.files.tests_helper import InMemoryStorageMixin, create_test_file
 from application.app_access_control.services import AppAccessControlServices
 from infrastructure.logger.models import AttributeLogger
 
@@ -33,15 +44,25 @@ COLLECTION_ACTIONS = {
 }
 
 
-class FileViewSetTest(APITestCase):
+class FileViewSetTest(InMemoryStorageMixin, APITestCase):
     @classmethod
     def setUpTestData(cls):
         cls.factory = APIRequestFactory()
         cls.file_resource_view = views.FileViewSet.as_view(RESOURCE_ACTIONS)
         cls.file_collection_view = views.FileViewSet.as_view(COLLECTION_ACTIONS)
         cls.file_upload_view = views.FileUploadViewSet.as_view({"post": "create"})
+        cls.file_batch_upload_view = views.FileUploadViewSet.as_view({"post": "batch"})
+        cls.file_extract_upload_view = views.FileUploadViewSet.as_view({"post": "extract"})
+        cls.resumable_collection_view = views.ResumableUploadViewSet.as_view({"post": "create"})
+        cls.resumable_resource_view = views.ResumableUploadViewSet.as_view(
+            {"get": "retrieve", "patch": "partial_update", "delete": "destroy"}
+        )
+        cls.resumable_finalize_view = views.ResumableUploadViewSet.as_view({"post": "finalize"})
         cls.file_download_view = views.FileDownloadViewSet.as_view({"post": "create"})
+        cls.file_bundle_view = views.FileDownloadViewSet.as_view({"post": "bundle"})
         cls.file_serve_view = views.FileViewSet.as_view({"get": "serve"})
+        cls.file_search_view = views.FileViewSet.as_view({"get": "search"})
+        cls.file_metrics_view = views.FileMetricsViewSet.as_view({"get": "list"})
 
         cls.u_data_01 = UserPersonalData(
             username="Teser",
@@ -60,7 +81,7 @@ class FileViewSetTest(APITestCase):
             "origin_name": "test.png",
             "location": "https://dev-general-bucket.s3.amazonaws.com/media/Teser/test.png",
             "status": "active",
-            "meta_data":json.dumps({'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000})
+            "meta_data":{'height':100,'width':100,'mime_type':'image/png','filesize_in_bytes':2000}
         }
 
         cls.file_app_services = fas(
@@ -106,6 +127,275 @@ class FileViewSetTest(APITestCase):
         response = self.file_upload_view(request)
         self.assertIs(response.status_code, 200)
 
+    def test_file_upload_idempotency_key(self):
+        responses = []
+        for content in (b"a,b\n1,2\n", b"a,b\n1,2\n", b"a,b\n3,4\n"):
+            request = self.factory.post(
+                "/api/v0/file/upload/",
+                {
+                    "upload_file": SimpleUploadedFile("test.csv", content, content_type="text/csv"),
+                    "file_type": "",
+                    "size_soft_limit_mb": "",
+                },
+                format="multipart",
+                HTTP_IDEMPOTENCY_KEY="test-upload-1",
+            )
+            force_authenticate(request, user=self.user_01)
+            responses.append(self.file_upload_view(request))
+
+        first, replay, conflict = responses
+        self.assertIs(first.status_code, 200)
+        self.assertIs(replay.status_code, 200)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(replay.data, first.data)
+        self.assertIs(conflict.status_code, 409)
+
+        self.assertEqual(
+            self.file_app_services.file_delete_s3(self.user_01, first.data["upload_key"]), True
+        )
+
+    def test_file_upload_idempotency_key_reused_after_ttl(self):
+        responses = []
+        for content in (b"a,b\n1,2\n", b"a,b\n3,4\n"):
+            request = self.factory.post(
+                "/api/v0/file/upload/",
+                {
+                    "upload_file": SimpleUploadedFile("test.csv", content, content_type="text/csv"),
+                    "file_type": "",
+                    "size_soft_limit_mb": "",
+                },
+                format="multipart",
+                HTTP_IDEMPOTENCY_KEY="test-upload-2",
+            )
+            force_authenticate(request, user=self.user_01)
+            responses.append(self.file_upload_view(request))
+            # the stored response expired
+            IdempotencyStore().cache.clear()
+
+        first, conflict = responses
+        self.assertIs(first.status_code, 200)
+        self.assertIs(conflict.status_code, 409)
+        self.assertEqual(
+            self.file_app_services.file_delete_s3(self.user_01, first.data["upload_key"]), True
+        )
+
+    def test_resumable_upload(self):
+        content = create_test_file(fmt="csv").read()
+        request = self.factory.post(
+            "/api/v0/file/upload/resumable/", {"filename": "test.csv"}, HTTP_UPLOAD_LENGTH=str(len(content))
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.resumable_collection_view(request)
+        self.assertIs(response.status_code, 201)
+        upload_id = response.data["upload_id"]
+
+        half = len(content) // 2
+        for offset, chunk in ((0, content[:half]), (half, content[half:])):
+            request = self.factory.patch(
+                "/api/v0/file/upload/resumable/{}/".format(upload_id),
+                chunk,
+                content_type="application/offset+octet-stream",
+                HTTP_UPLOAD_OFFSET=str(offset),
+            )
+            force_authenticate(request, user=self.user_01)
+            response = self.resumable_resource_view(request, pk=upload_id)
+            self.assertIs(response.status_code, 204)
+            self.assertEqual(response["Upload-Offset"], str(offset + len(chunk)))
+
+        # a repeated chunk for an offset that is already stored is rejected
+        request = self.factory.patch(
+            "/api/v0/file/upload/resumable/{}/".format(upload_id),
+            content[:half],
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET="0",
+        )
+        force_authenticate(request, user=self.user_01)
+        self.assertIs(self.resumable_resource_view(request, pk=upload_id).status_code, 409)
+
+        request = self.factory.post("/api/v0/file/upload/resumable/{}/finalize/".format(upload_id))
+        force_authenticate(request, user=self.user_01)
+        response = self.resumable_finalize_view(request, pk=upload_id)
+        self.assertIs(response.status_code, 200)
+
+        fobj = self.file_app_services.get_file(self.user_01, response.data["file_id"])
+        self.assertEqual(fobj.get_meta_data().filesize_in_bytes, len(content))
+        read_file = self.file_app_services.read_file_from_s3(
+            self.user_01, fobj.location, fobj.origin_name, fobj.get_meta_data().content_encoding
+        )
+        self.assertEqual(read_file.read(), content)
+        read_file.close()
+        self.assertEqual(
+            self.file_app_services.file_delete_s3(self.user_01, fobj.location), True
+        )
+
+    def test_file_upload_content_mismatch(self):
+        uploaded_file = SimpleUploadedFile(
+            "test_file_01.png", create_test_file(fmt="json").read(), content_type="image/png"
+        )
+        upload_params = {
+            "upload_file": uploaded_file,
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_upload_view(request)
+        self.assertIs(response.status_code, 400)
+
+    def test_file_upload_streaming_size_limit(self):
+        uploaded_file = SimpleUploadedFile(
+            "test_file_01.csv", b"a" * 1500000, content_type="text/csv"
+        )
+        upload_params = {
+            "upload_file": uploaded_file,
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/", upload_params, format="multipart", HTTP_X_SIZE_SOFT_LIMIT_MB="1"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_upload_view(request)
+        self.assertIs(response.status_code, 400)
+
+    def test_file_batch_upload(self):
+        upload_files = [
+            SimpleUploadedFile(
+                "test_file_{}.json".format(i),
+                create_test_file(fmt="json").read(),
+                content_type="application/json",
+            )
+            for i in range(3)
+        ]
+        upload_params = {
+            "upload_files": upload_files,
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/batch/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_batch_upload_view(request)
+        self.assertIs(response.status_code, 200)
+        self.assertEqual(len(response.data["files"]), 3)
+
+        for result in response.data["files"]:
+            self.assertEqual(result["status"], "uploaded")
+            self.assertEqual(
+                self.file_app_services.file_delete_s3(request.user, result["upload_key"]), True
+            )
+
+    def test_file_batch_upload_partial_failure(self):
+        upload_files = [
+            SimpleUploadedFile(
+                "test_file.json", create_test_file(fmt="json").read(), content_type="application/json"
+            ),
+            SimpleUploadedFile(
+                "test_file.csv", create_test_file(fmt="csv").read(), content_type="application/json"
+            ),
+        ]
+        upload_params = {
+            "upload_files": upload_files,
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/batch/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_batch_upload_view(request)
+        self.assertIs(response.status_code, 207)
+        uploaded, failed = response.data["files"]
+        self.assertEqual(uploaded["status"], "uploaded")
+        self.assertEqual(failed["status"], "failed")
+
+        self.assertEqual(
+            self.file_app_services.file_delete_s3(request.user, uploaded["upload_key"]), True
+        )
+
+    def test_file_batch_upload_unknown_type(self):
+        upload_files = [
+            SimpleUploadedFile(
+                "test_file.json", create_test_file(fmt="json").read(), content_type="application/json"
+            ),
+            SimpleUploadedFile("test_file.unknownext", b"data", content_type="application/octet-stream"),
+        ]
+        upload_params = {
+            "upload_files": upload_files,
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/batch/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_batch_upload_view(request)
+        # the unknown file fails alone, the request is not rejected
+        self.assertIs(response.status_code, 207)
+        uploaded, failed = response.data["files"]
+        self.assertEqual(uploaded["status"], "uploaded")
+        self.assertEqual(failed["status"], "failed")
+        self.assertEqual(failed["origin_name"], "test_file.unknownext")
+
+    def test_file_archive_upload(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("scans/test.json", create_test_file(fmt="json").read())
+            archive.writestr("scans/test.csv", create_test_file(fmt="csv").read())
+            archive.writestr("__MACOSX/scans/._test.csv", b"\x00\x05\x16\x07")
+        upload_params = {
+            "upload_file": SimpleUploadedFile(
+                "scans.zip", buffer.getvalue(), content_type="application/zip"
+            ),
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/extract/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_extract_upload_view(request)
+        self.assertIs(response.status_code, 200)
+        self.assertEqual(
+            [result["origin_name"] for result in response.data["files"]], ["test.json", "test.csv"]
+        )
+
+        fobj = self.file_app_services.get_file(self.user_01, response.data["files"][1]["file_id"])
+        self.assertEqual(fobj.get_meta_data().mime_type, "text/csv")
+        for result in response.data["files"]:
+            self.assertEqual(
+                self.file_app_services.file_delete_s3(request.user, result["upload_key"]), True
+            )
+
+    @override_settings(FILES_ARCHIVE_MAX_RATIO=2)
+    def test_file_archive_upload_ratio_limit(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("bomb.csv", b"a,b\n" * 100000)
+        upload_params = {
+            "upload_file": SimpleUploadedFile(
+                "bomb.zip", buffer.getvalue(), content_type="application/zip"
+            ),
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+
+        request = self.factory.post(
+            "/api/v0/file/upload/extract/", upload_params, format="multipart"
+        )
+        force_authenticate(request, user=self.user_01)
+        response = self.file_extract_upload_view(request)
+        self.assertIs(response.status_code, 400)
+
     def test_file_upload_file_type(self):
         # creating testing file
         test_file = create_test_file(fmt="json")
@@ -222,6 +512,84 @@ class FileViewSetTest(APITestCase):
             self.file_app_services.file_delete_s3(request.user, upload_key), True
         )
 
+    def test_file_upload_download_compressed(self):
+        content = b"file_test\r\nhello\r\nworld\r\n" * 1000
+        with override_settings(FILES_COMPRESS_AT_REST="gzip"):
+            upload_params = {
+                "upload_file": SimpleUploadedFile("test_file.csv", content, content_type="text/csv"),
+                "file_type": "",
+                "size_soft_limit_mb": "",
+            }
+            request = self.factory.post(
+                "/api/v0/file/upload/", upload_params, format="multipart"
+            )
+            force_authenticate(request, user=self.user_01)
+            response = self.file_upload_view(request)
+            self.assertIs(response.status_code, 200)
+            file_id = response.data["file_id"]
+
+            fobj = self.file_app_services.get_file(self.user_01, file_id)
+            self.assertEqual(fobj.meta_data["content_encoding"], "gzip")
+            self.assertEqual(fobj.meta_data["filesize_in_bytes"], len(content))
+
+            # clients accepting gzip get the stored bytes
+            request = self.factory.post(
+                "/api/v0/file/download/", {"file_id": file_id}, HTTP_ACCEPT_ENCODING="gzip, br"
+            )
+            force_authenticate(request, user=self.user_01)
+            response = self.file_download_view(request)
+            self.assertIs(response.status_code, 200)
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), content)
+
+            # other clients get the decompressed content
+            request = self.factory.post("/api/v0/file/download/", {"file_id": file_id})
+            force_authenticate(request, user=self.user_01)
+            response = self.file_download_view(request)
+            self.assertIs(response.status_code, 200)
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertEqual(b"".join(response.streaming_content), content)
+
+    def test_file_bundle_download(self):
+        upload_keys, file_ids = [], []
+        for fmt in ("json", "json", "csv"):
+            uploaded_file = SimpleUploadedFile(
+                "test.{}".format(fmt),
+                create_test_file(fmt=fmt).read(),
+                content_type="application/json" if fmt == "json" else "text/csv",
+            )
+            request = self.factory.post(
+                "/api/v0/file/upload/",
+                {"upload_file": uploaded_file, "file_type": "", "size_soft_limit_mb": ""},
+                format="multipart",
+            )
+            force_authenticate(request, user=self.user_01)
+            response = self.file_upload_view(request)
+            self.assertIs(response.status_code, 200)
+            upload_keys.append(response.data["upload_key"])
+            file_ids.append(response.data["file_id"])
+
+        request = self.factory.post("/api/v0/file/download/bundle/", {"file_ids": file_ids})
+        force_authenticate(request, user=self.user_01)
+        response = self.file_bundle_view(request)
+        self.assertIs(response.status_code, 200)
+
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["test.json", "test (1).json", "test.csv"])
+        self.assertEqual(archive.read("test.csv"), create_test_file(fmt="csv").read())
+
+        # Files of other users can not be bundled
+        other = File.objects.get(id=file_ids[0])
+        other.pk, other.uploader = uuid.uuid4(), uuid.uuid4()
+        other.save(force_insert=True)
+        request = self.factory.post("/api/v0/file/download/bundle/", {"file_ids": [file_ids[0], str(other.id)]})
+        force_authenticate(request, user=self.user_01)
+        response = self.file_bundle_view(request)
+        self.assertIs(response.status_code, 400)
+
+        for upload_key in upload_keys:
+            self.file_app_services.file_delete_s3(self.user_01, upload_key)
+
     def test_update_files(self):
         data = {
             "uploader": "c13cce88-42e3-40a1-9402-abf7e2f0a297",
@@ -245,6 +613,108 @@ class FileViewSetTest(APITestCase):
 
         self.assertIs(response.status_code, 200)
 
+    def test_list_files_profiled(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(
+            FILES_PROFILING_ENABLED=True, FILES_PROFILING_DIR=tmp_dir
+        ):
+            # only staff users can ask for a profile
+            request = self.factory.get("/api/v0/file/", HTTP_X_PROFILE="1")
+            force_authenticate(request, user=self.user_01)
+            response = self.file_collection_view(request)
+            self.assertIs(response.status_code, 200)
+            self.assertFalse(response.has_header("X-Profile-Id"))
+
+            self.user_01.is_staff = True
+            request = self.factory.get("/api/v0/file/", HTTP_X_PROFILE="1")
+            force_authenticate(request, user=self.user_01)
+            response = self.file_collection_view(request)
+
+            self.assertIs(response.status_code, 200)
+            profile_id = response["X-Profile-Id"]
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "{}.folded".format(profile_id))))
+            with open(os.path.join(tmp_dir, "{}.json".format(profile_id))) as fh:
+                self.assertEqual(json.load(fh)["view"], "FileViewSet")
+
+    def test_metrics_staff_only(self):
+        request = self.factory.get("/api/v0/file/metrics/")
+        response = self.file_metrics_view(request)
+        self.assertIn(response.status_code, (401, 403))
+
+        request = self.factory.get("/api/v0/file/metrics/")
+        force_authenticate(request, user=self.user_01)
+        response = self.file_metrics_view(request)
+        self.assertIs(response.status_code, 403)
+
+        self.user_01.is_staff = True
+        request = self.factory.get("/api/v0/file/metrics/")
+        force_authenticate(request, user=self.user_01)
+        response = self.file_metrics_view(request)
+        self.assertIs(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    def test_file_serve_profiled_until_streamed(self):
+        content = create_test_file(fmt="json").read()
+        request = self.factory.post(
+            "/api/v0/file/upload/",
+            {
+                "upload_file": SimpleUploadedFile("test_file.json", content, content_type="application/json"),
+                "file_type": "",
+                "size_soft_limit_mb": "",
+            },
+            format="multipart",
+        )
+        force_authenticate(request, user=self.user_01)
+        file_id = self.file_upload_view(request).data["file_id"]
+
+        self.user_01.is_staff = True
+        with tempfile.TemporaryDirectory() as tmp_dir, override_settings(
+            FILES_PROFILING_ENABLED=True, FILES_PROFILING_DIR=tmp_dir
+        ):
+            request = self.factory.get("/api/v0/{}/serve/".format(file_id), HTTP_X_PROFILE="1")
+            force_authenticate(request, user=self.user_01)
+            response = self.file_serve_view(request, pk=file_id)
+            self.assertIs(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            profile_path = os.path.join(tmp_dir, "{}.json".format(response["X-Profile-Id"]))
+            # the profile covers the body, it is written once the body was streamed
+            self.assertFalse(os.path.exists(profile_path))
+            self.assertEqual(b"".join(response.streaming_content), content)
+            response.close()
+            self.assertTrue(os.path.exists(profile_path))
+
+    def test_search_files(self):
+        data = {
+            "description": "Test Description",
+            "location": "https://dev-general-bucket.s3.amazonaws.com/media/Teser/test.csv",
+            "status": "active",
+            "meta_data": {"mime_type": "text/csv", "filesize_in_bytes": 2000},
+        }
+        file_ids = set()
+        for i in range(3):
+            fobj = self.file_app_services.create_file_from_dict(
+                self.user_01, dict(data, title="Invoice {}".format(i), origin_name="invoice_{}.csv".format(i))
+            )
+            file_ids.add(fobj.id)
+        self.file_app_services.create_file_from_dict(
+            self.user_01, dict(data, title="Report", origin_name="report.csv")
+        )
+
+        found, cursor = set(), None
+        for expected in (2, 1):
+            params = {"q": "invoice", "page_size": 2}
+            if cursor:
+                params["cursor"] = cursor
+            request = self.factory.get("/api/v0/file/search/", params)
+            force_authenticate(request, user=self.user_01)
+            response = self.file_search_view(request)
+            self.assertIs(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), expected)
+            found.update(str(result["id"]) for result in response.data["results"])
+            cursor = response.data["next_cursor"]
+
+        self.assertIsNone(cursor)
+        self.assertEqual(found, {str(file_id) for file_id in file_ids})
+
     def test_retrieve_file_dummy_data(self):
         request = self.factory.get("/api/v0/file/{}".format(self.fkt.id))
         force_authenticate(request, user=self.user_01)
@@ -271,4 +741,92 @@ class FileViewSetTest(APITestCase):
         )
         force_authenticate(request, user=self.user_01)
         response = self.file_upload_view(request)
-        self.assertIs(response.status_code, 200)
\ No newline at end of file
+        self.assertIs(response.status_code, 200)
+
+
+@override_settings(ROOT_URLCONF="interface.urls")
+class AsyncFileViewTest(InMemoryStorageMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.u_data_01 = UserPersonalData(
+            username="Teser",
+            first_name="Testerman",
+            last_name="Testerson",
+            email="testerman@example.com",
+        )
+        cls.u_permissions_01 = UserBasePermissions(is_staff=False, is_active=False)
+        cls.user_01 = UserAppServices.create_user(cls.u_data_01, cls.u_permissions_01)
+
+        cls.file_app_services = fas(
+            AppAccessControlServices(cls.user_01).get_access_controller(),
+            log.with_attributes(user_id=cls.user_01.id)
+        )
+
+    def read_body(self, response):
+        async def read_body():
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        return async_to_sync(read_body)()
+
+    def test_async_file_upload_serve(self):
+        test_file = create_test_file(fmt="json")
+        content = test_file.read()
+        upload_params = {
+            "upload_file": SimpleUploadedFile("test_file.json", content, content_type="application/json"),
+            "file_type": "",
+            "size_soft_limit_mb": "",
+        }
+        # requests without credentials never reach the handlers
+        response = self.client.post(reverse("async-file-upload"), upload_params, format="multipart")
+        self.assertEqual(response.status_code, 401)
+
+        self.client.force_authenticate(user=self.user_01)
+        upload_params["upload_file"].seek(0)
+        response = self.client.post(reverse("async-file-upload"), upload_params, format="multipart")
+        self.assertIs(response.status_code, 200)
+        data = json.loads(response.content)
+
+        response = self.client.get(reverse("async-file-serve", kwargs={"pk": data["file_id"]}))
+        self.assertIs(response.status_code, 200)
+        self.assertEqual(self.read_body(response), content)
+
+        # the download takes a json body like the sync download
+        response = self.client.post(reverse("async-file-download"), {"file_id": data["file_id"]}, format="json")
+        self.assertIs(response.status_code, 200)
+        self.assertEqual(self.read_body(response), content)
+
+        self.assertEqual(
+            self.file_app_services.file_delete_s3(self.user_01, data["upload_key"]), True
+        )
+
+    def test_async_file_upload_validation_and_idempotency(self):
+        self.client.force_authenticate(user=self.user_01)
+        # the streaming handler rejects the body before it is spooled, like the sync upload
+        response = self.client.post(
+            reverse("async-file-upload") + "?size_soft_limit_mb=1",
+            {"upload_file": SimpleUploadedFile("big.csv", b"a,b\n" * 300000, content_type="text/csv")},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        responses = []
+        for content in (b"a,b\n1,2\n", b"a,b\n1,2\n", b"a,b\n3,4\n"):
+            responses.append(
+                self.client.post(
+                    reverse("async-file-upload"),
+                    {
+                        "upload_file": SimpleUploadedFile("test.csv", content, content_type="text/csv"),
+                        "file_type": "",
+                        "size_soft_limit_mb": "",
+                    },
+                    format="multipart",
+                    HTTP_IDEMPOTENCY_KEY="async-upload-1",
+                )
+            )
+        first, replay, conflict = responses
+        self.assertIs(first.status_code, 200)
+        self.assertIs(replay.status_code, 200)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(json.loads(replay.content), json.loads(first.content))
+        self.assertIs(conflict.status_code, 409)
+        self.assertEqual(File.objects.filter(uploader=self.user_01.id, idempotency_key="async-upload-1").count(), 1)
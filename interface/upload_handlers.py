@@ -0,0 +1,90 @@
+# python imports
+import logging
+
+# django imports
+from django.core.files.uploadhandler import FileUploadHandler
+
+# app imports
+from application.files.services import FileAppServices as fas, SIZE_HARD_LIMIT_MB
+from application.files.exceptions import FileUploadException
+from application.files.sniffing import SNIFF_BYTES, content_matches
+from infrastructure.logger.models import AttributeLogger
+
+logger = AttributeLogger(logging.getLogger(__name__))
+
+SOFT_LIMIT_HEADER = "HTTP_X_SIZE_SOFT_LIMIT_MB"
+
+
+class StreamingValidationUploadHandler(FileUploadHandler):
+    """
+    First handler of the upload chain. It enforces the size limits and sniffs the content type while
+    the bytes arrive, so oversized or mislabelled files are rejected before the next handler buffers them.
+    The soft limit is read from the X-Size-Soft-Limit-Mb header or the size_soft_limit_mb query parameter,
+    the form field of the same name is only known after the file and is still checked by file_validation.
+    Batch uploads only enforce the size limits here so that a mislabelled or unknown file fails alone in
+    file_validation.
+    """
+
+    def __init__(self, request=None, sniff_content=True):
+        super().__init__(request)
+        self.sniff_content = sniff_content
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.limit_bytes = SIZE_HARD_LIMIT_MB * 1000000
+        size_soft_limit_mb = META.get(SOFT_LIMIT_HEADER) or self.request.GET.get("size_soft_limit_mb")
+        if size_soft_limit_mb:
+            try:
+                self.limit_bytes = min(self.limit_bytes, int(size_soft_limit_mb) * 1000000)
+            except ValueError:
+                raise FileUploadException(
+                    "file-upload-exception",
+                    "size_soft_limit_mb is not valid - {}".format(size_soft_limit_mb),
+                )
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = b""
+        self.sniffed = not self.sniff_content
+        if not self.sniff_content:
+            # an unknown type in a batch is reported for that file by file_validation
+            return
+        try:
+            self.mime_type = fas(None, logger).get_mime_type(self.file_name)["mime_type"]
+        except KeyError:
+            raise FileUploadException(
+                "file-upload-exception", "File type not permitted - {}".format(self.file_name)
+            )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit_bytes:
+            logger.warning(
+                "Upload {} aborted - more than {} bytes".format(self.file_name, self.limit_bytes)
+            )
+            raise FileUploadException(
+                "file-upload-exception",
+                "File size not permitted - more than {} MB".format(self.limit_bytes // 1000000),
+            )
+        if not self.sniffed:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self.check_content()
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not self.sniffed:
+            self.check_content()
+        # the next handler builds the uploaded file
+        return None
+
+    def check_content(self):
+        self.sniffed = True
+        if not content_matches(self.mime_type, self.head):
+            logger.warning(
+                "Upload {} aborted - content does not match {}".format(self.file_name, self.mime_type)
+            )
+            raise FileUploadException(
+                "file-upload-exception",
+                "File content does not match its type - {}".format(self.mime_type),
+            )
@@ -1,14 +1,31 @@
+from django.urls import path
 from rest_framework_nested import routers
 
 from . import views
+from . import async_views
 
 file_pattern = r"file"
 file_upload_pattern = r"file/upload"
+file_resumable_upload_pattern = r"file/upload/resumable"
 file_download_pattern = r"file/download"
+file_metrics_pattern = r"file/metrics"
 
 router = routers.SimpleRouter()
+router.register(
+    file_resumable_upload_pattern, views.ResumableUploadViewSet, basename="file/upload/resumable"
+)
 router.register(file_upload_pattern, views.FileUploadViewSet, basename="file/upload")
 router.register(
     file_download_pattern, views.FileDownloadViewSet, basename="file/download"
 )
+router.register(file_metrics_pattern, views.FileMetricsViewSet, basename="file/metrics")
 router.register(file_pattern, views.FileViewSet, basename="file")
+
+# coroutine views, only non-blocking when served through ASGI
+async_urlpatterns = [
+    path("async/file/upload/", async_views.AsyncFileUploadView.as_view(), name="async-file-upload"),
+    path("async/file/download/", async_views.AsyncFileDownloadView.as_view(), name="async-file-download"),
+    path("async/file/<uuid:pk>/serve/", async_views.AsyncFileServeView.as_view(), name="async-file-serve"),
+]
+
+urlpatterns = router.urls + async_urlpatterns
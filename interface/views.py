@@ -2,7 +2,10 @@
 import logging
 
 # django imports
+from django.http import HttpResponse
+from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
 from drf_spectacular.utils import extend_schema_view
@@ -12,6 +15,10 @@ from django.utils.decorators import decorator_from_middleware_with_args
 # app imports
 from lib.django.custom_views import ListUpdateRetrieveViewSet
 from application.files.services import FileAppServices as fas
+from application.files.instrumentation import metrics
+from application.files.exceptions import FileUploadException, IdempotencyException
+from application.files.idempotency import IdempotencyStore, request_fingerprint
+from application.files.resumable import ResumableUploadAppServices
 from interface.access_control.middleware import UacMiddlewareWithLogger
 from infrastructure.logger.models import AttributeLogger
 
@@ -19,6 +26,8 @@ from infrastructure.logger.models import AttributeLogger
 
 # local imports
 from . import open_api
+from .profiling import ProfiledViewMixin
+from .upload_handlers import StreamingValidationUploadHandler
 from .serializers import FileSerializer
 from .serializer_upload import UploadSerializer
 from .serializer_download import DownloadSerializer
@@ -29,7 +38,7 @@ logger = AttributeLogger(logging.getLogger(__name__))
 @extend_schema_view(
     list=open_api.file_list_extension, serve=open_api.file_serve_extension
 )
-class FileViewSet(ListUpdateRetrieveViewSet):
+class FileViewSet(ProfiledViewMixin, ListUpdateRetrieveViewSet):
     """
     Allows clients to perform retrieve and list Files
     """
@@ -39,10 +48,49 @@ class FileViewSet(ListUpdateRetrieveViewSet):
 
     access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
 
+    list_filters = (
+        "status",
+        "created_after",
+        "created_before",
+        "modified_after",
+        "modified_before",
+        "mime_type",
+        "name_prefix",
+    )
+
     @access_control()
     def get_queryset(self):
         file_app_services = fas(self.user_access_controller, self.log)
-        return file_app_services.list_files(self.request.user)
+        filters = {}
+        if self.action == "list":
+            filters = self.get_list_filters()
+        # rows that are updated are read from the primary
+        for_update = self.request.method not in SAFE_METHODS
+        return file_app_services.list_files(self.request.user, filters, for_update=for_update)
+
+    def list(self, request, *args, **kwargs):
+        if "cursor" in request.query_params or "page_size" in request.query_params:
+            return self.list_page(request)
+        return super().list(request, *args, **kwargs)
+
+    @access_control()
+    def list_page(self, request):
+        file_app_services = fas(self.user_access_controller, self.log)
+        files, next_cursor = file_app_services.list_files_page(
+            request.user,
+            cursor=request.query_params.get("cursor"),
+            page_size=request.query_params.get("page_size"),
+            filters=self.get_list_filters(),
+        )
+        serializer = self.get_serializer(files, many=True)
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
+
+    def get_list_filters(self):
+        return {
+            key: self.request.query_params.get(key)
+            for key in self.list_filters
+            if key in self.request.query_params
+        }
 
     @access_control()
     def get_serializer_context(self):
@@ -61,20 +109,51 @@ class FileViewSet(ListUpdateRetrieveViewSet):
         file_app_services = fas(self.user_access_controller, self.log)
         # get id of file from request
         fobj = file_app_services.get_file(request.user, pk)
+        file_app_services.record_access(fobj)
         response = file_app_services.file_download_from_s3(
-            request.user, fobj.location, fobj.origin_name
+            request.user,
+            fobj.location,
+            fobj.origin_name,
+            content_encoding=file_app_services.get_content_encoding(fobj),
+            accept_encoding=request.META.get("HTTP_ACCEPT_ENCODING"),
         )
         return response
 
+    @access_control()
+    @action(detail=False, methods=["get"], name="search")
+    def search(self, request):
+        file_app_services = fas(self.user_access_controller, self.log)
+        files, next_cursor = file_app_services.search_files(
+            request.user,
+            request.query_params.get("q"),
+            cursor=request.query_params.get("cursor"),
+            page_size=request.query_params.get("page_size"),
+            filters=self.get_list_filters(),
+        )
+        serializer = self.get_serializer(files, many=True)
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
 
-class FileUploadViewSet(ViewSet):
+
+class FileUploadViewSet(ProfiledViewMixin, ViewSet):
     serializer_class = UploadSerializer
     parser_classes = (MultiPartParser,)
 
     access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
 
-    # def dispatch(self, request, *args, **kwargs):
-    #     return super().dispatch(request, *args, **kwargs)
+    def initialize_request(self, request, *args, **kwargs):
+        # validate while the body streams in, ahead of the handlers that spool the upload
+        sniff_content = self.action_map.get(request.method.lower()) == "create"
+        request.upload_handlers.insert(
+            0, StreamingValidationUploadHandler(request, sniff_content=sniff_content)
+        )
+        return super().initialize_request(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, FileUploadException):
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if isinstance(exc, IdempotencyException):
+            return Response({"detail": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
 
     @access_control()
     def create(self, request):
@@ -84,20 +163,166 @@ class FileUploadViewSet(ViewSet):
         data = {
             "upload_file":request.FILES.get("upload_file"),
             "size_soft_limit_mb": request.data.get("size_soft_limit_mb"),
-            "file_type":request.data.get("file_type")
+            "file_type":request.data.get("file_type"),
+            "idempotency_key": request.headers.get("Idempotency-Key") or request.data.get("idempotency_key") or None,
         }
 
-        upload_key, fobj = file_app_services.upload_file(data)
-        
-        response_data = {"upload_key": upload_key, "file_id": fobj.id}
+        def upload():
+            upload_key, fobj = file_app_services.upload_file(data)
+            logger.debug(
+                "File created - upload_key {} and file_id {}".format(upload_key, fobj.id)
+            )
+            return {"upload_key": upload_key, "file_id": fobj.id}
+
+        if data["idempotency_key"] is None:
+            return Response(upload())
+
+        # retries with the same Idempotency-Key get the first response, concurrent ones wait for it
+        fingerprint = request_fingerprint(
+            request.user.id, "upload", {k: v for k, v in data.items() if k != "idempotency_key"}
+        )
+        response_data, replayed = IdempotencyStore().run(
+            request.user.id, data["idempotency_key"], fingerprint, upload
+        )
+        response = Response(response_data)
+        if replayed:
+            response["Idempotent-Replayed"] = "true"
+        return response
+
+    @access_control()
+    @action(detail=False, methods=["post"], name="batch")
+    def batch(self, request):
+        file_app_services = fas(self.user_access_controller, self.log)
+
+        # get files from request
+        data = {
+            "upload_files": request.FILES.getlist("upload_files"),
+            "size_soft_limit_mb": request.data.get("size_soft_limit_mb"),
+            "file_type": request.data.get("file_type"),
+        }
+
+        results = file_app_services.upload_files(data)
+        logger.debug(
+            "Batch upload - {} of {} files created".format(
+                len([r for r in results if r["status"] == "uploaded"]), len(results)
+            )
+        )
+
+        if any(result["status"] == "failed" for result in results):
+            return Response({"files": results}, status=status.HTTP_207_MULTI_STATUS)
+        return Response({"files": results})
+
+    @access_control()
+    @action(detail=False, methods=["post"], name="extract")
+    def extract(self, request):
+        file_app_services = fas(self.user_access_controller, self.log)
+
+        # get archive from request
+        data = {
+            "upload_file": request.FILES.get("upload_file"),
+            "size_soft_limit_mb": request.data.get("size_soft_limit_mb"),
+            "file_type": request.data.get("file_type"),
+        }
+
+        results = file_app_services.upload_archive(data)
         logger.debug(
-            "File created - upload_key {} and file_id {}".format(upload_key, fobj.id)
+            "Archive upload - {} of {} members created".format(
+                len([r for r in results if r["status"] == "uploaded"]), len(results)
+            )
+        )
+
+        if any(result["status"] == "failed" for result in results):
+            return Response({"files": results}, status=status.HTTP_207_MULTI_STATUS)
+        return Response({"files": results})
+
+
+class ResumableUploadViewSet(ProfiledViewMixin, ViewSet):
+    """
+    Resumable uploads: POST announces the file (filename, Upload-Length), PATCH appends the raw request body
+    at Upload-Offset, HEAD/GET report the stored offset, finalize registers the File and DELETE aborts.
+    """
+
+    access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, FileUploadException):
+            status_code = {
+                "upload-session-not-found": status.HTTP_404_NOT_FOUND,
+                "upload-offset-mismatch": status.HTTP_409_CONFLICT,
+                "upload-session-complete": status.HTTP_409_CONFLICT,
+            }.get(exc.item, status.HTTP_400_BAD_REQUEST)
+            return Response({"detail": str(exc)}, status=status_code)
+        return super().handle_exception(exc)
+
+    def session_response(self, session, status_code=status.HTTP_200_OK):
+        response = Response(
+            {
+                "upload_id": session.upload_id,
+                "offset": session.offset,
+                "size": session.size,
+                "file_id": session.file_id,
+                "upload_key": session.upload_key,
+            },
+            status=status_code,
         )
+        response["Upload-Offset"] = str(session.offset)
+        response["Upload-Length"] = str(session.size)
+        response["Cache-Control"] = "no-store"
+        return response
 
-        return Response(response_data)
+    @access_control()
+    def create(self, request):
+        resumable_services = ResumableUploadAppServices(self.user_access_controller, self.log)
+        data = {
+            "filename": request.data.get("filename"),
+            "size": request.headers.get("Upload-Length") or request.data.get("size"),
+            "file_type": request.data.get("file_type"),
+            "size_soft_limit_mb": request.data.get("size_soft_limit_mb"),
+        }
+        session = resumable_services.create_session(request.user, data)
+        response = self.session_response(session, status.HTTP_201_CREATED)
+        response["Location"] = request.build_absolute_uri("{}/".format(session.upload_id))
+        return response
+
+    @access_control()
+    def retrieve(self, request, pk=None):
+        resumable_services = ResumableUploadAppServices(self.user_access_controller, self.log)
+        return self.session_response(resumable_services.get_session(request.user, pk))
 
+    @access_control()
+    def partial_update(self, request, pk=None):
+        resumable_services = ResumableUploadAppServices(self.user_access_controller, self.log)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            return Response({"detail": "Upload-Offset header is required"}, status=status.HTTP_400_BAD_REQUEST)
+        length = request.META.get("CONTENT_LENGTH")
+        # the body is read straight from the wsgi stream, it never goes through the parsers
+        session = resumable_services.append_chunk(
+            request.user, pk, offset, request._request, int(length) if length else None
+        )
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response["Upload-Offset"] = str(session.offset)
+        return response
 
-class FileDownloadViewSet(ViewSet):
+    @access_control()
+    def destroy(self, request, pk=None):
+        resumable_services = ResumableUploadAppServices(self.user_access_controller, self.log)
+        resumable_services.abort(request.user, pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @access_control()
+    @action(detail=True, methods=["post"], name="finalize")
+    def finalize(self, request, pk=None):
+        resumable_services = ResumableUploadAppServices(self.user_access_controller, self.log)
+        session = resumable_services.finalize(request.user, pk)
+        logger.debug(
+            "File created - upload_key {} and file_id {}".format(session.upload_key, session.file_id)
+        )
+        return self.session_response(session)
+
+
+class FileDownloadViewSet(ProfiledViewMixin, ViewSet):
     serializer_class = DownloadSerializer
 
     access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
@@ -107,7 +332,41 @@ class FileDownloadViewSet(ViewSet):
         file_app_services = fas(self.user_access_controller, self.log)
         # get id of file from request
         fobj = file_app_services.get_file(request.user, request.data["file_id"])
+        file_app_services.record_access(fobj)
         response = file_app_services.file_download_from_s3(
-            request.user, fobj.location, fobj.origin_name
+            request.user,
+            fobj.location,
+            fobj.origin_name,
+            content_encoding=file_app_services.get_content_encoding(fobj),
+            accept_encoding=request.META.get("HTTP_ACCEPT_ENCODING"),
         )
         return response
+
+    @access_control()
+    @action(detail=False, methods=["post"], name="bundle")
+    def bundle(self, request):
+        file_app_services = fas(self.user_access_controller, self.log)
+        # get ids of files from request
+        if hasattr(request.data, "getlist"):
+            file_ids = request.data.getlist("file_ids")
+        else:
+            file_ids = request.data.get("file_ids", [])
+        return file_app_services.bundle_files(
+            request.user, file_ids, request.data.get("archive_format", "zip")
+        )
+
+
+class FileMetricsViewSet(ViewSet):
+    """
+    Exposes the file service metrics in the prometheus text format, to staff users only
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    access_control = decorator_from_middleware_with_args(UacMiddlewareWithLogger)
+
+    @access_control()
+    def list(self, request):
+        return HttpResponse(
+            metrics.render_prometheus(), content_type="text/plain; version=0.0.4"
+        )